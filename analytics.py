@@ -0,0 +1,279 @@
+"""
+Leaderboard, trend and projection figures over the activity logs.
+
+Each user's log is held as NumPy columns (timestamp, points, activity code,
+completions: more than 1 for rollups, see retention) and summarized with
+array operations: totals, points per week, completions per activity and
+runs of active days. Columns and summaries are only
+updated for users whose log changed (StateStore.changes_since), new
+completions are appended to the columns, and the report combines the cached
+per-user summaries; the report itself is cached per store version.
+
+Days and weeks are local calendar days; weeks start on Monday. Weekly
+rollups count as activity on the first day of their week.
+"""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from history import local_day, week_start
+from leveling import calculate_level
+
+# Activity code of level-up bonus entries
+BONUS = -1
+TREND_WEEKS = 12
+# Days of history behind the points-per-day rate used for projections
+RATE_DAYS = 28
+TOP_ACTIVITIES = 10
+
+
+def days_to_reach(remaining, rate):
+    """
+    Days until remaining points are earned at rate points/day (NaN when
+    nothing was earned lately)
+    """
+    return np.where(rate > 0, np.ceil(remaining / np.where(rate > 0, rate, 1)), np.nan)
+
+
+def padded_sum(vectors, length):
+    total = np.zeros(length, np.int64)
+    for vector in vectors:
+        total[:len(vector)] += vector.astype(np.int64)
+    return total
+
+
+class LogColumns:
+    """
+    Activity logs as NumPy columns with a summary per user, updated when that
+    user's log changes: new entries at the end are appended to the columns,
+    any other change (a delete, a backdated entry, a rollup) rebuilds them
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.version = None
+        # Activity id (or the name, for entries of activities deleted before
+        # they had ids) -> code
+        self.codes = {}
+        self._users = {}
+        # user -> the entries the columns were built from
+        self._entries = {}
+        # user -> (columns, day, summary)
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def _columns(self, logs):
+        codes = self.codes
+        n = len(logs)
+        return (
+            np.fromiter((e["timestamp"] for e in logs), np.int64, n),
+            np.fromiter((e["points"] for e in logs), np.int64, n),
+            np.fromiter(
+                (BONUS if "level" in e else codes.setdefault(e.get("activity_id") or e.get("activity"), len(codes))
+                 for e in logs),
+                np.int32, n
+            ),
+            np.fromiter((e.get("count", 1) for e in logs), np.int64, n)
+        )
+
+    def _updated(self, user, logs):
+        old = self._entries.get(user)
+        # List comparison checks identity first, so an unchanged prefix
+        # costs a pointer comparison per entry
+        if old is None or len(logs) < len(old) or logs[:len(old)] != old:
+            return self._columns(logs)
+        if len(logs) == len(old):
+            return self._users[user]
+        return tuple(
+            np.concatenate((column, new)) for column, new in zip(self._users[user], self._columns(logs[len(old):]))
+        )
+
+    def refresh(self):
+        """
+        Bring the columns up to date with the store; returns the store
+        version they reflect
+        """
+        store = self.store
+        with self._lock:
+            with store.lock:
+                version = store.version
+                if version == self.version:
+                    return version
+                changes = store.changes_since(self.version)
+                if changes is None:
+                    self._users.clear()
+                    self._entries.clear()
+                changed = {topic.split(":", 1)[1] for topic in changes or () if topic.startswith("activity_logs:")}
+                # Copy the lists so the conversion can run without the lock
+                stale = {
+                    user: list(logs) for user, logs in store.activity_logs.items()
+                    if user not in self._users or user in changed
+                }
+                for user in list(self._users):
+                    if user not in store.activity_logs:
+                        del self._users[user]
+                        del self._entries[user]
+            for user, logs in stale.items():
+                self._users[user] = self._updated(user, logs)
+                self._entries[user] = logs
+            self.version = version
+            return version
+
+    def summaries(self, users, offset, today):
+        """
+        Summary dict per user (see _summarize), recomputed only for users
+        whose log or local day changed
+        """
+        result = []
+        day = (offset, today)
+        with self._lock:
+            for user in users:
+                columns = self._users.get(user) or self._columns([])
+                cached = self._summaries.get(user)
+                if cached is None or cached[0] is not columns or cached[1] != day:
+                    cached = (columns, day, self._summarize(columns, offset, today))
+                    self._summaries[user] = cached
+                result.append(cached[2])
+        return result
+
+    @staticmethod
+    def _summarize(columns, offset, today):
+        timestamps, points, codes, completions = columns
+        days = local_day(timestamps, offset)
+        completed = codes != BONUS
+        this_week = week_start(today)
+        first_week = this_week - 7 * (TREND_WEEKS - 1)
+        recent_weeks = days >= first_week
+
+        active_days = np.unique(days[completed])
+        if len(active_days):
+            starts = np.flatnonzero(np.r_[True, active_days[1:] != active_days[:-1] + 1])
+            runs = np.diff(np.r_[starts, len(active_days)])
+            last_run_end, last_run, best_run = active_days[-1], runs[-1], runs.max()
+        else:
+            last_run_end, last_run, best_run = 0, 0, 0
+        return {
+            "earned": int(points.sum()),
+            "this_week": int(points[days >= this_week].sum()),
+            "recent": int(points[days > today - RATE_DAYS].sum()),
+            "completions": int(completions[completed].sum()),
+            "weekly": np.bincount((week_start(days[recent_weeks]) - first_week) // 7,
+                                  points[recent_weeks], TREND_WEEKS),
+            "activity_counts": np.bincount(codes[completed], completions[completed]),
+            "activity_points": np.bincount(codes[completed], points[completed]),
+            # A streak is current if its last day is today or yesterday
+            "streak": int(last_run) if last_run_end >= today - 1 else 0,
+            "best_streak": int(best_run)
+        }
+
+
+class LogAnalytics:
+    rate_days = RATE_DAYS
+
+    def __init__(self, store):
+        self.store = store
+        self.columns = LogColumns(store)
+        self._report = None
+        self._lock = threading.Lock()
+
+    def activity_names(self):
+        """
+        Display name for each activity code
+        """
+        store = self.store
+        retired = store.bank["retired_activities"]
+        names = {}
+        for key, code in list(self.columns.codes.items()):
+            activity = store.activity(key)
+            names[code] = activity["name"] if activity is not None else retired.get(key, key)
+        return names
+
+    def report(self, now=None):
+        """
+        Dict of DataFrames: leaderboard, weekly, activities, level_projection
+        and dream_projection. Cached until the store changes or the day ends.
+        """
+        now = time.time() if now is None else now
+        offset = time.localtime(now).tm_gmtoff
+        today = local_day(int(now), offset)
+        version = self.columns.refresh()
+        with self._lock:
+            if self._report is not None and self._report[0] == (version, today):
+                return self._report[1]
+            report = self._compute(offset, today)
+            self._report = ((version, today), report)
+            return report
+
+    def _compute(self, offset, today):
+        store = self.store
+        users = list(store.users)
+        summaries = self.columns.summaries(users, offset, today)
+
+        def column(key):
+            return np.array([s[key] for s in summaries], np.int64)
+
+        # ---- Leaderboard ----
+        balances = np.array(
+            [store.user_banks.get(user, {}).get("activity_points", 0) for user in users], np.int64
+        )
+        levels = [calculate_level(int(b)) for b in balances]
+        leaderboard = pd.DataFrame({
+            "User": users,
+            "Level": [level for level, _, _ in levels],
+            "Points": balances,
+            "Earned": column("earned"),
+            "This week": column("this_week"),
+            "Completions": column("completions"),
+            "Current streak": column("streak"),
+            "Best streak": column("best_streak")
+        }).sort_values(["Level", "Points"], ascending=False, kind="stable").reset_index(drop=True)
+
+        # ---- Points per user per week ----
+        this_week = week_start(today)
+        weekly = pd.DataFrame(
+            np.array([s["weekly"] for s in summaries], np.int64).reshape(len(users), TREND_WEEKS).T,
+            columns=users,
+            index=pd.to_datetime(np.arange(this_week - 7 * (TREND_WEEKS - 1), this_week + 1, 7),
+                                 unit="D").rename("Week")
+        )
+
+        # ---- Most completed activities ----
+        names = self.activity_names()
+        counts = padded_sum((s["activity_counts"] for s in summaries), len(names))
+        totals = padded_sum((s["activity_points"] for s in summaries), len(names))
+        top = np.argsort(-counts, kind="stable")[:TOP_ACTIVITIES]
+        top = top[counts[top] > 0]
+        activities = pd.DataFrame({
+            "Activity": [names.get(int(code), "?") for code in top],
+            "Completions": counts[top],
+            "Points": totals[top]
+        })
+
+        # ---- Projections ----
+        rate = column("recent") / RATE_DAYS
+        remaining = np.array([needed - in_level for _, in_level, needed in levels], np.float64)
+        level_projection = pd.DataFrame({
+            "User": users,
+            "Points/day": rate.round(1),
+            "Points to next level": remaining.astype(np.int64),
+            "Days to next level": days_to_reach(remaining, rate)
+        })
+        open_dreams = [d for d in store.dreams if d["cost"] > store.dream_bank]
+        needed = np.array([d["cost"] - store.dream_bank for d in open_dreams], np.float64)
+        dream_projection = pd.DataFrame({
+            "Dream": [d["name"] for d in open_dreams],
+            "Cost": [d["cost"] for d in open_dreams],
+            "Points needed": needed.astype(np.int64),
+            # Assumes the points everyone earns reach the dream bank
+            "Days": days_to_reach(needed, rate.sum())
+        }).sort_values("Points needed", kind="stable").reset_index(drop=True)
+
+        return {
+            "leaderboard": leaderboard,
+            "weekly": weekly,
+            "activities": activities,
+            "level_projection": level_projection,
+            "dream_projection": dream_projection
+        }
@@ -0,0 +1,246 @@
+"""
+Read-only JSON API over the app's data, for dashboards and scripts.
+
+Runs as its own process next to the Streamlit app and reads through the
+same storage layer and state store, so it never sees a half-written file.
+Every response carries an ETag derived from the stored data's version;
+clients that send it back in If-None-Match get a 304 without a body until
+something changes.
+
+    GET /api/health
+    GET /api/groups
+    GET /api/users                     balances and levels
+    GET /api/users/<name>              balance, level and treats
+    GET /api/users/<name>/log          activity log, newest first (?page=1&page_size=25)
+    GET /api/dreams                    dreams and the Dream Bank
+    GET /api/activities
+
+Every path except /api/health and /api/groups takes ?group=<name> (default
+group otherwise).
+
+    python api.py [--port 8548] [--host 0.0.0.0]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import history
+import service
+import tenants
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+DEFAULT_PORT = int(os.getenv("API_PORT", "8548"))
+MAX_PAGE_SIZE = max(history.PAGE_SIZES)
+
+logger = logging.getLogger("treatsdreams.api")
+
+
+class NotFound(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+# ---- Data ----
+class Groups:
+    """
+    One service (and state store) per group partition, opened on first use
+    """
+
+    def __init__(self, data_dir, backend=None):
+        self.data_dir = data_dir
+        self.backend = backend
+        self._services = {}
+        self._lock = threading.Lock()
+
+    def get(self, group):
+        if group not in tenants.list_groups(self.data_dir):
+            raise NotFound(f"Group '{group}' not found.")
+        with self._lock:
+            if group not in self._services:
+                self._services[group] = service.TreatsDreamsService.open(
+                    tenants.partition_dir(self.data_dir, group), self.backend, read_only=True
+                )
+            app = self._services[group]
+        # Pick up changes saved by the app since the last request
+        app.store.sync()
+        return app
+
+
+def etag(app):
+    return '"' + hashlib.sha1(repr(app.store.storage_version).encode()).hexdigest()[:20] + '"'
+
+
+def user_summary(app, name):
+    points = app.store.user_banks.get(name, {}).get("activity_points", 0)
+    level, points_in_level, points_needed = app.level(name)
+    return {
+        "name": name,
+        "points": points,
+        "level": level,
+        "points_in_level": points_in_level,
+        "points_needed": points_needed
+    }
+
+
+def log_entry(store, entry):
+    data = {
+        "id": entry["id"],
+        "timestamp": entry["timestamp"],
+        "time": history.format_entry_time(entry),
+        "label": store.entry_label(entry),
+        "points": entry["points"]
+    }
+    for key in ("activity_id", "level", "count", "period"):
+        if key in entry:
+            data[key] = entry[key]
+    return data
+
+
+def int_param(query, name, default, minimum, maximum):
+    try:
+        value = int(query.get(name, [default])[0])
+    except ValueError:
+        raise BadRequest(f"{name} must be a number.") from None
+    if not minimum <= value <= maximum:
+        raise BadRequest(f"{name} must be between {minimum} and {maximum}.")
+    return value
+
+
+def users(app, query):
+    return [user_summary(app, name) for name in app.store.users]
+
+
+def user(app, query, name):
+    store = app.store
+    if name not in store.users:
+        raise NotFound(f"User '{name}' not found.")
+    return {
+        **user_summary(app, name),
+        "treats_purchased": store.treats_purchased(name),
+        "treats": store.user_banks.get(name, {}).get("treats", [])
+    }
+
+
+def user_log(app, query, name):
+    store = app.store
+    if name not in store.users:
+        raise NotFound(f"User '{name}' not found.")
+    user_history = store.history(name)
+    page_size = int_param(query, "page_size", history.DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    page_count = user_history.page_count(page_size)
+    page = int_param(query, "page", 1, 1, page_count)
+    return {
+        "user": name,
+        "total_points": user_history.total_points,
+        "entries_total": len(user_history),
+        "page": page,
+        "page_size": page_size,
+        "page_count": page_count,
+        "entries": [log_entry(store, entry) for entry in user_history.page(page - 1, page_size)]
+    }
+
+
+def dreams(app, query):
+    store = app.store
+    return {
+        "dream_bank": store.dream_bank,
+        "dreams": [
+            {"id": d["id"], "name": d["name"], "cost": d["cost"], "purchased_by": list(d["purchased_by"])}
+            for d in store.dreams
+        ]
+    }
+
+
+def activities(app, query):
+    return [{"id": a["id"], "name": a["name"], "points": a["points"]} for a in app.store.activities]
+
+
+# path parts after /api -> handler(app, query, *parameters)
+ROUTES = {
+    ("users",): users,
+    ("users", None): user,
+    ("users", None, "log"): user_log,
+    ("dreams",): dreams,
+    ("activities",): activities
+}
+
+
+def route(parts):
+    for pattern, handler in ROUTES.items():
+        if len(pattern) == len(parts) and all(p is None or p == part for p, part in zip(pattern, parts)):
+            return handler, [part for p, part in zip(pattern, parts) if p is None]
+    raise NotFound("No such endpoint.")
+
+
+# ---- HTTP ----
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "TreatsDreamsAPI/1.0"
+    groups = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        query = parse_qs(url.query)
+        try:
+            if parts[:1] != ["api"]:
+                raise NotFound("No such endpoint.")
+            parts = parts[1:]
+            if parts == ["health"]:
+                return self._send(200, {"status": "ok"})
+            if parts == ["groups"]:
+                return self._send(200, tenants.list_groups(self.groups.data_dir))
+            handler, parameters = route(parts)
+            app = self.groups.get(query.get("group", [tenants.DEFAULT_GROUP])[0])
+            with app.store.lock:
+                tag = etag(app)
+                if tag in self.headers.get("If-None-Match", ""):
+                    return self._send(304, None, tag)
+                body = handler(app, query, *parameters)
+            self._send(200, body, tag)
+        except NotFound as e:
+            self._send(404, {"error": str(e)})
+        except BadRequest as e:
+            self._send(400, {"error": str(e)})
+        except Exception:
+            logger.exception("api: %s failed", self.path)
+            self._send(500, {"error": "Internal error."})
+
+    def _send(self, status, body, tag=None):
+        data = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        if tag is not None:
+            self.send_header("ETag", tag)
+            self.send_header("Cache-Control", "no-cache")
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_server(data_dir, host="0.0.0.0", port=DEFAULT_PORT, backend=None):
+    handler = type("Handler", (ApiHandler,), {"groups": Groups(data_dir, backend)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read-only JSON API for Treats & Dreams")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--backend", default=None, help="json or sqlite (default: STORAGE_BACKEND)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(args.data_dir, exist_ok=True)
+    server = make_server(args.data_dir, args.host, args.port, args.backend)
+    print(f"Serving the Treats & Dreams API on http://{args.host}:{args.port}/api")
+    server.serve_forever()
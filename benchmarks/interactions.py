@@ -0,0 +1,134 @@
+"""
+Latency of common interactions on the main page: opening a treat's edit
+form, buying a treat and completing an activity.
+
+Each interaction is a widget click followed by the rerun it triggers, timed
+on a warm page (one full run in between, so every sample starts from the
+same page). Reruns that only redraw the affected sections show up here as
+shorter times than a full run of the page, which is timed as "full_rerun"
+for comparison.
+
+    python benchmarks/interactions.py
+    python benchmarks/interactions.py --samples 20 --app /path/to/other/tree/main.py
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from suite import generate_dataset, git_version, summarize, write_dataset  # noqa: E402
+
+INTERACTIONS = ("edit_treat", "buy_treat", "complete_activity")
+
+
+def child(app_path, samples):
+    """
+    Times every interaction samples times; prints the timings as JSON
+    """
+    # The app's own modules, not this tree's, when timing another checkout
+    sys.path.insert(0, os.path.dirname(os.path.abspath(app_path)))
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app_path, default_timeout=300)
+    at.run().run()
+    if at.exception:
+        raise SystemExit(at.exception[0].message)
+
+    def button(key=None, label=None):
+        for b in at.button:
+            if (key is None or b.key == key) and (label is None or b.label == label) and not b.disabled:
+                return b
+        raise SystemExit(f"no enabled button {key or label}")
+
+    def buyable_treat():
+        for b in at.button:
+            if b.key and b.key.startswith("buy_treat_") and not b.disabled:
+                return b
+        raise SystemExit("no treat left to buy")
+
+    def timed(click):
+        at.run()
+        widget = click()
+        start = time.perf_counter()
+        widget.click().run()
+        elapsed = time.perf_counter() - start
+        if at.exception:
+            raise SystemExit(at.exception[0].message)
+        return elapsed
+
+    def edit_treat():
+        treat_id = buyable_treat().key[len("buy_treat_"):]
+        # Close the form opened by the previous sample
+        at.session_state["editing_treat"] = None
+        return button(key=f"edit_treat_btn_{treat_id}")
+
+    timings = {name: [] for name in INTERACTIONS}
+    timings["full_rerun"] = []
+    for _ in range(samples):
+        timings["edit_treat"].append(timed(edit_treat))
+        timings["buy_treat"].append(timed(buyable_treat))
+        timings["complete_activity"].append(timed(lambda: button(label="Complete Activity")))
+        start = time.perf_counter()
+        at.run()
+        timings["full_rerun"].append(time.perf_counter() - start)
+    print(json.dumps(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--log-entries", type=int, default=2_000, help="activity log entries per user")
+    parser.add_argument("--treats", type=int, default=50, help="treats per user")
+    parser.add_argument("--dreams", type=int, default=50)
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--samples", type=int, default=10, help="clicks timed per interaction")
+    parser.add_argument("--app", default=os.path.join(ROOT, "main.py"), help="main.py to time")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.app, args.samples)
+
+    data_dir = tempfile.mkdtemp(prefix="treatsdreams-interactions-")
+    try:
+        write_dataset(data_dir, args.backend,
+                      generate_dataset(args.users, args.log_entries, args.treats, args.dreams))
+        env = dict(os.environ, DATA_DIR=data_dir, STORAGE_BACKEND=args.backend)
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--app", os.path.abspath(args.app),
+             "--samples", str(args.samples)],
+            env=env, capture_output=True, text=True, check=True
+        )
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "version": git_version(),
+        "app": os.path.abspath(args.app),
+        "dataset": {
+            "users": args.users,
+            "log_entries_per_user": args.log_entries,
+            "treats_per_user": args.treats,
+            "dreams": args.dreams,
+            "backend": args.backend
+        },
+        **{name: summarize(values) for name, values in timings.items()}
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
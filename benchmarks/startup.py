@@ -0,0 +1,123 @@
+"""
+Time to first render and rerun latency of main.py.
+
+Each sample starts a fresh interpreter, as a new server process would:
+Streamlit is imported first (the server has it loaded before any session
+connects), then the first run of main.py is timed, which includes importing
+the app's modules and loading the data. Warm reruns are then timed in the
+same process, once with the panels collapsed (the default page) and once
+with the Activity History, Analytics and Admin panels open.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --users 20 --log-entries 5000 --samples 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from suite import generate_dataset, git_version, summarize, write_dataset  # noqa: E402
+
+# Session state keys of the panels that only render while open
+PANELS = ("history_panel", "analytics_panel", "admin_panel")
+# Modules whose import the page should not pay for until they are needed
+HEAVY_MODULES = ("numpy", "pandas", "pyarrow")
+
+
+def child(reruns):
+    """
+    One sample; prints its timings as JSON
+    """
+    from streamlit.testing.v1 import AppTest
+
+    before = {name for name in HEAVY_MODULES if name in sys.modules}
+    at = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=300)
+    start = time.perf_counter()
+    at.run()
+    first_render = time.perf_counter() - start
+    if at.exception:
+        raise SystemExit(at.exception[0].message)
+    loaded = sorted(name for name in HEAVY_MODULES if name in sys.modules and name not in before)
+
+    def rerun(open_panels):
+        # AppTest has no browser to remember open panels; set them every run
+        for key in PANELS:
+            at.session_state[key] = open_panels
+        start = time.perf_counter()
+        at.run()
+        return time.perf_counter() - start
+
+    collapsed = [rerun(False) for _ in range(reruns)]
+    rerun(True)  # first open run imports and computes what the panels need
+    opened = [rerun(True) for _ in range(reruns)]
+    print(json.dumps({
+        "first_render": first_render,
+        "loaded_on_first_render": loaded,
+        "rerun": collapsed,
+        "rerun_panels_open": opened
+    }))
+
+
+def run_sample(data_dir, backend, reruns):
+    env = dict(os.environ, DATA_DIR=data_dir, STORAGE_BACKEND=backend)
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", "--reruns", str(reruns)],
+        env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--log-entries", type=int, default=2_000, help="activity log entries per user")
+    parser.add_argument("--treats", type=int, default=50, help="treats per user")
+    parser.add_argument("--dreams", type=int, default=50)
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--samples", type=int, default=3, help="fresh processes (first renders) to time")
+    parser.add_argument("--reruns", type=int, default=10, help="warm reruns timed per process and panel state")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.reruns)
+
+    data_dir = tempfile.mkdtemp(prefix="treatsdreams-startup-")
+    try:
+        write_dataset(data_dir, args.backend,
+                      generate_dataset(args.users, args.log_entries, args.treats, args.dreams))
+        samples = [run_sample(data_dir, args.backend, args.reruns) for _ in range(args.samples)]
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "version": git_version(),
+        "dataset": {
+            "users": args.users,
+            "log_entries_per_user": args.log_entries,
+            "treats_per_user": args.treats,
+            "dreams": args.dreams,
+            "backend": args.backend
+        },
+        "first_render": summarize([s["first_render"] for s in samples]),
+        "loaded_on_first_render": samples[0]["loaded_on_first_render"],
+        "rerun": summarize([t for s in samples for t in s["rerun"]]),
+        "rerun_panels_open": summarize([t for s in samples for t in s["rerun_panels_open"]])
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Concurrent session stress test for the storage layer.
+
+Runs N processes, each acting as a browser session for its own user, that
+complete activities and buy treats through the service against one
+temporary data directory. Every so often a session also edits an activity,
+saving its stale copy of the bank. At the end the stored balances, logs and
+purchases must equal the sum of every session's changes.
+
+    python benchmarks/stress_sessions.py --sessions 8 --ops 500 --backend json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import service  # noqa: E402
+import storage  # noqa: E402
+
+POINTS = 7
+TREAT_COST = 5
+
+
+def run_session(data_dir, backend, user, ops, result_queue):
+    app = service.TreatsDreamsService.open(data_dir, backend)
+    store = app.store
+    activity_id = store.activities[0]["id"]
+    # New users also get the default treats; buy only the ones added here
+    treat_ids = [treat["id"] for treat in store.user_banks[user]["treats"] if treat["name"] == "Stress"]
+    expected_points = 0
+    expected_logs = 0
+    dream_bank_delta = 0
+    for op in range(ops):
+        if op % 20 == 0:
+            # Pick up other sessions' changes now and then, so most catalog
+            # saves below come from a stale copy
+            store.sync()
+        if op % 5 == 4:
+            app.buy_treat(user, treat_ids[op // 5])
+            expected_points -= TREAT_COST
+            dream_bank_delta += TREAT_COST
+        else:
+            events = app.complete_activity(user, activity_id)
+            # Level-up bonuses are logged and paid out too
+            expected_points += sum(event["points"] for event in events)
+            expected_logs += len(events)
+        if op % 50 == 49:
+            # A stale full save must not wipe anyone's balances
+            app.edit_activity(activity_id, "Stress", POINTS)
+    store.flush()
+    result_queue.put((user, expected_points, expected_logs, dream_bank_delta))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=500, help="operations per session")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default=storage.DEFAULT_BACKEND)
+    args = parser.parse_args()
+
+    users = [f"user{i}" for i in range(args.sessions)]
+    with tempfile.TemporaryDirectory(prefix="treatsdreams-stress-") as data_dir:
+        app = service.TreatsDreamsService.open(data_dir, args.backend)
+        app.add_activity("Stress", POINTS)
+        for user in users:
+            app.add_user(user)
+            for _ in range(args.ops // 5):
+                app.add_treat(user, "Stress", TREAT_COST)
+        app.store.flush()
+
+        result_queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=run_session, args=(data_dir, args.backend, user, args.ops, result_queue))
+            for user in users
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        results = [result_queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        store = service.TreatsDreamsService.open(data_dir, args.backend).store
+        lost = {}
+        missing_logs = {}
+        lost_purchases = {}
+        for user, expected_points, expected_logs, _ in results:
+            actual = store.user_banks[user]["activity_points"]
+            if actual != expected_points:
+                lost[user] = expected_points - actual
+            logged = len(store.activity_logs.get(user, []))
+            if logged != expected_logs:
+                missing_logs[user] = expected_logs - logged
+            if store.treats_purchased(user) != args.ops // 5:
+                lost_purchases[user] = args.ops // 5 - store.treats_purchased(user)
+        dream_bank = store.dream_bank
+    expected_dream_bank = sum(delta for *_, delta in results)
+    total_ops = args.sessions * args.ops
+    report = {
+        "backend": args.backend,
+        "sessions": args.sessions,
+        "operations": total_ops,
+        "seconds": round(elapsed, 3),
+        "ops_per_second": round(total_ops / elapsed, 1),
+        "lost_points": lost,
+        "missing_log_entries": missing_logs,
+        "lost_purchases": lost_purchases,
+        "dream_bank": dream_bank,
+        "expected_dream_bank": expected_dream_bank
+    }
+    print(json.dumps(report, indent=2))
+    ok = not lost and not missing_logs and not lost_purchases and dream_bank == expected_dream_bank
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Benchmark suite for persistence, leveling and page render cost.
+
+Generates a synthetic dataset (many users, large activity logs, hundreds of
+treats and dreams), then measures:
+
+- save_bank / save_activity_logs / record_events latency per backend
+- startup load time (building the state store from disk)
+- cold start of the JSON backend with and without the binary snapshot
+- calculate_level throughput across point ranges
+- full-script rerun time of main.py with Streamlit's AppTest
+
+Results are printed (or written with --output) as JSON so runs can be
+compared between versions.
+
+    python benchmarks/suite.py
+    python benchmarks/suite.py --quick --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import catalog  # noqa: E402
+import history  # noqa: E402
+import leveling  # noqa: E402
+import snapshot  # noqa: E402
+import state_store  # noqa: E402
+import storage  # noqa: E402
+
+POINT_RANGES = [(0, 1_000), (1_000, 1_000_000), (1_000_000, 1_000_000_000)]
+
+
+# ---- Helpers ----
+def summarize(samples):
+    """
+    Latency stats in milliseconds for a list of durations in seconds
+    """
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3)
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---- Dataset ----
+def generate_dataset(users, log_entries, treats, dreams, seed=0):
+    """
+    Synthetic (users, bank, activity_logs) shaped like the app's data
+    """
+    rng = random.Random(seed)
+    names = [f"user{i:04d}" for i in range(users)]
+    activities = [
+        {"name": f"Activity {i}", "points": rng.randint(1, 30), "id": catalog.new_id()} for i in range(20)
+    ]
+    bank = {
+        "activities": activities,
+        "dreams": [
+            {"name": f"Dream {i}", "cost": rng.randint(50, 5_000),
+             "purchased_by": rng.sample(names, rng.randint(0, min(3, users))), "id": catalog.new_id()}
+            for i in range(dreams)
+        ],
+        "user_banks": {},
+        "dream_bank": rng.randint(0, 10_000),
+        "retired_activities": {}
+    }
+    activity_logs = {}
+    start = int(time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1)))
+    for name in names:
+        logs = []
+        points = 0
+        for i in range(log_entries):
+            activity = rng.choice(activities)
+            logs.append({"timestamp": start + i * 3_600, "points": activity["points"],
+                         "activity_id": activity["id"], "id": history.new_entry_id()})
+            points += activity["points"]
+        activity_logs[name] = logs
+        bank["user_banks"][name] = {
+            "activity_points": points,
+            "treats": [
+                {"name": f"Treat {i}", "cost": rng.randint(5, 200), "purchased": rng.random() < 0.3,
+                 "id": catalog.new_id()}
+                for i in range(treats)
+            ]
+        }
+    return names, bank, activity_logs
+
+
+def write_dataset(data_dir, backend, dataset):
+    users, bank, activity_logs = dataset
+    store = storage.get_storage(data_dir, backend)
+    store.save_users(users)
+    store.save_snapshot(bank, activity_logs)
+    return store
+
+
+# ---- Benchmarks ----
+def bench_persistence(backend, dataset, repeat):
+    data_dir = tempfile.mkdtemp(prefix=f"treatsdreams-bench-{backend}-")
+    try:
+        users, bank, activity_logs = dataset
+        store = write_dataset(data_dir, backend, dataset)
+        user = users[0]
+
+        def complete():
+            store.record_events([{
+                "type": "complete", "user": user, "id": history.new_entry_id(),
+                "timestamp": int(time.time()), "activity_id": bank["activities"][0]["id"], "points": 1
+            }], bank, activity_logs)
+
+        return {
+            "save_bank": timed(lambda: store.save_bank(bank, activity_logs), repeat),
+            "save_activity_logs": timed(lambda: store.save_activity_logs(activity_logs), repeat),
+            "record_events": timed(complete, repeat * 5),
+            "startup_load": timed(
+                lambda: state_store.StateStore(storage.get_storage(data_dir, backend)), repeat
+            ),
+            "data_bytes": sum(
+                os.path.getsize(os.path.join(data_dir, name)) for name in os.listdir(data_dir)
+            )
+        }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def bench_cold_start(dataset, repeat):
+    """
+    State store load time from JSON files alone vs. with the binary
+    activity log snapshot (SNAPSHOT_FORMAT=binary)
+    """
+    data_dir = tempfile.mkdtemp(prefix="treatsdreams-bench-snapshot-")
+    try:
+        write_dataset(data_dir, "json", dataset)
+        storage.JsonStorage(data_dir, binary_snapshot=True).save_activity_logs(dataset[2])
+        json_load = timed(lambda: state_store.StateStore(storage.JsonStorage(data_dir, binary_snapshot=False)), repeat)
+        binary_load = timed(lambda: state_store.StateStore(storage.JsonStorage(data_dir, binary_snapshot=True)), repeat)
+        return {
+            "json": json_load,
+            "binary_snapshot": binary_load,
+            "speedup": round(json_load["median_ms"] / binary_load["median_ms"], 2),
+            "activity_json_bytes": os.path.getsize(os.path.join(data_dir, "activity.json")),
+            "activity_bin_bytes": os.path.getsize(os.path.join(data_dir, snapshot.SNAPSHOT_FILE_NAME))
+        }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def bench_leveling(calls):
+    rng = random.Random(1)
+    results = {}
+    for low, high in POINT_RANGES:
+        points = [rng.randrange(low, high) for _ in range(calls)]
+        calculate_level = leveling.calculate_level
+        start = time.perf_counter()
+        for p in points:
+            calculate_level(p)
+        elapsed = time.perf_counter() - start
+        results[f"{low}-{high}"] = {
+            "calls": calls,
+            "calls_per_second": round(calls / elapsed),
+            "ns_per_call": round(elapsed / calls * 1e9, 1)
+        }
+    return results
+
+
+def bench_rerun(backend, dataset, repeat):
+    """
+    First run and warm rerun time of main.py against the dataset
+    """
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return {"skipped": "streamlit is not installed"}
+
+    data_dir = tempfile.mkdtemp(prefix=f"treatsdreams-bench-app-{backend}-")
+    saved_env = {key: os.environ.get(key) for key in ("DATA_DIR", "STORAGE_BACKEND")}
+    try:
+        write_dataset(data_dir, backend, dataset)
+        os.environ["DATA_DIR"] = data_dir
+        os.environ["STORAGE_BACKEND"] = backend
+        at = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=300)
+        start = time.perf_counter()
+        at.run()
+        first_run = time.perf_counter() - start
+        if at.exception:
+            return {"error": str(at.exception[0].message)}
+        return {
+            "first_run_ms": round(first_run * 1000, 3),
+            "rerun": timed(at.run, repeat)
+        }
+    finally:
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--log-entries", type=int, default=2_000, help="activity log entries per user")
+    parser.add_argument("--treats", type=int, default=200, help="treats per user")
+    parser.add_argument("--dreams", type=int, default=300)
+    parser.add_argument("--backend", choices=["json", "sqlite", "all"], default="all")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--level-calls", type=int, default=200_000)
+    parser.add_argument("--quick", action="store_true", help="small dataset and few repeats, for a smoke run")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    if args.quick:
+        args.users, args.log_entries, args.treats, args.dreams = 10, 200, 20, 30
+        args.repeat, args.level_calls = 2, 20_000
+
+    backends = ["json", "sqlite"] if args.backend == "all" else [args.backend]
+    dataset = generate_dataset(args.users, args.log_entries, args.treats, args.dreams)
+    report = {
+        "version": git_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "dataset": {
+            "users": args.users,
+            "log_entries_per_user": args.log_entries,
+            "treats_per_user": args.treats,
+            "dreams": args.dreams
+        },
+        "persistence": {backend: bench_persistence(backend, dataset, args.repeat) for backend in backends},
+        "cold_start": bench_cold_start(dataset, args.repeat),
+        "leveling": bench_leveling(args.level_calls),
+        "rerun": {backend: bench_rerun(backend, dataset, args.repeat) for backend in backends}
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Stable ids for catalog records: activities, dreams and each user's treats.
+
+New records get a random id. Records saved before they had ids get one
+derived from their kind, position and name, so every process migrating the
+same data assigns the same ids.
+
+NameIndex searches a catalog by name; the state store keeps one per
+catalog until the catalog is edited.
+"""
+import bisect
+import hashlib
+import os
+
+
+def new_id():
+    return os.urandom(6).hex()
+
+
+def legacy_id(*parts):
+    return hashlib.sha1(":".join(str(p) for p in parts).encode()).hexdigest()[:12]
+
+
+def ensure_ids(records, kind, scope=""):
+    """
+    Give records without an id a deterministic one. Returns True if any
+    record changed.
+    """
+    changed = False
+    for position, record in enumerate(records):
+        if "id" not in record:
+            record["id"] = legacy_id(kind, scope, position, record.get("name"))
+            changed = True
+    return changed
+
+
+def index_by_id(records):
+    return {record["id"]: record for record in records}
+
+
+def position_of(records, record_id):
+    """
+    List position of the record with record_id, or None
+    """
+    for position, record in enumerate(records):
+        if record.get("id") == record_id:
+            return position
+    return None
+
+
+# ---- Search ----
+PAGE_SIZE = 20
+
+
+def _words(text):
+    return "".join(c if c.isalnum() else " " for c in text.lower()).split()
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class NameIndex:
+    """
+    Search index over record names. A query matches records whose name
+    contains every query term: terms of three or more characters match
+    anywhere in the name (trigram postings), shorter ones match the start
+    of a word (bisect over the sorted words). Matches keep list order.
+    """
+
+    def __init__(self, records):
+        self.records = list(records)
+        self._names = [str(record.get("name", "")).lower() for record in self.records]
+        self._words = sorted(
+            (word, position) for position, name in enumerate(self._names) for word in set(_words(name))
+        )
+        self._trigrams = {}
+        for position, name in enumerate(self._names):
+            for trigram in _trigrams(name):
+                self._trigrams.setdefault(trigram, set()).add(position)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _prefix(self, term):
+        start = bisect.bisect_left(self._words, (term,))
+        positions = set()
+        words = self._words
+        for i in range(start, len(words)):
+            word, position = words[i]
+            if not word.startswith(term):
+                break
+            positions.add(position)
+        return positions
+
+    def _substring(self, term):
+        postings = sorted((self._trigrams.get(t, set()) for t in _trigrams(term)), key=len)
+        candidates = set.intersection(*postings) if postings else set()
+        return {position for position in candidates if term in self._names[position]}
+
+    def search(self, query):
+        """
+        Records matching query, in list order (all of them for a blank query)
+        """
+        positions = None
+        for term in query.lower().split():
+            found = self._substring(term) if len(term) >= 3 else self._prefix(term)
+            positions = found if positions is None else positions & found
+            if not positions:
+                return []
+        if positions is None:
+            return list(self.records)
+        return [self.records[position] for position in sorted(positions)]
+
+
+def page_of(records, page, page_size=PAGE_SIZE):
+    """
+    (records on 1-based page, page count), clamping page to the last one
+    """
+    page_count = max(1, -(-len(records) // page_size))
+    page = min(max(page, 1), page_count)
+    return records[(page - 1) * page_size:page * page_size], page_count
@@ -0,0 +1,327 @@
+"""
+Streaming export of activity logs, balances, treats and dreams.
+
+In the app, rows are read from the shared state store a chunk at a time,
+holding its lock only while a chunk is copied, and written out as CSV, JSON
+Lines or Parquet (with pyarrow installed) as they come, so an export never
+builds the whole table in memory and sessions keep running in between
+chunks. Activity logs can be limited to a date range; the start of the range
+is found by bisecting the timestamp-ordered log, so a daily export only
+reads the new tail.
+
+From the command line, rows are read straight from storage without loading
+the app's state: with SQLite a date range is one indexed query read a chunk
+at a time, with JSON the logs are filtered as they are written out.
+
+    python export.py activity_logs [-o logs.csv] [--start 2024-06-01] [--end 2024-06-30]
+    python export.py balances --format jsonl [--user alice] [--group NAME]
+"""
+import argparse
+import bisect
+import csv
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import history
+import metrics
+import storage
+import tenants
+from leveling import calculate_level
+
+CHUNK_SIZE = 5_000
+
+COLUMNS = {
+    "activity_logs": ["user", "id", "timestamp", "time", "activity_id", "activity", "points",
+                      "level", "count", "period"],
+    "balances": ["user", "activity_points", "level", "treats_purchased", "dreams_purchased"],
+    "treats": ["user", "id", "name", "cost", "purchased"],
+    "dreams": ["user", "id", "name", "cost", "purchased"]
+}
+TABLES = list(COLUMNS)
+# Parquet column types; the other columns are strings
+INT_COLUMNS = {"timestamp", "points", "level", "count", "activity_points", "treats_purchased",
+               "dreams_purchased", "cost"}
+BOOL_COLUMNS = {"purchased"}
+EXTENSIONS = {"csv": "csv", "jsonl": "jsonl", "parquet": "parquet"}
+MIME_TYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+
+
+def formats():
+    """
+    Export formats available here; Parquet needs pyarrow
+    """
+    return ["csv", "jsonl"] + (["parquet"] if importlib.util.find_spec("pyarrow") else [])
+
+
+def day_start(day):
+    """
+    Epoch seconds at local midnight of a date or a "YYYY-MM-DD" string
+    """
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return int(time.mktime((day.year, day.month, day.day, 0, 0, 0, 0, 0, -1)))
+
+
+def day_range(start=None, end=None):
+    """
+    (start, end) epoch bounds covering the days start..end inclusive; either
+    may be None for an open end
+    """
+    if isinstance(end, str):
+        end = date.fromisoformat(end)
+    return (
+        None if start is None else day_start(start),
+        None if end is None else day_start(end + timedelta(days=1))
+    )
+
+
+# ---- Rows ----
+def log_row(user, entry, label):
+    """
+    Export row for a log entry; label(entry) gives the activity name
+    """
+    return {
+        "user": user,
+        "id": entry.get("id"),
+        "timestamp": history.to_epoch(entry["timestamp"]),
+        "time": history.format_entry_time(entry),
+        "activity_id": entry.get("activity_id"),
+        "activity": label(entry),
+        "points": entry["points"],
+        "level": entry.get("level"),
+        "count": entry.get("count"),
+        "period": entry.get("period")
+    }
+
+
+def log_chunks(store, user, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield lists of a user's log rows with start <= timestamp < end, oldest
+    first. Each chunk resumes after the last timestamp written, so entries
+    added or removed elsewhere in the log between chunks do not shift it.
+    """
+    last = None
+    written_at_last = 0
+    while True:
+        with store.lock:
+            index = store.history(user)
+            if last is None:
+                position = 0 if start is None else bisect.bisect_left(index.timestamps, start)
+            else:
+                position = bisect.bisect_left(index.timestamps, last) + written_at_last
+            stop = len(index.timestamps) if end is None else bisect.bisect_left(index.timestamps, end)
+            entries = index.entries[position:min(position + chunk_size, stop)]
+            rows = [log_row(user, entry, store.entry_label) for entry in entries]
+        if not rows:
+            return
+        for entry in entries:
+            if entry["timestamp"] == last:
+                written_at_last += 1
+            else:
+                last, written_at_last = entry["timestamp"], 1
+        yield rows
+
+
+def _user_rows(bank, table, user):
+    user_bank = bank.get("user_banks", {}).get(user, {})
+    if table == "balances":
+        points = user_bank.get("activity_points", 0)
+        return [{
+            "user": user,
+            "activity_points": points,
+            "level": calculate_level(points)[0],
+            "treats_purchased": sum(1 for t in user_bank.get("treats", []) if t.get("purchased", False)),
+            "dreams_purchased": sum(1 for d in bank.get("dreams", []) if user in d["purchased_by"])
+        }]
+    if table == "treats":
+        return [
+            {"user": user, "id": t.get("id"), "name": t["name"], "cost": t["cost"],
+             "purchased": bool(t.get("purchased", False))}
+            for t in user_bank.get("treats", [])
+        ]
+    return [
+        {"user": user, "id": d.get("id"), "name": d["name"], "cost": d["cost"], "purchased": user in d["purchased_by"]}
+        for d in bank.get("dreams", [])
+    ]
+
+
+def _check_table(table):
+    if table not in COLUMNS:
+        raise ValueError(f"Unknown table '{table}', expected one of: {', '.join(TABLES)}")
+
+
+def export_chunks(store, table, users=None, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield lists of row dicts (see COLUMNS) for table from a state store, per
+    user in user order. start and end (epoch seconds) only apply to
+    activity_logs.
+    """
+    _check_table(table)
+    with store.lock:
+        names = [name for name in store.users if users is None or name in users]
+    for user in names:
+        if table == "activity_logs":
+            yield from log_chunks(store, user, start, end, chunk_size)
+            continue
+        with store.lock:
+            rows = _user_rows(store.bank, table, user)
+        for i in range(0, len(rows), chunk_size):
+            yield rows[i:i + chunk_size]
+
+
+def stored_chunks(backend, table, users=None, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """
+    export_chunks() straight from a storage backend, without loading a state
+    store: activity logs come from Storage.log_chunks, which with SQLite
+    reads only the date range, and the other tables need only the bank.
+    """
+    _check_table(table)
+    names = [name for name in backend.load_users() if users is None or name in users]
+    bank = backend.load_bank()
+    if table != "activity_logs":
+        for user in names:
+            rows = _user_rows(bank, table, user)
+            for i in range(0, len(rows), chunk_size):
+                yield rows[i:i + chunk_size]
+        return
+    activities_by_id = {activity["id"]: activity for activity in bank.get("activities", []) if "id" in activity}
+    retired = bank.get("retired_activities", {})
+
+    def label(entry):
+        return history.entry_label(entry, activities_by_id, retired)
+
+    for user, entries in backend.log_chunks(names, start, end, chunk_size):
+        yield [log_row(user, entry, label) for entry in entries]
+
+
+# ---- Writers ----
+def write_csv(chunks, columns, f):
+    writer = csv.DictWriter(f, columns)
+    writer.writeheader()
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def write_jsonl(chunks, columns, f):
+    count = 0
+    for rows in chunks:
+        f.write("".join(json.dumps(row) + "\n" for row in rows))
+        count += len(rows)
+    return count
+
+
+def write_parquet(chunks, columns, f):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export needs pyarrow (pip install pyarrow).") from None
+    schema = pa.schema([
+        (name, pa.int64() if name in INT_COLUMNS else pa.bool_() if name in BOOL_COLUMNS else pa.string())
+        for name in columns
+    ])
+    count = 0
+    with pq.ParquetWriter(f, schema) as writer:
+        for rows in chunks:
+            # One row group per chunk
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            count += len(rows)
+        if not count:
+            writer.write_table(schema.empty_table())
+    return count
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "parquet": write_parquet}
+
+
+def write(chunks, table, fmt, f):
+    """
+    Write chunks of table rows to f (a text file for csv and jsonl, binary
+    for parquet) and return the number of rows
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown format '{fmt}', expected one of: {', '.join(WRITERS)}")
+    with metrics.timer(f"export.{table}"):
+        return WRITERS[fmt](chunks, COLUMNS[table], f)
+
+
+def export(store, table, fmt, f, users=None, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """
+    Write table from a state store to f and return the number of rows
+    """
+    return write(export_chunks(store, table, users, start, end, chunk_size), table, fmt, f)
+
+
+def export_file(store, table, fmt, users=None, start=None, end=None):
+    """
+    Export into an anonymous temporary file and return it rewound, as an
+    unbuffered binary file for a download button to read. Only the chunk
+    being written is held in memory.
+    """
+    f = tempfile.TemporaryFile(buffering=0)
+    buffered = io.BufferedWriter(f)
+    if fmt == "parquet":
+        export(store, table, fmt, buffered, users, start, end)
+    else:
+        text = io.TextIOWrapper(buffered, encoding="utf-8", newline="")
+        export(store, table, fmt, text, users, start, end)
+        text.detach()
+    # Detaching flushes and leaves f open when the wrappers are collected
+    buffered.detach()
+    f.seek(0)
+    return f
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export Treats & Dreams data")
+    parser.add_argument("table", choices=TABLES)
+    parser.add_argument("-o", "--output", help="file to write (default: stdout); the extension picks the format")
+    parser.add_argument("--format", choices=list(WRITERS), help="csv, jsonl or parquet (default: csv)")
+    parser.add_argument("--user", action="append", help="only this user; repeat for several")
+    parser.add_argument("--start", help="activity_logs from this day on (YYYY-MM-DD)")
+    parser.add_argument("--end", help="activity_logs up to and including this day (YYYY-MM-DD)")
+    parser.add_argument("--data-dir", default=os.getenv("DATA_DIR", "data"))
+    parser.add_argument("--group", default=tenants.DEFAULT_GROUP, help="group to export (default: default)")
+    parser.add_argument("--backend", default=None, help="json, sqlite or memory (default: STORAGE_BACKEND)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt is None and args.output:
+        extension = os.path.splitext(args.output)[1].lstrip(".").lower()
+        fmt = {ext: name for name, ext in EXTENSIONS.items()}.get(extension)
+    fmt = fmt or "csv"
+    if fmt == "parquet" and not args.output:
+        parser.error("Parquet exports need --output.")
+    try:
+        data_dir = tenants.partition_dir(args.data_dir, args.group)
+        start, end = day_range(args.start, args.end)
+    except ValueError as e:
+        parser.error(str(e))
+    if not os.path.isdir(data_dir):
+        parser.error(f"No data in {data_dir}.")
+
+    started = time.perf_counter()
+    try:
+        chunks = stored_chunks(storage.get_storage(data_dir, args.backend), args.table, args.user, start, end,
+                               args.chunk_size)
+        if fmt == "parquet":
+            with open(args.output, "wb") as f:
+                count = write(chunks, args.table, fmt, f)
+        elif args.output:
+            with open(args.output, "w", encoding="utf-8", newline="") as f:
+                count = write(chunks, args.table, fmt, f)
+        else:
+            count = write(chunks, args.table, fmt, sys.stdout)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Exported {count} {args.table} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
@@ -0,0 +1,179 @@
+"""
+Per-user activity history index.
+
+Wraps a user's activity log list, keeps it ordered by timestamp, looks
+entries up by their stable id and keeps the points total up to date, so the
+Activity History page never re-sorts or re-sums the whole log.
+
+Log entries look like
+    {"id": ..., "timestamp": <epoch seconds>, "points": 10, "activity_id": ...}
+with "level": N instead of activity_id for level-up bonuses. Entries saved
+before activities had ids carry the activity name as "activity" (and a
+formatted timestamp string) until normalize_entry() converts them. Rollups
+of old entries (see retention) add "count" and "period".
+"""
+import bisect
+import hashlib
+import os
+import re
+import time
+
+DEFAULT_PAGE_SIZE = 25
+PAGE_SIZES = [10, 25, 50, 100]
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+BONUS_LABEL = re.compile(r"LEVEL UP BONUS \(Level (\d+)\)$")
+
+
+def new_entry_id():
+    return os.urandom(6).hex()
+
+
+def to_epoch(timestamp):
+    """
+    Epoch seconds for an epoch or a local "%Y-%m-%d %H:%M:%S" string
+    """
+    if isinstance(timestamp, str):
+        return int(time.mktime(time.strptime(timestamp, TIMESTAMP_FORMAT)))
+    return int(timestamp)
+
+
+def local_day(timestamp, offset):
+    """
+    Local calendar day number (days since 1970-01-01) of epoch seconds, for
+    a UTC offset in seconds. Works on NumPy arrays too.
+    """
+    return (timestamp + offset) // 86400
+
+
+def week_start(day):
+    """
+    Day number of the Monday starting day's week. Works on NumPy arrays too.
+    """
+    # Day 0 (1970-01-01) was a Thursday
+    return day - (day + 3) % 7
+
+
+def format_timestamp(timestamp):
+    if isinstance(timestamp, str):
+        return timestamp
+    return time.strftime(TIMESTAMP_FORMAT, time.localtime(timestamp))
+
+
+def format_entry_time(entry):
+    """
+    The entry's timestamp, or for rollups the day or week they cover
+    """
+    period = entry.get("period")
+    if period is None:
+        return format_timestamp(entry["timestamp"])
+    day = time.strftime("%Y-%m-%d", time.localtime(entry["timestamp"]))
+    return f"week of {day}" if period == "week" else day
+
+
+def bonus_label(level):
+    return f"LEVEL UP BONUS (Level {level})"
+
+
+def entry_label(entry, activities_by_id, retired_activities):
+    """
+    Display name of a log entry: the activity's current name, the level
+    bonus, or the name the activity had when it was deleted
+    """
+    if "level" in entry:
+        return bonus_label(entry["level"])
+    activity_id = entry.get("activity_id")
+    activity = activities_by_id.get(activity_id)
+    if activity is not None:
+        return activity["name"]
+    return retired_activities.get(activity_id) or entry.get("activity", "Deleted activity")
+
+
+def normalize_entry(entry, user, position, activity_ids):
+    """
+    Convert an entry saved before activity ids in place: epoch timestamp,
+    activity_id (or level for bonuses) instead of the name, and a stable id.
+    activity_ids maps activity names to ids; names no longer in the catalog
+    are kept. Returns True if the entry changed.
+    """
+    changed = False
+    if "id" not in entry:
+        entry["id"] = hashlib.sha1(
+            f"{user}:{position}:{entry['timestamp']}:{entry.get('activity')}:{entry['points']}".encode()
+        ).hexdigest()[:12]
+        changed = True
+    if isinstance(entry["timestamp"], str):
+        entry["timestamp"] = to_epoch(entry["timestamp"])
+        changed = True
+    if "activity" in entry:
+        name = entry["activity"]
+        bonus = BONUS_LABEL.match(name) if isinstance(name, str) else None
+        if bonus:
+            entry["level"] = int(bonus.group(1))
+            del entry["activity"]
+            changed = True
+        elif name in activity_ids:
+            entry["activity_id"] = activity_ids[name]
+            del entry["activity"]
+            changed = True
+    return changed
+
+
+class HistoryIndex:
+    def __init__(self, entries):
+        # Sorting in place keeps the stored list in timestamp order; Timsort is
+        # linear on the already ordered logs the app appends
+        entries.sort(key=lambda e: e["timestamp"])
+        self.entries = entries
+        self.timestamps = [e["timestamp"] for e in entries]
+        self.by_id = {}
+        self.total_points = 0
+        for entry in entries:
+            if "id" not in entry:
+                entry["id"] = new_entry_id()
+            self.by_id[entry["id"]] = entry
+            self.total_points += entry["points"]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry):
+        """
+        Insert an entry at its timestamp position (the end for new entries)
+        """
+        if "id" not in entry:
+            entry["id"] = new_entry_id()
+        pos = bisect.bisect_right(self.timestamps, entry["timestamp"])
+        self.timestamps.insert(pos, entry["timestamp"])
+        self.entries.insert(pos, entry)
+        self.by_id[entry["id"]] = entry
+        self.total_points += entry["points"]
+        return entry
+
+    def remove(self, entry_id):
+        """
+        Remove an entry by id and return it, or None if it is not present
+        """
+        entry = self.by_id.pop(entry_id, None)
+        if entry is None:
+            return None
+        pos = bisect.bisect_left(self.timestamps, entry["timestamp"])
+        while self.entries[pos] is not entry:
+            # Entries sharing a timestamp sit next to each other
+            pos += 1
+        del self.timestamps[pos]
+        del self.entries[pos]
+        self.total_points -= entry["points"]
+        return entry
+
+    def page_count(self, page_size):
+        return max(1, -(-len(self.entries) // page_size))
+
+    def page(self, page, page_size):
+        """
+        Entries on a zero-based page, newest first
+        """
+        end = len(self.entries) - page * page_size
+        start = max(0, end - page_size)
+        if end <= 0:
+            return []
+        return self.entries[start:end][::-1]
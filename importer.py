@@ -0,0 +1,168 @@
+"""
+Bulk import of historical workouts.
+
+Reads CSV (header: user,activity,timestamp) or JSON Lines records one at a
+time and applies them in file order with the same points and level-up
+bonuses as the Complete Activity form. Records are committed to the shared
+state store in batches, and each batch is persisted as journal events (one
+SQLite transaction with that backend) before the next one is read, so
+memory use does not depend on the file size beyond the imported log itself,
+and changes the running app stores during the import are kept.
+
+    python importer.py history.csv [--data-dir data] [--group NAME] [--create-users]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime
+
+import service
+import tenants
+
+DEFAULT_BATCH_SIZE = 10_000
+# Error messages kept in the report; the rest are only counted
+MAX_ERRORS = 20
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+
+def format_for(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Unsupported file type '{ext}', expected one of: {', '.join(FORMATS)}")
+    return FORMATS[ext]
+
+
+def read_records(f, fmt):
+    """
+    Yield (line_number, record) from a text file; record is None for a line
+    that does not parse
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record if isinstance(record, dict) else None
+
+
+def parse_timestamp(value):
+    """
+    Epoch seconds for an ISO date/time (local time unless it has an offset)
+    """
+    return int(datetime.fromisoformat(str(value).strip()).timestamp())
+
+
+def _batches(records, batch_size):
+    batch = []
+    for item in records:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_records(app, records, batch_size=DEFAULT_BATCH_SIZE, create_users=False):
+    """
+    Apply (line_number, record) pairs through a TreatsDreamsService and
+    return a report dict. Invalid records are skipped and reported.
+    """
+    store = app.store
+    report = {"imported": 0, "bonuses": 0, "skipped": 0, "errors": []}
+
+    def reject(line_number, message):
+        report["skipped"] += 1
+        if len(report["errors"]) < MAX_ERRORS:
+            report["errors"].append(f"line {line_number}: {message}")
+
+    with store.deferred():
+        for batch in _batches(records, batch_size):
+            # Each batch is one commit; sessions can run between batches
+            with store.lock:
+                activities = {a["name"]: a for a in store.activities}
+                balances = {}
+                events = []
+                for line_number, record in batch:
+                    if record is None:
+                        reject(line_number, "not a valid record")
+                        continue
+                    user = str(record.get("user") or "").strip()
+                    activity_name = str(record.get("activity") or "").strip()
+                    if activity_name not in activities:
+                        reject(line_number, f"unknown activity '{activity_name}'")
+                        continue
+                    if user not in store.user_banks:
+                        if not create_users or not user:
+                            reject(line_number, f"unknown user '{user}'")
+                            continue
+                        app.add_user(user)
+                    try:
+                        timestamp = parse_timestamp(record.get("timestamp"))
+                    except ValueError:
+                        reject(line_number, f"invalid timestamp '{record.get('timestamp')}'")
+                        continue
+
+                    if user not in balances:
+                        balances[user] = store.user_banks[user]["activity_points"]
+                    completed = service.completion_events(
+                        user, activities[activity_name], balances[user], timestamp
+                    )
+                    for event in completed:
+                        balances[user] += event["points"]
+                    events.extend(completed)
+                    report["imported"] += 1
+                    report["bonuses"] += len(completed) - 1
+                if events:
+                    store.commit_events(events)
+                    store.persist_deferred()
+    return report
+
+
+def import_file(app, f, fmt, batch_size=DEFAULT_BATCH_SIZE, create_users=False):
+    """
+    Import from a text or binary file object (e.g. a Streamlit upload)
+    """
+    if isinstance(f, (io.RawIOBase, io.BufferedIOBase)) or "b" in getattr(f, "mode", ""):
+        f = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    return import_records(app, read_records(f, fmt), batch_size, create_users)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import historical workouts into Treats & Dreams")
+    parser.add_argument("file", help="CSV or JSON Lines file with user, activity and timestamp")
+    parser.add_argument("--data-dir", default=os.getenv("DATA_DIR", "data"))
+    parser.add_argument("--group", default=tenants.DEFAULT_GROUP, help="group to import into (default: default)")
+    parser.add_argument("--backend", default=None, help="json, sqlite or memory (default: STORAGE_BACKEND)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--create-users", action="store_true", help="add users that do not exist yet")
+    args = parser.parse_args()
+
+    try:
+        data_dir = tenants.partition_dir(args.data_dir, args.group)
+    except ValueError as e:
+        parser.error(str(e))
+    os.makedirs(data_dir, exist_ok=True)
+    started = datetime.now()
+    with open(args.file, "r", encoding="utf-8-sig", newline="") as f:
+        result = import_file(
+            service.TreatsDreamsService.open(data_dir, args.backend),
+            f, format_for(args.file), args.batch_size, args.create_users
+        )
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"Imported {result['imported']} records ({result['bonuses']} level-up bonuses), "
+          f"skipped {result['skipped']} in {elapsed:.1f}s")
+    for message in result["errors"]:
+        print(f"  {message}")
+    sys.exit(1 if result["skipped"] and not result["imported"] else 0)
@@ -0,0 +1,270 @@
+"""
+Append-only event journal for the hot paths (completions and purchases).
+
+Each event is one JSON line. The JSON files in DATA_DIR act as the snapshot;
+events with a sequence number above the snapshot's journal_seq are replayed
+on top of it at startup. With write-behind persistence, catalog saves are
+journaled too, as save_bank events carrying the whole bank.
+"""
+import json
+import os
+
+import catalog
+import history
+import retention
+
+JOURNAL_FILE_NAME = "journal.jsonl"
+
+# Number of journaled events after which the caller should write a snapshot
+COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", "500"))
+
+
+def read_events(path, after_seq=0):
+    """
+    Yield events with a sequence number greater than after_seq
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # A torn final line from a crash mid-append is ignored
+                continue
+            if event.get("seq", 0) > after_seq:
+                yield event
+
+
+def last_seq(path):
+    """
+    Sequence number of the newest event. Other processes append too, so this
+    is read from the file each time rather than cached.
+    """
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    seq = 0
+    if size:
+        with open(path, "rb") as f:
+            # Only the tail is needed to find the last complete record
+            f.seek(max(0, size - 4096))
+            lines = f.read().splitlines()
+        for line in reversed(lines):
+            try:
+                seq = json.loads(line)["seq"]
+                break
+            except (ValueError, KeyError):
+                continue
+        else:
+            seq = max((event["seq"] for event in read_events(path)), default=0)
+    return seq
+
+
+def pending_count(path, snapshot_seq):
+    return max(0, last_seq(path) - snapshot_seq)
+
+
+def append_event(path, event):
+    """
+    Append one event and return its sequence number. Callers hold the data
+    directory lock, so sequence numbers are unique across processes.
+    """
+    return append_events(path, [event])
+
+
+def append_events(path, events):
+    """
+    Append events with consecutive sequence numbers and one fsync; returns
+    the last sequence number
+    """
+    seq = last_seq(path)
+    lines = []
+    for event in events:
+        seq += 1
+        lines.append(json.dumps(dict(event, seq=seq)) + "\n")
+    with open(path, "a") as f:
+        f.write("".join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+    return seq
+
+
+def reset(path):
+    """
+    Drop all events once they are covered by a snapshot, keeping a checkpoint
+    record so sequence numbers keep increasing after a restart
+    """
+    seq = last_seq(path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps({"seq": seq, "type": "checkpoint"}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def merge_purchases(bank, stored):
+    """
+    bank with the purchase state of the treats and dreams that are also in
+    stored (matched by id) taken from stored: treats' purchased flag and
+    dreams' purchased_by
+    """
+    merged = dict(bank)
+    if "user_banks" in bank:
+        stored_banks = stored.get("user_banks", {})
+        merged["user_banks"] = {}
+        for user, user_bank in bank["user_banks"].items():
+            purchased = {
+                t["id"]: t.get("purchased", False) for t in stored_banks.get(user, {}).get("treats", []) if "id" in t
+            }
+            if purchased:
+                user_bank = dict(user_bank, treats=[
+                    dict(t, purchased=purchased[t["id"]]) if t.get("id") in purchased else t
+                    for t in user_bank.get("treats", [])
+                ])
+            merged["user_banks"][user] = user_bank
+    if "dreams" in bank:
+        purchased_by = {d["id"]: d["purchased_by"] for d in stored.get("dreams", []) if "id" in d}
+        merged["dreams"] = [
+            dict(d, purchased_by=list(purchased_by[d["id"]])) if d.get("id") in purchased_by else d
+            for d in bank["dreams"]
+        ]
+    return merged
+
+
+def merge_balances(bank, stored):
+    """
+    Take everything from bank except the balances and purchases, which keep
+    their stored values. They only change through events, so a session
+    saving stale data never wipes points earned or purchases made in
+    another session.
+    """
+    merged = merge_purchases(bank, stored)
+    stored_banks = stored.get("user_banks", {})
+    merged["user_banks"] = {
+        user: dict(user_bank, activity_points=stored_banks[user]["activity_points"])
+        if user in stored_banks else user_bank
+        for user, user_bank in merged.get("user_banks", {}).items()
+    }
+    if "dream_bank" in stored:
+        merged["dream_bank"] = stored["dream_bank"]
+    return merged
+
+
+def log_entry(event):
+    """
+    Activity log entry created by a complete or level_bonus event
+    """
+    entry = {"timestamp": history.to_epoch(event["timestamp"]), "points": event["points"]}
+    if event["type"] == "level_bonus":
+        entry["level"] = event["level"]
+    elif "activity_id" in event:
+        entry["activity_id"] = event["activity_id"]
+    else:
+        # Journaled before activities had ids
+        entry["activity"] = event["activity"]
+    if "id" in event:
+        entry["id"] = event["id"]
+    return entry
+
+
+def _position(records, event, id_key):
+    # Events journaled before catalog ids refer to records by position
+    if id_key in event:
+        return catalog.position_of(records, event[id_key])
+    return event["index"]
+
+
+def apply_to_bank(event, bank_data):
+    """
+    Apply the balance, treat and dream side of an event to bank data
+    """
+    kind = event["type"]
+    user = event.get("user")
+    user_banks = bank_data.setdefault("user_banks", {})
+
+    if kind in ("complete", "level_bonus"):
+        user_bank = user_banks.setdefault(user, {"activity_points": 0, "treats": []})
+        user_bank["activity_points"] += event["points"]
+    elif kind == "buy_treat":
+        user_bank = user_banks[user]
+        pos = _position(user_bank["treats"], event, "treat_id")
+        if pos is not None:
+            user_bank["treats"][pos]["purchased"] = True
+        user_bank["activity_points"] -= event["cost"]
+        bank_data["dream_bank"] = bank_data.get("dream_bank", 0) + event["cost"]
+    elif kind == "buy_dream":
+        pos = _position(bank_data["dreams"], event, "dream_id")
+        if pos is not None and user not in bank_data["dreams"][pos]["purchased_by"]:
+            bank_data["dreams"][pos]["purchased_by"].append(user)
+        bank_data["dream_bank"] = bank_data.get("dream_bank", 0) - event["cost"]
+    elif kind == "delete_log":
+        user_bank = user_banks.setdefault(user, {"activity_points": 0, "treats": []})
+        user_bank["activity_points"] -= event["points"]
+    elif kind == "reset_user":
+        if user in user_banks:
+            user_banks[user]["activity_points"] = 0
+            for treat in user_banks[user].get("treats", []):
+                treat["purchased"] = False
+    elif kind == "reset_dream_bank":
+        bank_data["dream_bank"] = 0
+    elif kind == "save_bank":
+        bank_data.update(merge_balances(event["bank"], bank_data))
+
+
+def apply_to_logs(event, activity_logs):
+    """
+    Apply the activity log side of an event
+    """
+    kind = event["type"]
+    user = event.get("user")
+
+    if kind in ("complete", "level_bonus"):
+        activity_logs.setdefault(user, []).append(log_entry(event))
+    elif kind == "delete_log":
+        logs = activity_logs.get(user, [])
+        pos = find_log_entry(logs, event)
+        if pos is not None:
+            logs.pop(pos)
+    elif kind == "reset_user":
+        if user in activity_logs:
+            activity_logs[user] = []
+    elif kind == "rollup_logs":
+        if user in activity_logs:
+            activity_logs[user] = retention.rollup(
+                activity_logs[user], event["raw_before"], event.get("weekly_before"), event["offset"]
+            )
+
+
+def apply_event(event, bank_data, activity_logs):
+    """
+    Apply a single journaled event to loaded bank data and activity logs
+    """
+    apply_to_bank(event, bank_data)
+    apply_to_logs(event, activity_logs)
+
+
+def find_log_entry(logs, event):
+    """
+    Position of the log entry a delete_log event refers to: by id, or for
+    entries saved before they had ids, by timestamp, activity and points
+    """
+    fallback = None
+    for pos, entry in enumerate(logs):
+        if entry.get("id") == event["id"]:
+            return pos
+        if fallback is None and "id" not in entry and (
+                entry["timestamp"], entry.get("activity"), entry["points"]) == (
+                event["timestamp"], event.get("activity"), event["points"]):
+            fallback = pos
+    return fallback
+
+
+def replay(path, bank_data, activity_logs):
+    """
+    Rebuild state by applying every event newer than the snapshot
+    """
+    for event in read_events(path, bank_data.get("journal_seq", 0)):
+        apply_event(event, bank_data, activity_logs)
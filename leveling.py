@@ -0,0 +1,151 @@
+"""
+Level engine: maps total points to (level, points_in_level, points_needed).
+
+The default curve matches the app's original rules: 5 points to reach
+level 2, then level L needs 5 + 5 * L more points to reach level L + 1.
+"""
+import bisect
+import math
+
+
+class LevelCurve:
+    """
+    Quadratic level curve.
+    first: points needed to go from level 1 to level 2
+    base, step: from level L >= 2, base + step * L points reach level L + 1
+    """
+
+    def __init__(self, first=5, base=5, step=5):
+        self.first = first
+        self.base = base
+        self.step = step
+
+    def increment(self, level):
+        """
+        Points needed to go from level to level + 1
+        """
+        if level <= 1:
+            return self.first
+        return self.base + self.step * level
+
+    def threshold(self, level):
+        """
+        Total points at which level starts
+        """
+        if level <= 1:
+            return 0
+        return self.first + self.base * (level - 2) + self.step * ((level - 1) * level // 2 - 1)
+
+    def level_for(self, total_points):
+        """
+        Closed-form (level, points_in_level, points_needed) for total_points
+        """
+        if total_points < self.first:
+            return 1, total_points, self.first
+
+        if self.step == 0:
+            level = 2 + (total_points - self.first) // self.base if self.base > 0 else 2
+        else:
+            # threshold(L) = step/2 * L^2 + (base - step/2) * L + c; solve for L
+            b2 = 2 * self.base - self.step
+            c = self.first - 2 * self.base - self.step
+            discriminant = b2 * b2 - 8 * self.step * (c - total_points)
+            level = max(2, (math.isqrt(max(discriminant, 0)) - b2) // (2 * self.step))
+        # Integer square root can land one level off near a threshold
+        next_start = self.threshold(level + 1)
+        while next_start <= total_points:
+            level += 1
+            next_start = self.threshold(level + 1)
+        start = self.threshold(level)
+        while level > 2 and start > total_points:
+            level -= 1
+            next_start, start = start, self.threshold(level)
+
+        return level, total_points - start, next_start - start
+
+
+class ThresholdTable:
+    """
+    Precomputed level start thresholds with bisect lookup, for curves given
+    as an arbitrary increment function instead of a closed form.
+    The table grows on demand for point totals beyond it.
+    """
+
+    def __init__(self, increment, max_level=100):
+        self.increment = increment
+        self.thresholds = [0]
+        self._extend(max(max_level, 2))
+
+    def _extend(self, max_level):
+        level = len(self.thresholds)
+        while level <= max_level:
+            self.thresholds.append(self.thresholds[-1] + self.increment(level))
+            level += 1
+
+    def threshold(self, level):
+        if level <= 1:
+            return 0
+        if level > len(self.thresholds):
+            self._extend(level)
+        return self.thresholds[level - 1]
+
+    def level_for(self, total_points):
+        if total_points < self.thresholds[1]:
+            return 1, total_points, self.increment(1)
+        while total_points >= self.thresholds[-1]:
+            self._extend(len(self.thresholds) * 2)
+        level = bisect.bisect_right(self.thresholds, total_points)
+        return level, total_points - self.thresholds[level - 1], self.increment(level)
+
+
+DEFAULT_CURVE = LevelCurve()
+
+# (icon, title) for every 5 levels; the last one covers all higher levels
+LEVEL_TITLES = [
+    ("🌱", "Beginner"),
+    ("🦾", "Apprentice"),
+    ("⚡", "Adventurer"),
+    ("🛡️", "Challenger"),
+    ("🦉", "Strategist"),
+    ("🐉", "Elite"),
+    ("👑", "Champion"),
+    ("🚀", "Legend"),
+    ("🌌", "Mythic"),
+    ("🏆", "Ascendant"),
+    ("🧬", "Transcendent"),
+    ("💫", "Immortal"),
+    ("🪐", "Celestial"),
+    ("🔥", "Paragon"),
+    ("🎮", "Grandmaster"),
+    ("🦸", "Vanguard"),
+    ("🧙", "Archmage"),
+    ("🦾", "Overlord"),
+    ("🌟", "Virtuoso"),
+    ("👾", "Ultimate"),
+]
+
+
+def calculate_level(total_points):
+    """
+    Calculate level based on points with increasing difficulty
+    Level 1: 0-4 points (+5)
+    Level 2: 5-19 points (+15)
+    Level 3: 20-39 points (+20)
+    Level 4: 40-64 points (+25)
+    And so on with increasing difficulty
+    """
+    return DEFAULT_CURVE.level_for(total_points)
+
+
+def level_title(level):
+    """
+    (icon, title) shown for a level
+    """
+    return LEVEL_TITLES[min(level // 5, len(LEVEL_TITLES) - 1)]
+
+
+def calculate_points_needed(level):
+    """
+    Calculate points needed to reach a specific level
+    """
+    return DEFAULT_CURVE.threshold(level)
@@ -1,391 +1,448 @@
 
 
 import streamlit as st
-import json
 import os
+import time
+
+import catalog
+import export
+import history
+import importer
+import leveling
+import metrics
+import retention
+import service
+import state_store
+import storage
+import tenants
+import ui_state
 
 # ---- Data Storage ----
+# Everything cached with st.cache_resource runs once per process; the rest
+# of the script is the per-rerun rendering
 DATA_DIR = os.getenv("DATA_DIR", "data")
-os.makedirs(DATA_DIR, exist_ok=True)
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
-BANK_FILE = os.path.join(DATA_DIR, "bank.json")
-ACTIVITY_FILE = os.path.join(DATA_DIR, "activity.json")
-
-def load_users():
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "r") as f:
-            return json.load(f)
-    return []
-
-def save_users(users):
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f)
-
-def load_bank():
-    if os.path.exists(BANK_FILE):
-        with open(BANK_FILE, "r") as f:
-            return json.load(f)
-    return {}
-
-def load_activity_logs():
-    if os.path.exists(ACTIVITY_FILE):
-        with open(ACTIVITY_FILE, "r") as f:
-            return json.load(f)
-    return {}
-
-def save_activity_logs():
-    with open(ACTIVITY_FILE, "w") as f:
-        json.dump(st.session_state.activity_logs, f)
-
-def save_bank():
-    with open(BANK_FILE, "w") as f:
-        json.dump({
-            "activities": st.session_state.activities,
-            "dreams": st.session_state.dreams,
-            "user_banks": st.session_state.user_banks,
-            "dream_bank": st.session_state.dream_bank
-        }, f)
-
- # ---- Level calculations ----
-def calculate_points_needed(level):
+page_timer = metrics.SectionTimer()
+page_timer.start("startup")
+
+@st.cache_resource
+def prepare_data_dir(data_dir):
+    os.makedirs(data_dir, exist_ok=True)
+    metrics.configure(data_dir)
+
+prepare_data_dir(DATA_DIR)
+
+@st.cache_resource
+def get_service(data_dir, backend):
+    # One state store per process and group partition; every session of the
+    # group reads and changes this copy
+    return service.TreatsDreamsService(state_store.StateStore(
+        metrics.TimedStorage(storage.get_storage(data_dir, backend))
+    ))
+
+@st.cache_resource
+def get_analytics(data_dir, backend):
+    # Imported on first use: NumPy and pandas are only needed once someone
+    # opens the Analytics panel
+    import analytics
+    return analytics.LogAnalytics(get_service(data_dir, backend).store)
+
+@st.cache_resource
+def compact_logs_daily(data_dir, backend, day):
+    # Runs once per process and local day
+    return get_service(data_dir, backend).compact_logs()
+
+# ---- Group ----
+# The group comes from the URL (?group=name) so it can be bookmarked; only
+# its partition is loaded
+groups = tenants.list_groups(DATA_DIR)
+group = st.query_params.get("group", tenants.DEFAULT_GROUP)
+if group not in groups:
+    st.warning(f"Group '{group}' not found, showing '{tenants.DEFAULT_GROUP}'.")
+    group = tenants.DEFAULT_GROUP
+GROUP_DIR = tenants.partition_dir(DATA_DIR, group)
+
+def switch_group():
+    st.query_params["group"] = st.session_state.group_select
+
+app = get_service(GROUP_DIR, os.getenv("STORAGE_BACKEND", storage.DEFAULT_BACKEND))
+store = app.store
+store.sync()
+if retention.ENABLED:
+    compact_logs_daily(GROUP_DIR, os.getenv("STORAGE_BACKEND", storage.DEFAULT_BACKEND),
+                       time.strftime("%Y-%m-%d"))
+
+# ---- Session State Initialization ----
+# UI state belongs to one group; start over when the session switches
+if st.session_state.get("group") != group:
+    for key in [k for k in st.session_state if k != "group_select"]:
+        del st.session_state[key]
+    st.session_state.group = group
+# Sessions only keep UI state; the data lives in the shared store. Drop UI
+# state for records that are gone and for forms that are closed, so a long
+# session stays the same size
+def record_exists(section, record_id):
+    if section == "activities":
+        return store.activity(record_id) is not None
+    if section == "treats":
+        return store.treat(st.session_state.get("selected_user"), record_id) is not None
+    return store.dream(record_id) is not None
+
+ui_state.prune(st.session_state, record_exists)
+if "selected_user" not in st.session_state:
+    st.session_state.selected_user = store.users[0] if store.users else None
+
+# ---- Sections ----
+# Each section below is a fragment: clicking inside it reruns only that
+# section. A change reruns the sections that show any topic it touched
+# (StateStore topics; "activity_logs:<user>" counts as "activity_logs").
+# Changes to the user list rerun the whole page.
+SECTION_TOPICS = {
+    "header": {"user_banks"},
+    "activities": {"activities"},
+    "history": {"activities", "activity_logs"},
+    "treats": {"treats", "user_banks"},
+    "dreams": {"dreams", "dream_bank", "dream_purchases"},
+    "analytics": {"activities", "dreams", "user_banks", "dream_bank", "dream_purchases", "activity_logs"},
+    "admin": {"user_banks"}
+}
+
+def section(key):
     """
-    Calculate points needed to reach a specific level
+    Decorator: render the function as the section's fragment, timed as
+    section.<key>
     """
-    if level <= 1:
-        return 0
-    
-    total_points = 5  # Points needed for level 2
-    
-    for l in range(3, level+1):
-        total_points += 5 + ((l-1) * 5)  # (5, 10, 15, 20, 25...)
-    
-    return total_points
-
-def calculate_level(total_points):
+    def decorate(render):
+        @st.fragment(key=key)
+        def run(*args):
+            if store.sync():
+                # Another process changed the data; refresh everything
+                st.rerun()
+            with metrics.timer(f"section.{key}"):
+                message = st.session_state.pop(f"message_{key}", None)
+                if message:
+                    getattr(st, message[0])(message[1])
+                render(*args)
+        return run
+    return decorate
+
+def refresh(changes, key):
     """
-    Calculate level based on points with increasing difficulty
-    Level 1: 0-5 points
-    Level 2: 6-15 points (+10)
-    Level 3: 16-30 points (+15)
-    Level 4: 31-50 points (+20)
-    And so on with increasing difficulty
+    From a widget callback: rerun section key and every section showing a
+    changed topic (the whole page for None or user list changes)
     """
-    if total_points < 5:
-        return 1, total_points, 5  # Level 1, current points, need 5 for next level
-    
-    level = 1
-    points_needed = 5  # Points needed for first level
-    previous_threshold = 0
-    level_threshold = points_needed
-    
-    while total_points >= level_threshold:
-        level += 1
-        previous_threshold = level_threshold
-        points_needed = 5 + (level * 5)  # Increasing difficulty (5, 10, 15, 20, 25...)
-        level_threshold += points_needed
-    
-    # Calculate points in current level and points needed for next level
-    points_in_current_level = total_points - previous_threshold
-    
-    return level, points_in_current_level, points_needed
+    if changes is None or "users" in changes:
+        st.rerun()
+    topics = {topic.split(":", 1)[0] for topic in changes}
+    st.rerun([name for name, shown in SECTION_TOPICS.items() if name == key or shown & topics])
 
-# ---- Session State Initialization ----
-st.session_state.users = load_users()
-if "selected_user" not in st.session_state:
-    st.session_state.selected_user = st.session_state.users[0] if st.session_state.users else None
-bank_data = load_bank()
-st.session_state.activity_logs = load_activity_logs()
-if "activities" not in st.session_state:
-    st.session_state.activities = bank_data.get("activities", [
-        {"name": "Run 5km", "points": 10},
-        {"name": "Yoga 30min", "points": 5}
-    ])
-if "dreams" not in st.session_state:
-    st.session_state.dreams = bank_data.get("dreams", [
-        {"name": "Weekend Trip", "cost": 100, "purchased_by": []}
-    ])
-if "user_banks" not in st.session_state:
-    if "user_banks" in bank_data:
-        st.session_state.user_banks = bank_data["user_banks"]
-    else:
-        # Initialize user banks with activity points and empty treats list for each user
-        st.session_state.user_banks = {
-            user: {
-                "activity_points": 0, 
-                "treats": [{"name": "Ice Cream", "cost": 15, "purchased": False}]
-            } 
-            for user in st.session_state.users
-        }
-
-if "activity_logs" not in st.session_state:
-    st.session_state.activity_logs = {user: [] for user in st.session_state.users}
-if "dream_bank" not in st.session_state:
-    st.session_state.dream_bank = bank_data.get("dream_bank", 0)
+def act(key, action, *args, success=None):
+    """
+    Widget callback body: run a service call, leave its outcome as a
+    message at the top of section key and refresh what it changed.
+    success is a message or a function of the call's result.
+    """
+    version = store.version
+    try:
+        result = action(*args)
+    except ValueError as e:
+        # Deleted or changed by another session since this page was drawn
+        st.session_state[f"message_{key}"] = ("warning", str(e))
+        return
+    if success:
+        st.session_state[f"message_{key}"] = ("success", success(result) if callable(success) else success)
+    refresh(store.changes_since(version), key)
+
+def set_state(**values):
+    st.session_state.update(values)
+
+def search_box(key, label):
+    """
+    Search input for a catalog; a new query starts again at page 1
+    """
+    return st.text_input(label, key=f"{key}_search", placeholder="Type part of a name",
+                         on_change=set_state, kwargs={f"{key}_page": 1})
+
+def catalog_page(key, records, filters=None):
+    """
+    Filter choice and pager for a catalog list; returns the records on the
+    current page. filters maps a choice label to a predicate on a record.
+    """
+    if filters:
+        choice = st.radio("Show", list(filters), horizontal=True, key=f"{key}_filter",
+                          on_change=set_state, kwargs={f"{key}_page": 1}, label_visibility="collapsed")
+        records = [record for record in records if filters[choice](record)]
+    if not records:
+        st.write("_Nothing matches._")
+        return []
+    shown, page_count = catalog.page_of(records, st.session_state.get(f"{key}_page", 1))
+    if page_count > 1:
+        if st.session_state.get(f"{key}_page", 1) > page_count:
+            # Edits or a narrower search can leave us past the last page
+            st.session_state[f"{key}_page"] = page_count
+        page = st.number_input(f"Page (of {page_count}, {len(records)} items)", min_value=1,
+                               max_value=page_count, step=1, key=f"{key}_page")
+        shown, _ = catalog.page_of(records, page)
+    return shown
 
 # ---- User Selection ----
+page_timer.start("users")
 st.title("🏋️ Workout Motivation App")
 
-st.subheader("Users")
-if st.session_state.users:
-    user = st.selectbox("Select User", st.session_state.users, key="user_select")
-    st.session_state.selected_user = user
-    user_bank = st.session_state.user_banks.get(user, {"activity_points": 0})
-
-    # Calculate user level
-    total_points = user_bank["activity_points"]
-    user_level, points_in_level, points_needed = calculate_level(total_points)
-
-    # Dynamic icon and title based on level (every 5 levels)
-    def get_level_title_icon(level):
-        # List of (icon, title) tuples, gender-neutral, gaming-themed, scalable
-        titles = [
-            ("🌱", "Beginner"),
-            ("🦾", "Apprentice"),
-            ("⚡", "Adventurer"),
-            ("🛡️", "Challenger"),
-            ("🦉", "Strategist"),
-            ("🐉", "Elite"),
-            ("👑", "Champion"),
-            ("🚀", "Legend"),
-            ("🌌", "Mythic"),
-            ("🏆", "Ascendant"),
-            ("🧬", "Transcendent"),
-            ("💫", "Immortal"),
-            ("🪐", "Celestial"),
-            ("🔥", "Paragon"),
-            ("🎮", "Grandmaster"),
-            ("🦸", "Vanguard"),
-            ("🧙", "Archmage"),
-            ("🦾", "Overlord"),
-            ("🌟", "Virtuoso"),
-            ("👾", "Ultimate"),
-        ]
-        idx = min(level // 5, len(titles) - 1)
-        return titles[idx]
-
-    level_icon, level_title = get_level_title_icon(user_level)
-
-    # Clamp points_in_level to [0, points_needed]
-    points_in_level = max(0, min(points_in_level, points_needed))
-    # Show level info at the top
-    level_col1, level_col2 = st.columns([3, 1])
-    with level_col1:
-        st.header(f"{level_icon} {level_title} {user}")
-        st.subheader(f"Level {user_level} - {points_in_level}/{points_needed} points to next level")
-        # Progress bar for level
-        level_progress = points_in_level / points_needed if points_needed > 0 else 0
-        level_progress = max(0.0, min(level_progress, 1.0))
-        st.progress(level_progress, text=f"{int(level_progress * 100)}% to Level {user_level + 1}")
-
-        # Show rewards for leveling up (10% of points needed for next level, min 1)
-        import math
-        next_level_points = points_needed if points_needed > 0 else 1
-        level_bonus = max(1, math.ceil(next_level_points * 0.10))
-        st.info(f"🏆 Level rewards: +{level_bonus} bonus points at next level")
-    with level_col2:
-        st.metric("Total Points", total_points)
-else:
-    st.info("No users yet. Please add a user to get started.")
-    user = None
-    user_bank = {"activity_points": 0}
-
-if st.button("➕ Add New User", key="add_user_button"):
-    st.session_state["add_user_form_visible"] = True
-
-if st.session_state.get("add_user_form_visible", False):
-    with st.form(key="add_user_form"):
-        new_user = st.text_input("Add New User")
-        col1, col2 = st.columns(2)
-        with col1:
-            if st.form_submit_button("Add User") and new_user:
-                if new_user not in st.session_state.users:
-                    st.session_state.users.append(new_user)
-                    save_users(st.session_state.users)
-                    # Add to user_banks with default treats
-                    st.session_state.user_banks[new_user] = {
-                        "activity_points": 0,
-                        "treats": [{"name": "Ice Cream", "cost": 15, "purchased": False}]
-                    }
-                    # Initialize empty activity log for the new user
-                    st.session_state.activity_logs[new_user] = []
-                    save_activity_logs()
-                    st.session_state["add_user_form_visible"] = False
-                    st.success(f"User '{new_user}' added!")
-                    st.rerun()
-                else:
-                    st.warning("User already exists.")
-        with col2:
-            if st.form_submit_button("Cancel"):
-                st.session_state["add_user_form_visible"] = False
-                st.rerun()
+if len(groups) > 1:
+    st.session_state.group_select = group
+    st.selectbox("Group", groups, key="group_select", on_change=switch_group)
 
-# ---- Activities ----
-st.subheader("Activities")
-st.write("Complete activities to earn activity points.")
-
-with st.expander("Current Activities"):
-    for idx, a in enumerate(st.session_state.activities):
-        col1, col2, col3 = st.columns([4,1,1])
-        with col1:
-            st.write(f"- **{a['name']}**: {a['points']} points")
-        with col2:
-            if st.button("✏️", key=f"edit_activity_btn_{idx}", help="Edit Activity"):
-                st.session_state[f"edit_activity_form_{idx}"] = True
-        with col3:
-            if st.button("🗑️", key=f"delete_activity_{idx}", help="Delete Activity"):
-                st.session_state.activities.pop(idx)
-                save_bank()
-                st.rerun()
-        
-        # Edit form for this activity
-        if st.session_state.get(f"edit_activity_form_{idx}", False):
-            with st.form(key=f"edit_activity_form_submit_{idx}"):
-                st.write(f"**Editing: {a['name']}**")
-                edit_name = st.text_input("Activity Name", value=a['name'])
-                edit_points = st.number_input("Points", value=a['points'], min_value=1, step=1)
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.form_submit_button("Save Changes"):
-                        st.session_state.activities[idx] = {"name": edit_name, "points": edit_points}
-                        st.session_state[f"edit_activity_form_{idx}"] = False
-                        save_bank()
-                        st.success("Activity updated!")
-                        st.rerun()
-                with col2:
-                    if st.form_submit_button("Cancel"):
-                        st.session_state[f"edit_activity_form_{idx}"] = False
-                        st.rerun()
-    import random
-    activity_form_key = f"add_activity_{random.randint(0, 1_000_000)}" if st.session_state.get("reset_activity_form") else "add_activity"
-    with st.form(key=activity_form_key):
-        new_activity = st.text_input("New Activity Name")
-        new_points = st.number_input("Points", min_value=1, step=1)
-        if st.form_submit_button("Add Activity") and new_activity:
-            st.session_state.activities.append(
-                {"name": new_activity, "points": new_points}
-            )
-            save_bank()
-            st.success("Activity added!")
-            st.session_state["reset_activity_form"] = True
-            st.rerun()
-    if st.session_state.get("reset_activity_form"):
-        del st.session_state["reset_activity_form"]
-
-with st.form(key="complete_activity"):
-    st.write("Mark an activity as complete:")
-
-    # Show activity names with points in dropdown
-    activity_options = [f"{a['name']} (+{a['points']} pts)" for a in st.session_state.activities]
-    activity_choice_display = st.selectbox("Activity", activity_options)
-    # Map back to activity name for logic
-    activity_names = [a["name"] for a in st.session_state.activities]
-    # Extract the selected activity name
-    if activity_choice_display:
-        # Find the index of the selected option
-        selected_idx = activity_options.index(activity_choice_display)
-        activity_choice = activity_names[selected_idx]
+st.subheader("Users")
+# Outside any section: picking another user reruns the whole page
+user = st.selectbox("Select User", store.users, key="user_select") if store.users else None
+st.session_state.selected_user = user
+page_timer.stop()
+
+def add_user():
+    name = st.session_state.get("new_user_name")
+    if name:
+        st.session_state["add_user_form_visible"] = False
+        act("header", app.add_user, name, success=f"User '{name}' added!")
+        # Still here: the name was taken, keep the form open
+        st.session_state["add_user_form_visible"] = True
+
+@section("header")
+def header_section(user):
+    if user:
+        user_bank = store.user_banks.get(user, {"activity_points": 0})
+
+        # Calculate user level
+        total_points = user_bank["activity_points"]
+        user_level, points_in_level, points_needed = app.level(user)
+
+        level_icon, level_title = leveling.level_title(user_level)
+
+        # Clamp points_in_level to [0, points_needed]
+        points_in_level = max(0, min(points_in_level, points_needed))
+        # Show level info at the top
+        level_col1, level_col2 = st.columns([3, 1])
+        with level_col1:
+            st.header(f"{level_icon} {level_title} {user}")
+            st.subheader(f"Level {user_level} - {points_in_level}/{points_needed} points to next level")
+            # Progress bar for level
+            level_progress = points_in_level / points_needed if points_needed > 0 else 0
+            level_progress = max(0.0, min(level_progress, 1.0))
+            st.progress(level_progress, text=f"{int(level_progress * 100)}% to Level {user_level + 1}")
+
+            # Show rewards for leveling up (10% of points needed for next level, min 1)
+            level_bonus = service.level_bonus(points_needed)
+            st.info(f"🏆 Level rewards: +{level_bonus} bonus points at next level")
+        with level_col2:
+            st.metric("Total Points", total_points)
     else:
-        activity_choice = None
-
-    if st.form_submit_button("Complete Activity") and user:
-        points = next(a["points"] for a in st.session_state.activities if a["name"] == activity_choice)
-
-        # Get current level and points needed for next level
-        current_level, _, current_points_needed = calculate_level(st.session_state.user_banks[user]["activity_points"])
-
-        # Update user points
-        st.session_state.user_banks[user]["activity_points"] += points
-
-        # Check for level up
-        new_level, _, new_points_needed = calculate_level(st.session_state.user_banks[user]["activity_points"])
-        bonus_points = 0
-
-        if new_level > current_level:
-            import math
-            # Award bonus points for leveling up (10% of points needed for next level, min 1)
-            next_level_points = new_points_needed if new_points_needed > 0 else 1
-            bonus_points = max(1, math.ceil(next_level_points * 0.10))
-            st.session_state.user_banks[user]["activity_points"] += bonus_points
-
-        # Add to activity log with timestamp
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        if user not in st.session_state.activity_logs:
-            st.session_state.activity_logs[user] = []
-
-        st.session_state.activity_logs[user].append({
-            "timestamp": timestamp,
-            "activity": activity_choice,
-            "points": points
-        })
-
-        # If there was a level up, add a bonus entry
-        if bonus_points > 0:
-            st.session_state.activity_logs[user].append({
-                "timestamp": timestamp,
-                "activity": f"LEVEL UP BONUS (Level {new_level})",
-                "points": bonus_points
-            })
+        st.info("No users yet. Please add a user to get started.")
 
-        save_bank()
-        save_activity_logs()
+    st.button("➕ Add New User", key="add_user_button", on_click=set_state, kwargs={"add_user_form_visible": True})
 
-        # Immediately rerun to update points and level display
-        st.rerun()
+    if st.session_state.get("add_user_form_visible", False):
+        with st.form(key="add_user_form"):
+            st.text_input("Add New User", key="new_user_name")
+            col1, col2 = st.columns(2)
+            with col1:
+                st.form_submit_button("Add User", on_click=add_user)
+            with col2:
+                st.form_submit_button("Cancel", on_click=set_state, kwargs={"add_user_form_visible": False})
 
-if user:
-    # Activity History dropdown
-    with st.expander("📋 Activity History"):
-        if user in st.session_state.activity_logs and st.session_state.activity_logs[user]:
-            st.write("Your completed activities:")
-            
-            # Sort activity logs by timestamp (newest first)
-            sorted_logs = sorted(
-                st.session_state.activity_logs[user], 
-                key=lambda x: x['timestamp'], 
-                reverse=True
-            )
-            
-            # Display total points from activities
-            total_activity_points = sum(log['points'] for log in sorted_logs)
-            st.info(f"Total points earned: {total_activity_points}")
-            
-            # Show each activity with its details
-            for idx, activity_log in enumerate(sorted_logs):
-                col1, col2, col3 = st.columns([3, 1, 1])
-                
-                with col1:
-                    st.write(f"**{activity_log['activity']}** - {activity_log['points']} pts - {activity_log['timestamp']}")
-                
-                with col3:
-                    # Delete activity log button
-                    if st.button("🗑️", key=f"delete_activity_log_{idx}"):
-                        # Find the original index in the unsorted list
-                        original_idx = st.session_state.activity_logs[user].index(activity_log)
-                        # Remove points from user's total
-                        st.session_state.user_banks[user]["activity_points"] -= activity_log["points"]
-                        # Delete the activity from logs
-                        st.session_state.activity_logs[user].pop(original_idx)
-                        save_bank()
-                        save_activity_logs()
-                        st.success(f"Activity log deleted and {activity_log['points']} points removed.")
-                        st.rerun()
+header_section(user)
+
+# ---- Activities ----
+def save_activity(activity_id):
+    ui_state.stop_editing(st.session_state, "activities")
+    act("activities", app.edit_activity, activity_id, st.session_state[f"edit_activity_name_{activity_id}"],
+        st.session_state[f"edit_activity_points_{activity_id}"], success="Activity updated!")
+
+def add_activity():
+    name = st.session_state.get("new_activity_name")
+    if name:
+        # Clear the form for the next activity
+        st.session_state["new_activity_name"] = ""
+        act("activities", app.add_activity, name, st.session_state["new_activity_points"],
+            success="Activity added!")
+
+def completed_message(events):
+    count = sum(1 for e in events if e["type"] == "complete")
+    levels = [e["level"] for e in events if e["type"] == "level_bonus"]
+    message = f"Logged {count} activities (+{sum(e['points'] for e in events)} pts)."
+    if levels:
+        message += f" Reached level {levels[-1]} with {len(levels)} level-up bonuses."
+    return message
+
+def complete_activity(user):
+    activity_id = st.session_state.get("complete_activity_choice")
+    if user and activity_id:
+        act("activities", app.complete_activity, user, activity_id)
+
+def complete_activities(user):
+    # Selected activities in the order they were picked, each repeated
+    activity_ids = [activity_id for activity_id in st.session_state.get("complete_activity_choices", [])
+                    for _ in range(st.session_state["complete_activity_times"])]
+    if user and activity_ids:
+        st.session_state["complete_activity_choices"] = []
+        act("activities", app.complete_activities, user, activity_ids, success=completed_message)
+
+@section("activities")
+def activities_section(user):
+    st.subheader("Activities")
+    st.write("Complete activities to earn activity points.")
+
+    query = search_box("activities", "🔍 Search activities")
+    matches = store.name_index("activities").search(query)
+
+    with st.expander("Current Activities"):
+        for a in catalog_page("activities", matches):
+            activity_id = a["id"]
+            col1, col2, col3 = st.columns([4,1,1])
+            with col1:
+                st.write(f"- **{a['name']}**: {a['points']} points")
+            with col2:
+                st.button("✏️", key=f"edit_activity_btn_{activity_id}", help="Edit Activity",
+                          on_click=ui_state.start_editing, args=(st.session_state, "activities", activity_id))
+            with col3:
+                st.button("🗑️", key=f"delete_activity_{activity_id}", help="Delete Activity",
+                          on_click=act, args=("activities", app.delete_activity, activity_id))
+
+            # Edit form for this activity
+            if ui_state.editing(st.session_state, "activities") == activity_id:
+                with st.form(key="edit_activity_form"):
+                    st.write(f"**Editing: {a['name']}**")
+                    st.text_input("Activity Name", value=a['name'], key=f"edit_activity_name_{activity_id}")
+                    st.number_input("Points", value=a['points'], min_value=1, step=1,
+                                    key=f"edit_activity_points_{activity_id}")
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.form_submit_button("Save Changes", on_click=save_activity, args=(activity_id,))
+                    with col2:
+                        st.form_submit_button("Cancel", on_click=ui_state.stop_editing,
+                                              args=(st.session_state, "activities"))
+        with st.form(key="add_activity"):
+            st.text_input("New Activity Name", key="new_activity_name")
+            st.number_input("Points", min_value=1, step=1, key="new_activity_points")
+            st.form_submit_button("Add Activity", on_click=add_activity)
+
+    # Show activity names with points in dropdown; the choice is the activity id
+    # Only activities matching the search, plus any already picked
+    shown = {a["id"] for a in matches} | set(st.session_state.get("complete_activity_choices", []))
+    activity_labels = {a["id"]: f"{a['name']} (+{a['points']} pts)" for a in store.activities if a["id"] in shown}
+    batch = st.toggle("Log several activities", key="complete_batch_mode")
+    with st.form(key="complete_activity"):
+        if batch:
+            st.write("Mark activities as complete, in the order you pick them:")
+            st.multiselect("Activities", list(activity_labels), format_func=activity_labels.get,
+                           key="complete_activity_choices")
+            st.number_input("Times each", min_value=1, max_value=20, value=1, step=1,
+                            key="complete_activity_times")
+            st.form_submit_button("Complete Activities", on_click=complete_activities, args=(user,))
         else:
-            st.info("No activity history yet. Complete activities to see them here.")
+            st.write("Mark an activity as complete:")
+            st.selectbox("Activity", list(activity_labels), format_func=activity_labels.get,
+                         key="complete_activity_choice")
+            st.form_submit_button("Complete Activity", on_click=complete_activity, args=(user,))
+
+activities_section(user)
+
+# ---- Activity History ----
+@section("history")
+def history_section(user):
+    if not user:
+        return
+    # Activity History dropdown
+    history_panel = st.expander("📋 Activity History", key="history_panel", on_change="rerun")
+    with history_panel:
+        if history_panel.open:
+            user_history = store.history(user)
+            if len(user_history):
+                st.write("Your completed activities:")
+
+                # Display total points from activities
+                st.info(f"Total points earned: {user_history.total_points}")
+
+                page_col1, page_col2 = st.columns([1, 1])
+                with page_col2:
+                    page_size = st.selectbox(
+                        "Entries per page",
+                        history.PAGE_SIZES,
+                        index=history.PAGE_SIZES.index(history.DEFAULT_PAGE_SIZE),
+                        key="history_page_size"
+                    )
+                page_count = user_history.page_count(page_size)
+                if st.session_state.get("history_page", 1) > page_count:
+                    # Deletions or a larger page size can leave us past the last page
+                    st.session_state["history_page"] = page_count
+                with page_col1:
+                    page = st.number_input(
+                        f"Page (of {page_count})",
+                        min_value=1,
+                        max_value=page_count,
+                        value=1,
+                        step=1,
+                        key="history_page"
+                    ) if page_count > 1 else 1
+
+                # Show only this page of activities, newest first
+                for activity_log in user_history.page(page - 1, page_size):
+                    col1, col2, col3 = st.columns([3, 1, 1])
 
-# ---- Treats ----
-st.header("🎁 Treats")
+                    with col1:
+                        count = f" × {activity_log['count']}" if "count" in activity_log else ""
+                        st.write(f"**{store.entry_label(activity_log)}**{count} - {activity_log['points']} pts - "
+                                 f"{history.format_entry_time(activity_log)}")
+
+                    with col3:
+                        # Remove the entry and its points from user's total
+                        st.button(
+                            "🗑️", key=f"delete_activity_log_{activity_log['id']}",
+                            on_click=act, args=("history", app.delete_log_entry, user, activity_log["id"]),
+                            kwargs={"success": f"Activity log deleted and {activity_log['points']} points removed."}
+                        )
+            else:
+                st.info("No activity history yet. Complete activities to see them here.")
+
+history_section(user)
 
-# Only proceed if a user is selected
-if user:
+# ---- Treats ----
+def save_treat(user, treat_id):
+    ui_state.stop_editing(st.session_state, "treats")
+    act("treats", app.edit_treat, user, treat_id, st.session_state[f"edit_treat_name_{treat_id}"],
+        st.session_state[f"edit_treat_cost_{treat_id}"], success="Treat updated!")
+
+def add_treat(user):
+    name = st.session_state.get("new_treat_name")
+    if name:
+        st.session_state["new_treat_name"] = ""
+        act("treats", app.add_treat, user, name, st.session_state["new_treat_cost"], success="Treat added!")
+
+@section("treats")
+def treats_section(user):
+    st.header("🎁 Treats")
+
+    # Only proceed if a user is selected
+    if not user:
+        st.info("Please select a user to manage treats.")
+        return
+    user_bank = store.user_banks.get(user, {"activity_points": 0})
     user_treats = user_bank.get("treats", [])
-    
+
     with st.expander("Your Treats"):
+        page = []
         if not user_treats:
             st.write("_No treats yet!_")
-            
-        for idx, treat in enumerate(user_treats):
+        else:
+            query = search_box("treats", "🔍 Search treats")
+            points = user_bank["activity_points"]
+            page = catalog_page("treats", store.name_index("treats", user).search(query), {
+                "All": lambda treat: True,
+                "Affordable now": lambda treat: not treat.get("purchased", False) and points >= treat["cost"],
+                "Not purchased": lambda treat: not treat.get("purchased", False),
+                "Purchased": lambda treat: treat.get("purchased", False)
+            })
+
+        for treat in page:
+            treat_id = treat["id"]
             treat_cols = st.columns([4,1,1])
             with treat_cols[0]:
                 purchased = treat.get("purchased", False)
@@ -398,288 +455,395 @@ if user:
                     points_needed = max(treat["cost"] - points, 0)
                     st.progress(percent / 100, text=f"{percent:.1f}% complete")
                     st.write(f"Points needed: {points_needed}")
-                    
-                    # Add buy button directly under treat
-                    if points >= treat["cost"]:
-                        if st.button("Buy", key=f"buy_treat_{idx}"):
-                            # Purchase the treat
-                            user_bank["treats"][idx]["purchased"] = True
-                            user_bank["activity_points"] -= treat["cost"]
-                            st.session_state.dream_bank += treat["cost"]
-                            save_bank()
-                            st.success(f"Treat '{treat['name']}' purchased! Points moved to Dream Bank.")
-                            st.rerun()
-                    else:
-                        st.button("Buy", key=f"buy_treat_{idx}", disabled=True)
+
+                    # Buy button directly under the treat; its points move to the dream bank
+                    st.button(
+                        "Buy", key=f"buy_treat_{treat_id}", disabled=points < treat["cost"],
+                        on_click=act, args=("treats", app.buy_treat, user, treat_id),
+                        kwargs={"success": f"Treat '{treat['name']}' purchased! Points moved to Dream Bank."}
+                    )
             with treat_cols[1]:
-                if st.button("✏️", key=f"edit_treat_btn_{idx}", help="Edit Treat"):
-                    st.session_state[f"edit_treat_form_{idx}"] = True
+                st.button("✏️", key=f"edit_treat_btn_{treat_id}", help="Edit Treat",
+                          on_click=ui_state.start_editing, args=(st.session_state, "treats", treat_id))
             with treat_cols[2]:
-                if st.button("🗑️", key=f"delete_treat_{idx}", help="Delete Treat"):
-                    user_bank["treats"].pop(idx)
-                    save_bank()
-                    st.rerun()
-            
+                st.button("🗑️", key=f"delete_treat_{treat_id}", help="Delete Treat",
+                          on_click=act, args=("treats", app.delete_treat, user, treat_id))
+
             # Edit form for this treat
-            if st.session_state.get(f"edit_treat_form_{idx}", False):
-                with st.form(key=f"edit_treat_form_submit_{idx}"):
+            if ui_state.editing(st.session_state, "treats") == treat_id:
+                with st.form(key="edit_treat_form"):
                     st.write(f"**Editing: {treat['name']}**")
-                    edit_name = st.text_input("Treat Name", value=treat['name'])
-                    edit_cost = st.number_input("Treat Cost (points)", value=treat['cost'], min_value=1, step=1)
+                    st.text_input("Treat Name", value=treat['name'], key=f"edit_treat_name_{treat_id}")
+                    st.number_input("Treat Cost (points)", value=treat['cost'], min_value=1, step=1,
+                                    key=f"edit_treat_cost_{treat_id}")
                     col1, col2 = st.columns(2)
                     with col1:
-                        if st.form_submit_button("Save Changes"):
-                            user_bank["treats"][idx] = {
-                                "name": edit_name, 
-                                "cost": edit_cost, 
-                                "purchased": treat.get("purchased", False)
-                            }
-                            save_bank()
-                            st.success("Treat updated!")
-                            st.rerun()
+                        st.form_submit_button("Save Changes", on_click=save_treat, args=(user, treat_id))
                     with col2:
-                        if st.form_submit_button("Cancel"):
-                            st.session_state[f"edit_treat_form_{idx}"] = False
-                            st.rerun()
+                        st.form_submit_button("Cancel", on_click=ui_state.stop_editing,
+                                              args=(st.session_state, "treats"))
 
         with st.form(key="add_treat"):
-            treat_name = st.text_input("New Treat Name")
-            treat_cost = st.number_input("Treat Cost (points)", min_value=1, step=1)
-            if st.form_submit_button("Add Treat") and treat_name:
-                if "treats" not in user_bank:
-                    user_bank["treats"] = []
-                    
-                user_bank["treats"].append(
-                    {"name": treat_name, "cost": treat_cost, "purchased": False}
-                )
-                save_bank()
-                st.success("Treat added!")
-                st.rerun()
+            st.text_input("New Treat Name", key="new_treat_name")
+            st.number_input("Treat Cost (points)", min_value=1, step=1, key="new_treat_cost")
+            st.form_submit_button("Add Treat", on_click=add_treat, args=(user,))
 
     # Treats purchased percentage
     if user_treats:
-        purchased = sum(1 for t in user_treats if t.get("purchased", False))
+        purchased = store.treats_purchased(user)
         total = len(user_treats)
         percent = (purchased / total) * 100 if total > 0 else 0
         st.info(f"Treats Purchased: {purchased} / {total} ({percent:.1f}%)")
 
-    # Removed dropdown purchase section as we now have inline buy buttons
-else:
-    st.info("Please select a user to manage treats.")
+treats_section(user)
 
 # ---- Dream Points ----
-st.header("🌟 Dreams")
-st.markdown(f"**Combined Dream Bank:** {st.session_state.dream_bank} points")
-
-with st.expander("Dream List"):
-    if not st.session_state.dreams:
-        st.write("_No dreams yet!_")
-    for idx, dream in enumerate(st.session_state.dreams):
-        dream_cols = st.columns([4,1,1])
-        with dream_cols[0]:
-            purchased = user in dream["purchased_by"]
-            st.write(f"**{dream['name']}** - Cost: {dream['cost']} pts")
-            if purchased:
-                st.success("Purchased!")
-            else:
-                points = st.session_state.dream_bank
-                percent = min(max(points / dream["cost"], 0.0), 1.0) * 100
-                points_needed = max(dream["cost"] - points, 0)
-                st.progress(percent / 100, text=f"{percent:.1f}% complete")
-                st.write(f"Points needed: {points_needed}")
-                
-                # Add buy button directly under dream
-                if user and points >= dream["cost"]:
-                    if st.button("Buy", key=f"buy_dream_{idx}"):
-                        # Purchase the dream
-                        dream["purchased_by"].append(user)
-                        st.session_state.dream_bank -= dream["cost"]
-                        save_bank()
-                        st.success(f"Dream '{dream['name']}' purchased!")
-                        st.rerun()
-                elif user:
-                    st.button("Buy", key=f"buy_dream_{idx}", disabled=True)
-        with dream_cols[1]:
-            if st.button("✏️", key=f"edit_dream_btn_{idx}", help="Edit Dream"):
-                st.session_state[f"edit_dream_form_{idx}"] = True
-        with dream_cols[2]:
-            if st.button("🗑️", key=f"delete_dream_{idx}", help="Delete Dream"):
-                st.session_state.dreams.pop(idx)
-                save_bank()
-                st.rerun()
-        
-        # Edit form for this dream
-        if st.session_state.get(f"edit_dream_form_{idx}", False):
-            with st.form(key=f"edit_dream_form_submit_{idx}"):
-                st.write(f"**Editing: {dream['name']}**")
-                edit_name = st.text_input("Dream Name", value=dream['name'])
-                edit_cost = st.number_input("Dream Cost (points)", value=dream['cost'], min_value=1, step=1)
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.form_submit_button("Save Changes"):
-                        st.session_state.dreams[idx] = {"name": edit_name, "cost": edit_cost, "purchased_by": dream["purchased_by"]}
-                        st.session_state[f"edit_dream_form_{idx}"] = False
-                        save_bank()
-                        st.success("Dream updated!")
-                        st.rerun()
-                with col2:
-                    if st.form_submit_button("Cancel"):
-                        st.session_state[f"edit_dream_form_{idx}"] = False
-                        st.rerun()
+def save_dream(dream_id):
+    ui_state.stop_editing(st.session_state, "dreams")
+    act("dreams", app.edit_dream, dream_id, st.session_state[f"edit_dream_name_{dream_id}"],
+        st.session_state[f"edit_dream_cost_{dream_id}"], success="Dream updated!")
+
+def add_dream():
+    name = st.session_state.get("new_dream_name")
+    if name:
+        st.session_state["new_dream_name"] = ""
+        act("dreams", app.add_dream, name, st.session_state["new_dream_cost"], success="Dream added!")
+
+@section("dreams")
+def dreams_section(user):
+    st.header("🌟 Dreams")
+    st.markdown(f"**Combined Dream Bank:** {store.dream_bank} points")
+
+    with st.expander("Dream List"):
+        page = []
+        if not store.dreams:
+            st.write("_No dreams yet!_")
+        else:
+            query = search_box("dreams", "🔍 Search dreams")
+            page = catalog_page("dreams", store.name_index("dreams").search(query), {
+                "All": lambda dream: True,
+                "Affordable now": lambda dream: (user not in dream["purchased_by"]
+                                                 and store.dream_bank >= dream["cost"]),
+                "Not purchased": lambda dream: user not in dream["purchased_by"],
+                "Purchased": lambda dream: user in dream["purchased_by"]
+            })
+        for dream in page:
+            dream_id = dream["id"]
+            dream_cols = st.columns([4,1,1])
+            with dream_cols[0]:
+                purchased = user in dream["purchased_by"]
+                st.write(f"**{dream['name']}** - Cost: {dream['cost']} pts")
+                if purchased:
+                    st.success("Purchased!")
+                else:
+                    points = store.dream_bank
+                    percent = min(max(points / dream["cost"], 0.0), 1.0) * 100
+                    points_needed = max(dream["cost"] - points, 0)
+                    st.progress(percent / 100, text=f"{percent:.1f}% complete")
+                    st.write(f"Points needed: {points_needed}")
 
-    with st.form(key="add_dream"):
-        dream_name = st.text_input("New Dream Name")
-        dream_cost = st.number_input("Dream Cost (points)", min_value=1, step=1)
-        if st.form_submit_button("Add Dream") and dream_name:
-            st.session_state.dreams.append(
-                {"name": dream_name, "cost": dream_cost, "purchased_by": []}
+                    # Buy button directly under the dream, paid from the shared dream bank
+                    if user:
+                        st.button(
+                            "Buy", key=f"buy_dream_{dream_id}", disabled=points < dream["cost"],
+                            on_click=act, args=("dreams", app.buy_dream, user, dream_id),
+                            kwargs={"success": f"Dream '{dream['name']}' purchased!"}
+                        )
+            with dream_cols[1]:
+                st.button("✏️", key=f"edit_dream_btn_{dream_id}", help="Edit Dream",
+                          on_click=ui_state.start_editing, args=(st.session_state, "dreams", dream_id))
+            with dream_cols[2]:
+                st.button("🗑️", key=f"delete_dream_{dream_id}", help="Delete Dream",
+                          on_click=act, args=("dreams", app.delete_dream, dream_id))
+
+            # Edit form for this dream
+            if ui_state.editing(st.session_state, "dreams") == dream_id:
+                with st.form(key="edit_dream_form"):
+                    st.write(f"**Editing: {dream['name']}**")
+                    st.text_input("Dream Name", value=dream['name'], key=f"edit_dream_name_{dream_id}")
+                    st.number_input("Dream Cost (points)", value=dream['cost'], min_value=1, step=1,
+                                    key=f"edit_dream_cost_{dream_id}")
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.form_submit_button("Save Changes", on_click=save_dream, args=(dream_id,))
+                    with col2:
+                        st.form_submit_button("Cancel", on_click=ui_state.stop_editing,
+                                              args=(st.session_state, "dreams"))
+
+        with st.form(key="add_dream"):
+            st.text_input("New Dream Name", key="new_dream_name")
+            st.number_input("Dream Cost (points)", min_value=1, step=1, key="new_dream_cost")
+            st.form_submit_button("Add Dream", on_click=add_dream)
+
+    # Dreams purchased percentage
+    if store.dreams:
+        purchased = store.dreams_purchased(user)
+        total = len(store.dreams)
+        percent = (purchased / total) * 100
+        st.info(f"Dreams Purchased: {purchased} / {total} ({percent:.1f}%)")
+
+dreams_section(user)
+
+# ---- Analytics ----
+@section("analytics")
+def analytics_section():
+    st.header("📊 Analytics")
+    if not store.users:
+        st.info("Add users to see analytics.")
+        return
+    analytics_panel = st.expander("Leaderboard & Trends", key="analytics_panel", on_change="rerun")
+    with analytics_panel:
+        if analytics_panel.open:
+            with metrics.timer("analytics.report"):
+                log_analytics = get_analytics(GROUP_DIR, os.getenv("STORAGE_BACKEND", storage.DEFAULT_BACKEND))
+                report = log_analytics.report()
+            board_tab, trend_tab, activity_tab, projection_tab = st.tabs(
+                ["Leaderboard", "Weekly Points", "Top Activities", "Projections"]
             )
-            save_bank()
-            st.success("Dream added!")
-            st.rerun()
-
-# Dreams purchased percentage
-if st.session_state.dreams:
-    purchased = sum(user in d["purchased_by"] for d in st.session_state.dreams)
-    total = len(st.session_state.dreams)
-    percent = (purchased / total) * 100
-    st.info(f"Dreams Purchased: {purchased} / {total} ({percent:.1f}%)")
+            with board_tab:
+                st.dataframe(report["leaderboard"], hide_index=True)
+                st.caption("Streaks count consecutive days with at least one completed activity.")
+            with trend_tab:
+                st.line_chart(report["weekly"])
+            with activity_tab:
+                if report["activities"].empty:
+                    st.info("No activities completed yet.")
+                else:
+                    st.dataframe(report["activities"], hide_index=True)
+            with projection_tab:
+                st.markdown(f"**Next level** (at each user's points per day over the last "
+                            f"{log_analytics.rate_days} days)")
+                st.dataframe(report["level_projection"], hide_index=True)
+                if not report["dream_projection"].empty:
+                    st.markdown("**Dreams** (if everyone's recent points reach the Dream Bank)")
+                    st.dataframe(report["dream_projection"], hide_index=True)
 
-# Removed dropdown purchase section as we now have inline buy buttons
+analytics_section()
 
 st.markdown("---")
 
-# Admin Section
-with st.expander("⚙️ Admin Controls"):
-    st.warning("**Warning**: Admin actions affect all users and data.")
-    
-    st.markdown("### Reset Dream Bank")
-    admin_col1, admin_col2 = st.columns([3, 1])
-    
-    with admin_col1:
-        st.markdown("Resets the shared dream bank to 0 points.")
-    
-    with admin_col2:
-        if st.button("Reset Dream Bank"):
-            # Show confirmation dialog using session state
-            st.session_state["show_reset_confirmation"] = True
-    
-    # Dream Bank Confirmation dialog
-    if st.session_state.get("show_reset_confirmation", False):
-        st.error("⚠️ Are you sure you want to reset the Dream Bank to 0 points? This cannot be undone.")
-        
-        confirm_col1, confirm_col2 = st.columns([1, 1])
-        with confirm_col1:
-            if st.button("Yes, Reset Dream Bank"):
-                # Reset dream bank
-                st.session_state.dream_bank = 0
-                save_bank()
-                st.session_state["show_reset_confirmation"] = False
-                st.success("Dream Bank has been reset to 0 points!")
-                st.rerun()
-        
-        with confirm_col2:
-            if st.button("Cancel"):
-                st.session_state["show_reset_confirmation"] = False
+# ---- Admin ----
+def reset_dream_bank():
+    st.session_state["show_reset_confirmation"] = False
+    act("admin", app.reset_dream_bank, success="Dream Bank has been reset to 0 points!")
+
+def delete_user():
+    user_to_delete = st.session_state.get("user_to_delete")
+    st.session_state["show_delete_confirmation"] = False
+    if user_to_delete:
+        act("admin", app.delete_user, user_to_delete, success=f"User '{user_to_delete}' deleted!")
+
+def reset_user():
+    user_to_reset = st.session_state.get("user_to_reset")
+    st.session_state["show_user_reset_confirmation"] = False
+    # Reset user points, treat purchases and activity log
+    if user_to_reset in store.user_banks:
+        act("admin", app.reset_user, user_to_reset,
+            success=f"{user_to_reset}'s activity points and activity log have been reset to 0 "
+                    f"and treats marked as unpurchased!")
+
+@section("admin")
+def admin_section():
+    # Only rendered while open (on_change="rerun" makes .open available)
+    admin_panel = st.expander("⚙️ Admin Controls", key="admin_panel", on_change="rerun")
+    with admin_panel:
+        if admin_panel.open:
+            st.warning("**Warning**: Admin actions affect all users and data.")
+
+            st.markdown("### Reset Dream Bank")
+            admin_col1, admin_col2 = st.columns([3, 1])
+
+            with admin_col1:
+                st.markdown("Resets the shared dream bank to 0 points.")
+
+            with admin_col2:
+                # Show confirmation dialog using session state
+                st.button("Reset Dream Bank", on_click=set_state, kwargs={"show_reset_confirmation": True})
+
+            # Dream Bank Confirmation dialog
+            if st.session_state.get("show_reset_confirmation", False):
+                st.error("⚠️ Are you sure you want to reset the Dream Bank to 0 points? This cannot be undone.")
+
+                confirm_col1, confirm_col2 = st.columns([1, 1])
+                with confirm_col1:
+                    st.button("Yes, Reset Dream Bank", on_click=reset_dream_bank)
+                with confirm_col2:
+                    st.button("Cancel", on_click=set_state, kwargs={"show_reset_confirmation": False})
+
+            st.markdown("---")
+            st.markdown("### Import Workout History")
+            st.markdown("Upload a CSV or JSON Lines file with `user`, `activity` and `timestamp` columns. "
+                        "Records are applied in file order with level-up bonuses, as if completed one by one.")
+            history_upload = st.file_uploader("History file", type=["csv", "jsonl", "ndjson"], key="import_file")
+            import_create_users = st.checkbox("Create users that don't exist yet", key="import_create_users")
+            if history_upload is not None and st.button("Import History"):
+                with st.spinner("Importing..."):
+                    result = importer.import_file(
+                        app, history_upload, importer.format_for(history_upload.name),
+                        create_users=import_create_users
+                    )
+                st.session_state["import_result"] = result
+                # Imports can touch every section
                 st.rerun()
-    
-    st.markdown("---")
-    st.markdown("### User Management")
-
-    # Delete User
-    if st.session_state.users:
-        st.markdown("**Delete User**: Permanently remove a user account.")
-        delete_user_col1, delete_user_col2 = st.columns([3, 1])
-        
-        with delete_user_col1:
-            user_to_delete = st.selectbox(
-                "Select User to Delete",
-                options=st.session_state.users,
-                key="admin_delete_user"
+            if "import_result" in st.session_state:
+                result = st.session_state["import_result"]
+                st.success(f"Imported {result['imported']} records ({result['bonuses']} level-up bonuses).")
+                if result["skipped"]:
+                    st.warning(f"Skipped {result['skipped']} records:\n\n"
+                               + "\n".join(f"- {e}" for e in result["errors"]))
+
+            st.markdown("---")
+            st.markdown("### Export Data")
+            st.markdown("Download activity logs, balances, treats or dreams. The file is written in chunks "
+                        "when you click Download, without holding up other sessions. "
+                        "For large or scheduled exports, run `python export.py` in the container.")
+            export_col1, export_col2 = st.columns(2)
+            with export_col1:
+                export_table = st.selectbox("Table", export.TABLES, key="export_table",
+                                            format_func=lambda table: table.replace("_", " ").capitalize())
+                export_users = st.multiselect("Users (all if empty)", store.users, key="export_users")
+            with export_col2:
+                export_format = st.selectbox("Format", export.formats(), key="export_format")
+                export_start = export_end = None
+                if export_table == "activity_logs":
+                    export_start = st.date_input("From", value=None, key="export_start")
+                    export_end = st.date_input("To (inclusive)", value=None, key="export_end")
+            start, end = export.day_range(export_start, export_end)
+            st.download_button(
+                "Download",
+                # Runs on its own thread when clicked; Streamlit reads the
+                # temporary file it returns
+                data=lambda: export.export_file(store, export_table, export_format,
+                                                export_users or None, start, end),
+                file_name=f"{group}-{export_table}.{export.EXTENSIONS[export_format]}",
+                mime=export.MIME_TYPES[export_format],
+                on_click="ignore",
+                key="export_download"
             )
-        
-        with delete_user_col2:
-            st.write(" ")  # Spacer for alignment
-            if st.button("Delete User"):
-                # Show confirmation dialog
-                st.session_state["show_delete_confirmation"] = True
-                st.session_state["user_to_delete"] = user_to_delete
-        
-        # Delete User Confirmation dialog
-        if st.session_state.get("show_delete_confirmation", False):
-            user_to_delete = st.session_state.get("user_to_delete")
-            
-            st.error(f"⚠️ Are you sure you want to delete user **{user_to_delete}**? All their data will be lost. This cannot be undone.")
-            
-            delete_confirm_col1, delete_confirm_col2 = st.columns([1, 1])
-            with delete_confirm_col1:
-                if st.button("Yes, Delete User"):
-                    if user_to_delete:
-                        st.session_state.users.remove(user_to_delete)
-                        save_users(st.session_state.users)
-                        st.session_state.user_banks.pop(user_to_delete, None)
-                        save_bank()
-                        st.session_state.selected_user = st.session_state.users[0] if st.session_state.users else None
-                        st.session_state["show_delete_confirmation"] = False
-                        st.success(f"User '{user_to_delete}' deleted!")
-                        st.rerun()
-            
-            with delete_confirm_col2:
-                if st.button("Cancel Delete"):
-                    st.session_state["show_delete_confirmation"] = False
-                    st.rerun()
-
-    st.markdown("---")
-    st.markdown("### Reset User Activity Points")
-    
-    if st.session_state.users:
-        user_to_reset = st.selectbox("Select User", 
-                                    options=st.session_state.users,
-                                    key="admin_user_reset",
-                                    format_func=lambda x: f"{x} - {st.session_state.user_banks.get(x, {}).get('activity_points', 0)} points")
-        
-        reset_user_col1, reset_user_col2 = st.columns([3, 1])
-        
-        with reset_user_col1:
-            st.markdown(f"Reset activity points for **{user_to_reset}** to 0.")
-        
-        with reset_user_col2:
-            if st.button("Reset User Points"):
-                # Show confirmation dialog
-                st.session_state["show_user_reset_confirmation"] = True
-                st.session_state["user_to_reset"] = user_to_reset
-        
-        # User Points Confirmation dialog
-        if st.session_state.get("show_user_reset_confirmation", False):
-            user_to_reset = st.session_state.get("user_to_reset")
-            current_points = st.session_state.user_banks.get(user_to_reset, {}).get('activity_points', 0)
-            
-            st.error(f"⚠️ Are you sure you want to reset **{user_to_reset}**'s activity points from {current_points} to 0? This cannot be undone.")
-            
-            user_confirm_col1, user_confirm_col2 = st.columns([1, 1])
-            with user_confirm_col1:
-                if st.button("Yes, Reset User Points"):
-                    # Reset user points
-                    if user_to_reset in st.session_state.user_banks:
-                        st.session_state.user_banks[user_to_reset]["activity_points"] = 0
-                        # Reset purchased status on all treats
-                        if "treats" in st.session_state.user_banks[user_to_reset]:
-                            for treat in st.session_state.user_banks[user_to_reset]["treats"]:
-                                treat["purchased"] = False
-                        # Clear activity log for the user
-                        if user_to_reset in st.session_state.activity_logs:
-                            st.session_state.activity_logs[user_to_reset] = []
-                            save_activity_logs()
-                        save_bank()
-                        st.session_state["show_user_reset_confirmation"] = False
-                        st.success(f"{user_to_reset}'s activity points and activity log have been reset to 0 and treats marked as unpurchased!")
+
+            st.markdown("---")
+            st.markdown("### Compact Activity Log")
+            if retention.ENABLED:
+                weekly = (f" and entries older than {retention.WEEKLY_DAYS} days into weekly totals"
+                          if retention.WEEKLY_DAYS else "")
+                st.markdown(f"Rolls entries older than {retention.RAW_DAYS} days into daily totals per activity"
+                            f"{weekly}. Points and balances don't change. This also runs once a day.")
+                st.button("Compact Activity Log", on_click=act, args=("admin", app.compact_logs), kwargs={
+                    "success": lambda result: f"Rolled up {result['before']} entries into {result['after']} "
+                                              f"for {result['users']} users."
+                })
+            else:
+                st.info("Log retention is off. Set `LOG_RETENTION_DAYS` to roll up old entries.")
+
+            st.markdown("---")
+            st.markdown("### Groups")
+            st.markdown(f"Each group has its own users, activities, treats, dreams and Dream Bank. "
+                        f"Admin actions here only affect **{group}**.")
+            with st.form(key="add_group_form", clear_on_submit=True):
+                new_group = st.text_input("New group name")
+                if st.form_submit_button("Create Group") and new_group:
+                    try:
+                        st.query_params["group"] = tenants.create_group(DATA_DIR, new_group)
                         st.rerun()
+                    except ValueError as e:
+                        st.error(str(e))
+
+            st.markdown("---")
+            st.markdown("### User Management")
+
+            # Delete User
+            if store.users:
+                st.markdown("**Delete User**: Permanently remove a user account.")
+                delete_user_col1, delete_user_col2 = st.columns([3, 1])
+
+                with delete_user_col1:
+                    user_to_delete = st.selectbox(
+                        "Select User to Delete",
+                        options=store.users,
+                        key="admin_delete_user"
+                    )
+
+                with delete_user_col2:
+                    st.write(" ")  # Spacer for alignment
+                    # Show confirmation dialog
+                    st.button("Delete User", on_click=set_state, kwargs={
+                        "show_delete_confirmation": True, "user_to_delete": user_to_delete
+                    })
+
+                # Delete User Confirmation dialog
+                if st.session_state.get("show_delete_confirmation", False):
+                    user_to_delete = st.session_state.get("user_to_delete")
+
+                    st.error(f"⚠️ Are you sure you want to delete user **{user_to_delete}**? "
+                             f"All their data will be lost. This cannot be undone.")
+
+                    delete_confirm_col1, delete_confirm_col2 = st.columns([1, 1])
+                    with delete_confirm_col1:
+                        st.button("Yes, Delete User", on_click=delete_user)
+                    with delete_confirm_col2:
+                        st.button("Cancel Delete", on_click=set_state, kwargs={"show_delete_confirmation": False})
+
+            st.markdown("---")
+            st.markdown("### Reset User Activity Points")
+
+            if store.users:
+                user_to_reset = st.selectbox(
+                    "Select User",
+                    options=store.users,
+                    key="admin_user_reset",
+                    format_func=lambda x: f"{x} - {store.user_banks.get(x, {}).get('activity_points', 0)} points"
+                )
 
-            with user_confirm_col2:
-                if st.button("Cancel Reset"):
-                    st.session_state["show_user_reset_confirmation"] = False
-                    st.rerun()
-    else:
-        st.info("No users available to reset.")
+                reset_user_col1, reset_user_col2 = st.columns([3, 1])
+
+                with reset_user_col1:
+                    st.markdown(f"Reset activity points for **{user_to_reset}** to 0.")
+
+                with reset_user_col2:
+                    # Show confirmation dialog
+                    st.button("Reset User Points", on_click=set_state, kwargs={
+                        "show_user_reset_confirmation": True, "user_to_reset": user_to_reset
+                    })
+
+                # User Points Confirmation dialog
+                if st.session_state.get("show_user_reset_confirmation", False):
+                    user_to_reset = st.session_state.get("user_to_reset")
+                    current_points = store.user_banks.get(user_to_reset, {}).get('activity_points', 0)
+
+                    st.error(f"⚠️ Are you sure you want to reset **{user_to_reset}**'s activity points "
+                             f"from {current_points} to 0? This cannot be undone.")
+
+                    user_confirm_col1, user_confirm_col2 = st.columns([1, 1])
+                    with user_confirm_col1:
+                        st.button("Yes, Reset User Points", on_click=reset_user)
+                    with user_confirm_col2:
+                        st.button("Cancel Reset", on_click=set_state,
+                                  kwargs={"show_user_reset_confirmation": False})
+            else:
+                st.info("No users available to reset.")
+
+            st.markdown("---")
+            st.markdown("### Performance")
+            st.markdown(f"Recent timings in this server process. Summaries are also written to "
+                        f"`{os.path.join(DATA_DIR, metrics.METRICS_FILE_NAME)}`.")
+            cache = store.cache_stats()
+            st.markdown(f"State cache: **{cache['hit_rate']:.1%}** hit rate. {cache['hits']} checks found the "
+                        f"in-memory data current, {cache['misses']} reloaded it after a change elsewhere.")
+            perf_summary = metrics.summary()
+            if perf_summary:
+                st.dataframe(
+                    [{"metric": name, **stats} for name, stats in perf_summary.items()],
+                    hide_index=True
+                )
+            else:
+                st.info("No timings recorded yet.")
+
+            st.markdown("---")
+            st.markdown("### Session State")
+            state_keys, state_bytes = ui_state.size(st.session_state)
+            st.markdown(f"This browser session holds **{state_keys}** keys, about "
+                        f"**{state_bytes / 1024:.1f} KB**. It should stay about the same over a day of use.")
+
+admin_section()
 
 st.caption("Made with ❤️ using Streamlit. Data is session-based and resets on reload.")
@@ -0,0 +1,198 @@
+"""
+Lightweight timing metrics for the hot paths.
+
+Timings are kept in memory per name (the most recent SAMPLES_KEPT samples)
+and counters as running totals, for the Performance panel in Admin
+Controls. Once configure(data_dir) has been called, a summary of the
+timings and counts recorded since the previous one is appended every
+METRICS_FLUSH_SECONDS to a rotating JSON Lines file, DATA_DIR/metrics.jsonl,
+for offline analysis.
+
+    with metrics.timer("storage.save_bank"):
+        ...
+    metrics.count("state_cache.hits")
+
+Set METRICS_ENABLED=0 to turn recording off.
+"""
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_FILE_NAME = "metrics.jsonl"
+ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+SAMPLES_KEPT = 1_000
+FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "60"))
+FILE_MAX_BYTES = int(os.getenv("METRICS_FILE_MAX_BYTES", str(1024 * 1024)))
+FILE_BACKUPS = int(os.getenv("METRICS_FILE_BACKUPS", "3"))
+
+# Storage methods timed by TimedStorage
+TIMED_STORAGE_METHODS = (
+    "load_users", "save_users", "load_bank", "save_bank", "load_activity_logs", "load_state",
+    "save_activity_logs", "save_snapshot", "record_events", "flush"
+)
+
+file_logger = logging.getLogger("treatsdreams.metrics")
+file_logger.propagate = False
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(samples):
+    """
+    Count and p50/p95/max in milliseconds for durations in seconds
+    """
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3)
+    }
+
+
+class Metrics:
+    def __init__(self):
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=SAMPLES_KEPT))
+        self._unflushed = collections.defaultdict(list)
+        self._counts = collections.Counter()
+        self._unflushed_counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def record(self, name, seconds):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._samples[name].append(seconds)
+            if file_logger.handlers:
+                self._unflushed[name].append(seconds)
+                if time.monotonic() - self._last_flush >= FLUSH_SECONDS:
+                    self._flush()
+
+    def count(self, name, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._counts[name] += amount
+            if file_logger.handlers:
+                self._unflushed_counts[name] += amount
+
+    def counts(self):
+        """
+        {name: total} for the counters
+        """
+        with self._lock:
+            return dict(sorted(self._counts.items()))
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self):
+        """
+        {name: {count, p50_ms, p95_ms, max_ms}} over the recent samples
+        """
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items() if values}
+        return {name: summarize(values) for name, values in sorted(samples.items())}
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        # Caller holds the lock
+        self._last_flush = time.monotonic()
+        if not self._unflushed and not self._unflushed_counts:
+            return
+        file_logger.info(json.dumps({
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "pid": os.getpid(),
+            "metrics": {name: summarize(values) for name, values in self._unflushed.items()},
+            "counts": dict(self._unflushed_counts)
+        }))
+        self._unflushed.clear()
+        self._unflushed_counts.clear()
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._unflushed.clear()
+            self._counts.clear()
+            self._unflushed_counts.clear()
+
+
+METRICS = Metrics()
+timer = METRICS.timer
+record = METRICS.record
+summary = METRICS.summary
+count = METRICS.count
+counts = METRICS.counts
+
+
+def configure(data_dir):
+    """
+    Start writing periodic summaries to DATA_DIR/metrics.jsonl (rotated at
+    METRICS_FILE_MAX_BYTES, keeping METRICS_FILE_BACKUPS old files)
+    """
+    if file_logger.handlers or not ENABLED:
+        return
+    handler = logging.handlers.RotatingFileHandler(
+        os.path.join(data_dir, METRICS_FILE_NAME), maxBytes=FILE_MAX_BYTES, backupCount=FILE_BACKUPS
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    file_logger.addHandler(handler)
+    file_logger.setLevel(logging.INFO)
+
+
+class TimedStorage:
+    """
+    Wraps a storage backend and times its load and save methods as
+    storage.<method>
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        if name not in TIMED_STORAGE_METHODS:
+            return attr
+
+        def timed(*args, **kwargs):
+            with timer(f"storage.{name}"):
+                return attr(*args, **kwargs)
+        return timed
+
+
+class SectionTimer:
+    """
+    Times consecutive sections of a script: start() ends the running section
+    and starts the next one, stop() ends the last
+    """
+
+    def __init__(self, prefix="section"):
+        self.prefix = prefix
+        self._name = None
+        self._start = None
+
+    def start(self, name):
+        self.stop()
+        self._name = name
+        self._start = time.perf_counter()
+
+    def stop(self):
+        if self._name is not None:
+            record(f"{self.prefix}.{self._name}", time.perf_counter() - self._start)
+            self._name = None
@@ -0,0 +1,114 @@
+"""
+Retention policy for the activity log.
+
+Entries older than LOG_RETENTION_DAYS are rolled up into one entry per
+user, activity and local day, and entries older than LOG_ROLLUP_WEEKLY_DAYS
+into one per week (starting Monday). A rollup is an ordinary log entry with
+the summed points plus a count and a period:
+
+    {"id": ..., "timestamp": <start of the day>, "points": 120,
+     "activity_id": ..., "count": 12, "period": "day"}
+
+so history totals and paging work unchanged, and balances are not touched.
+Level-up bonuses roll up per level. Compaction is journaled as a
+rollup_logs event carrying its cutoffs, so every backend and every replay
+computes the same rollups.
+
+LOG_RETENTION_DAYS=0 (the default) keeps every entry. Run
+`python retention.py [DATA_DIR]` to compact now.
+"""
+import hashlib
+import os
+import sys
+import time
+
+from history import local_day, week_start
+
+RAW_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "0"))
+WEEKLY_DAYS = int(os.getenv("LOG_ROLLUP_WEEKLY_DAYS", "0"))
+ENABLED = RAW_DAYS > 0
+
+PERIODS = ("day", "week")
+LABEL_KEYS = ("activity_id", "level", "activity")
+
+
+def cutoffs(now=None, raw_days=None, weekly_days=None):
+    """
+    (raw_before, weekly_before, offset) for the policy: epoch seconds at the
+    start of the local day raw_days ago, the start of the week weekly_days
+    ago (None when weekly rollups are off) and the local UTC offset
+    """
+    now = time.time() if now is None else now
+    raw_days = RAW_DAYS if raw_days is None else raw_days
+    weekly_days = WEEKLY_DAYS if weekly_days is None else weekly_days
+    offset = time.localtime(now).tm_gmtoff
+    today = local_day(int(now), offset)
+    raw_before = (today - raw_days) * 86400 - offset
+    weekly_before = None
+    if weekly_days:
+        weekly_before = week_start(today - max(weekly_days, raw_days)) * 86400 - offset
+    return raw_before, weekly_before, offset
+
+
+def label(entry):
+    for key in LABEL_KEYS:
+        if key in entry:
+            return key, entry[key]
+    return "activity", None
+
+
+def needs_rollup(entries, raw_before, weekly_before=None):
+    for entry in entries:
+        if entry["timestamp"] < raw_before and (
+                "period" not in entry
+                or weekly_before is not None and entry["period"] == "day" and entry["timestamp"] < weekly_before):
+            return True
+    return False
+
+
+def rollup(entries, raw_before, weekly_before=None, offset=0):
+    """
+    entries with everything before raw_before merged into daily rollups and
+    everything before weekly_before into weekly ones (existing rollups
+    included). Entries from raw_before on are returned as they are, after the
+    rollups.
+    """
+    kept = []
+    groups = {}
+    for entry in entries:
+        timestamp = entry["timestamp"]
+        if timestamp >= raw_before:
+            kept.append(entry)
+            continue
+        day = local_day(timestamp, offset)
+        if entry.get("period") == "week" or weekly_before is not None and timestamp < weekly_before:
+            key = ("week", week_start(day)) + label(entry)
+        else:
+            key = ("day", day) + label(entry)
+        group = groups.setdefault(key, [0, 0])
+        group[0] += entry["points"]
+        group[1] += entry.get("count", 1)
+
+    rolled = []
+    for (period, day, label_key, label_value), (points, count) in groups.items():
+        rolled.append({
+            "id": hashlib.sha1(f"{period}:{day}:{label_key}:{label_value}".encode()).hexdigest()[:12],
+            "timestamp": day * 86400 - offset,
+            "points": points,
+            label_key: label_value,
+            "count": count,
+            "period": period
+        })
+    rolled.sort(key=lambda e: e["timestamp"])
+    return rolled + kept
+
+
+if __name__ == "__main__":
+    import service
+
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv("DATA_DIR", "data")
+    if not ENABLED:
+        print("Set LOG_RETENTION_DAYS to the number of days of full detail to keep")
+        sys.exit(1)
+    result = service.TreatsDreamsService.open(data_dir).compact_logs()
+    print(f"Rolled up {result['before']} entries into {result['after']} for {result['users']} users")
@@ -0,0 +1,279 @@
+"""
+Treats & Dreams business rules, independent of Streamlit.
+
+The Streamlit page renders state and calls these methods; scripts can use
+the same service for imports, simulations and benchmarks:
+
+    service = TreatsDreamsService.open("data")
+    run = service.store.activities[0]
+    service.complete_activity("alice", run["id"])
+
+Catalog records (activities, treats, dreams) are addressed by their stable
+ids, so a rename or a reorder never changes what an id refers to.
+"""
+import math
+import time
+
+import catalog
+import history
+import metrics
+import retention
+import state_store
+import storage
+from leveling import calculate_level, calculate_points_needed
+
+
+def level_bonus(points_needed):
+    """
+    Bonus for reaching a level: 10% of the points needed for the next level, min 1
+    """
+    next_level_points = points_needed if points_needed > 0 else 1
+    return max(1, math.ceil(next_level_points * 0.10))
+
+
+def completion_events(user, activity, current_points, timestamp):
+    """
+    Events for completing an activity record when the user has
+    current_points: the completion plus a level-up bonus for every level it
+    reaches, including levels the bonuses themselves reach. timestamp is in
+    epoch seconds.
+    """
+    points = activity["points"]
+    level = calculate_level(current_points)[0]
+
+    events = [{
+        "type": "complete",
+        "user": user,
+        "id": history.new_entry_id(),
+        "timestamp": timestamp,
+        "activity_id": activity["id"],
+        "points": points
+    }]
+    total_points = current_points + points
+    new_level = calculate_level(total_points)[0]
+    while level < new_level:
+        level += 1
+        bonus = level_bonus(calculate_level(calculate_points_needed(level))[2])
+        events.append({
+            "type": "level_bonus",
+            "user": user,
+            "id": history.new_entry_id(),
+            "timestamp": timestamp,
+            "level": level,
+            "points": bonus
+        })
+        total_points += bonus
+        new_level = max(new_level, calculate_level(total_points)[0])
+    return events
+
+
+class TreatsDreamsService:
+    def __init__(self, store):
+        self.store = store
+
+    @classmethod
+    def open(cls, data_dir, backend=None, read_only=False):
+        return cls(state_store.StateStore(storage.get_storage(data_dir, backend), read_only))
+
+    @staticmethod
+    def _require(record, kind):
+        if record is None:
+            raise ValueError(f"{kind} not found.")
+        return record
+
+    # ---- Users ----
+    def add_user(self, name):
+        store = self.store
+        with store.lock:
+            if name in store.users:
+                raise ValueError("User already exists.")
+            # Start from an empty log, also in storage, even if a user of
+            # that name was deleted before logs were dropped with them
+            store.commit_events([{"type": "reset_user", "user": name}])
+            with store.transaction("users", "treats"):
+                store.users.append(name)
+                store.user_banks[name] = state_store.default_user_bank()
+
+    def delete_user(self, name):
+        store = self.store
+        with store.lock:
+            # Drop the log with the user
+            store.commit_events([{"type": "reset_user", "user": name}])
+            with store.transaction("users", "treats"):
+                if name in store.users:
+                    store.users.remove(name)
+                store.user_banks.pop(name, None)
+
+    def reset_user(self, name):
+        """
+        Zero a user's points, mark their treats unpurchased and clear their log
+        """
+        if name in self.store.user_banks:
+            self.store.commit_events([{"type": "reset_user", "user": name}])
+
+    def level(self, name):
+        """
+        (level, points_in_level, points_needed) for a user
+        """
+        with metrics.timer("level.calculate"):
+            return calculate_level(self.store.user_banks.get(name, {}).get("activity_points", 0))
+
+    # ---- Activities ----
+    def add_activity(self, name, points):
+        activity = {"id": catalog.new_id(), "name": name, "points": points}
+        with self.store.transaction("activities"):
+            self.store.activities.append(activity)
+        return activity
+
+    def edit_activity(self, activity_id, name, points):
+        with self.store.transaction("activities"):
+            self._require(self.store.activity(activity_id), "Activity").update(name=name, points=points)
+
+    def delete_activity(self, activity_id):
+        store = self.store
+        with store.transaction("activities"):
+            activity = self._require(store.activity(activity_id), "Activity")
+            store.activities.remove(activity)
+            # History entries keep showing the name it had
+            store.bank["retired_activities"][activity_id] = activity["name"]
+
+    def complete_activity(self, user, activity_id, timestamp=None):
+        """
+        Log a completed activity, awarding a level-up bonus for every new
+        level it reaches. Returns the events that were committed.
+        """
+        return self.complete_activities(user, [activity_id], timestamp)
+
+    def complete_activities(self, user, activity_ids, timestamp=None):
+        """
+        Log several completed activities in order, with their level-up
+        bonuses, as one commit (one save and one change notification).
+        Returns the events that were committed.
+        """
+        store = self.store
+        if timestamp is None:
+            timestamp = int(time.time())
+        # Hold the lock so the level-up checks see the balance the events
+        # are applied to
+        with metrics.timer("service.complete_activity"), store.lock:
+            if user not in store.user_banks:
+                raise ValueError(f"Unknown user '{user}'.")
+            activities = [self._require(store.activity(activity_id), "Activity") for activity_id in activity_ids]
+            if not activities:
+                raise ValueError("No activities selected.")
+            points = store.user_banks[user]["activity_points"]
+            events = []
+            for activity in activities:
+                completed = completion_events(user, activity, points, timestamp)
+                points += sum(event["points"] for event in completed)
+                events.extend(completed)
+            store.commit_events(events)
+        return events
+
+    def delete_log_entry(self, user, entry_id):
+        """
+        Remove an activity log entry and take its points back
+        """
+        entry = self.store.history(user).by_id.get(entry_id)
+        if entry is None:
+            raise ValueError("Activity log entry not found.")
+        self.store.commit_events([{
+            "type": "delete_log",
+            "user": user,
+            "id": entry_id,
+            "timestamp": entry["timestamp"],
+            "points": entry["points"]
+        }])
+        return entry
+
+    def compact_logs(self, now=None, raw_days=None, weekly_days=None):
+        """
+        Roll up log entries older than the retention policy (see retention)
+        for every user that has any. Returns counts of entries before and
+        after and of users changed.
+        """
+        raw_days = retention.RAW_DAYS if raw_days is None else raw_days
+        if raw_days <= 0:
+            raise ValueError("Log retention is off (LOG_RETENTION_DAYS is 0).")
+        raw_before, weekly_before, offset = retention.cutoffs(now, raw_days, weekly_days)
+        store = self.store
+        result = {"users": 0, "before": 0, "after": 0}
+        with metrics.timer("service.compact_logs"), store.lock:
+            events = [
+                {"type": "rollup_logs", "user": user, "raw_before": raw_before,
+                 "weekly_before": weekly_before, "offset": offset}
+                for user, entries in store.activity_logs.items()
+                if retention.needs_rollup(entries, raw_before, weekly_before)
+            ]
+            if events:
+                before = sum(len(store.activity_logs[event["user"]]) for event in events)
+                store.commit_events(events)
+                result = {
+                    "users": len(events),
+                    "before": before,
+                    "after": sum(len(store.activity_logs[event["user"]]) for event in events)
+                }
+        return result
+
+    # ---- Treats ----
+    def add_treat(self, user, name, cost):
+        treat = {"id": catalog.new_id(), "name": name, "cost": cost, "purchased": False}
+        with self.store.transaction("treats"):
+            self.store.user_banks[user].setdefault("treats", []).append(treat)
+        return treat
+
+    def edit_treat(self, user, treat_id, name, cost):
+        with self.store.transaction("treats"):
+            self._require(self.store.treat(user, treat_id), "Treat").update(name=name, cost=cost)
+
+    def delete_treat(self, user, treat_id):
+        store = self.store
+        with store.transaction("treats"):
+            store.user_banks[user]["treats"].remove(self._require(store.treat(user, treat_id), "Treat"))
+
+    def buy_treat(self, user, treat_id):
+        """
+        Mark a treat purchased and move its cost into the shared dream bank
+        """
+        store = self.store
+        with store.lock:
+            treat = self._require(store.treat(user, treat_id), "Treat")
+            if treat.get("purchased", False):
+                raise ValueError(f"Treat '{treat['name']}' is already purchased.")
+            if store.user_banks[user]["activity_points"] < treat["cost"]:
+                raise ValueError(f"Not enough points for '{treat['name']}'.")
+            store.commit_events([{"type": "buy_treat", "user": user, "treat_id": treat_id, "cost": treat["cost"]}])
+        return treat
+
+    # ---- Dreams ----
+    def add_dream(self, name, cost):
+        dream = {"id": catalog.new_id(), "name": name, "cost": cost, "purchased_by": state_store.PurchasedBy()}
+        with self.store.transaction("dreams"):
+            self.store.dreams.append(dream)
+        return dream
+
+    def edit_dream(self, dream_id, name, cost):
+        with self.store.transaction("dreams"):
+            self._require(self.store.dream(dream_id), "Dream").update(name=name, cost=cost)
+
+    def delete_dream(self, dream_id):
+        store = self.store
+        with store.transaction("dreams"):
+            store.dreams.remove(self._require(store.dream(dream_id), "Dream"))
+
+    def buy_dream(self, user, dream_id):
+        """
+        Buy a dream for a user with points from the shared dream bank
+        """
+        store = self.store
+        with store.lock:
+            dream = self._require(store.dream(dream_id), "Dream")
+            if user in dream["purchased_by"]:
+                raise ValueError(f"Dream '{dream['name']}' is already purchased.")
+            if store.dream_bank < dream["cost"]:
+                raise ValueError(f"Not enough points in the Dream Bank for '{dream['name']}'.")
+            store.commit_events([{"type": "buy_dream", "user": user, "dream_id": dream_id, "cost": dream["cost"]}])
+        return dream
+
+    def reset_dream_bank(self):
+        self.store.commit_events([{"type": "reset_dream_bank"}])
@@ -0,0 +1,213 @@
+"""
+Compact binary copy of activity.json for fast cold starts.
+
+The activity log is stored column by column: per-user entry counts, then
+epoch seconds, indexes into an interned label table (activity id, bonus
+level or retired activity name), points and entry ids, each as a packed
+array, then the positions, counts and periods of rollup entries (see
+retention). The file records the inode, size and
+mtime of the activity.json it was built from and is only used while that still
+matches, so activity.json stays the source of truth and a stale or damaged
+snapshot just means falling back to JSON.
+
+Enabled with SNAPSHOT_FORMAT=binary (JSON backend only).
+"""
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+
+SNAPSHOT_FILE_NAME = "activity.bin"
+ENABLED = os.getenv("SNAPSHOT_FORMAT", "json").lower() == "binary"
+
+MAGIC = b"TDLOGS03"
+# source inode, size and mtime_ns, then users, labels, entries, entries
+# without id, rollup entries
+HEADER = struct.Struct("<qqqIIIII")
+ID_LENGTH = 12
+NO_ID = b" " * ID_LENGTH
+ENTRY_KEYS = {"timestamp", "points", "id"}
+ROLLUP_KEYS = {"count", "period"}
+LABEL_KEYS = {"activity_id", "level", "activity"}
+PERIODS = ["day", "week"]
+
+
+def source_fingerprint(path):
+    # Every write replaces activity.json, so the inode changes too
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _packed(arr):
+    if sys.byteorder != "little":
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _unpacked(typecode, data):
+    arr = array.array(typecode)
+    arr.frombytes(data)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+
+def _table(items):
+    data = json.dumps(items).encode()
+    return struct.pack("<I", len(data)) + data
+
+
+class _Unsupported(Exception):
+    """
+    An entry the binary format cannot reproduce exactly
+    """
+
+
+def encode(activity_logs, fingerprint):
+    """
+    Binary snapshot bytes for activity_logs, or None if some entry cannot be
+    represented (string timestamp, extra keys, non-integer points)
+    """
+    users = list(activity_logs)
+    labels = {}
+    counts = array.array("I")
+    epochs = array.array("q")
+    label_ids = array.array("I")
+    points = array.array("q")
+    ids = []
+    missing_ids = array.array("I")
+    rollups = array.array("I")
+    rollup_counts = array.array("I")
+    rollup_periods = array.array("B")
+    try:
+        for user in users:
+            logs = activity_logs[user]
+            counts.append(len(logs))
+            for entry in logs:
+                keys = entry.keys() - ENTRY_KEYS
+                if "period" in keys:
+                    keys -= ROLLUP_KEYS
+                    rollups.append(len(epochs))
+                    rollup_counts.append(entry["count"])
+                    rollup_periods.append(PERIODS.index(entry["period"]))
+                if (len(keys) != 1 or type(entry["timestamp"]) is not int
+                        or type(entry["points"]) is not int):
+                    raise _Unsupported(entry)
+                key = keys.pop()
+                if key not in LABEL_KEYS:
+                    raise _Unsupported(entry)
+                epochs.append(entry["timestamp"])
+                label_ids.append(labels.setdefault((key, entry[key]), len(labels)))
+                points.append(entry["points"])
+                entry_id = entry.get("id")
+                if entry_id is None:
+                    missing_ids.append(len(ids))
+                    ids.append(NO_ID)
+                elif isinstance(entry_id, str) and len(entry_id) == ID_LENGTH and entry_id.isascii():
+                    ids.append(entry_id.encode())
+                else:
+                    raise _Unsupported(entry)
+    except (_Unsupported, KeyError, TypeError, ValueError, OverflowError):
+        return None
+    return b"".join([
+        MAGIC,
+        HEADER.pack(*fingerprint, len(users), len(labels), len(epochs), len(missing_ids), len(rollups)),
+        _table(users),
+        _table(list(labels)),
+        _packed(counts),
+        _packed(epochs),
+        _packed(label_ids),
+        _packed(points),
+        b"".join(ids),
+        _packed(missing_ids),
+        _packed(rollups),
+        _packed(rollup_counts),
+        _packed(rollup_periods)
+    ])
+
+
+def decode(data, fingerprint):
+    """
+    activity_logs from snapshot bytes, or None if they were built from a
+    different activity.json
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        return None
+    pos = len(MAGIC)
+    inode, size, mtime_ns, n_users, _, n_entries, n_missing, n_rollups = HEADER.unpack_from(data, pos)
+    if (inode, size, mtime_ns) != tuple(fingerprint):
+        return None
+    pos += HEADER.size
+    tables = []
+    for _ in range(2):
+        (length,) = struct.unpack_from("<I", data, pos)
+        tables.append(json.loads(bytes(data[pos + 4:pos + 4 + length])))
+        pos += 4 + length
+    users, labels = tables
+
+    columns = []
+    for typecode, count in (("I", n_users), ("q", n_entries), ("I", n_entries), ("q", n_entries)):
+        nbytes = count * array.array(typecode).itemsize
+        columns.append(_unpacked(typecode, data[pos:pos + nbytes]))
+        pos += nbytes
+    counts, epochs, label_ids, points = columns
+    ids = bytes(data[pos:pos + n_entries * ID_LENGTH]).decode("ascii")
+    pos += n_entries * ID_LENGTH
+    missing_ids = _unpacked("I", data[pos:pos + n_missing * 4])
+    pos += n_missing * 4
+    rollups = _unpacked("I", data[pos:pos + n_rollups * 4])
+    rollup_counts = _unpacked("I", data[pos + n_rollups * 4:pos + n_rollups * 8])
+    rollup_periods = _unpacked("B", data[pos + n_rollups * 8:pos + n_rollups * 9])
+
+    labels = [tuple(label) for label in labels]
+    entries = [
+        {"timestamp": t, labels[k][0]: labels[k][1], "points": p, "id": ids[i:i + ID_LENGTH]}
+        for i, t, k, p in zip(range(0, n_entries * ID_LENGTH, ID_LENGTH), epochs, label_ids, points)
+    ]
+    for i in missing_ids:
+        del entries[i]["id"]
+    for i, count, period in zip(rollups, rollup_counts, rollup_periods):
+        entries[i]["count"] = count
+        entries[i]["period"] = PERIODS[period]
+
+    activity_logs = {}
+    start = 0
+    for user, count in zip(users, counts):
+        activity_logs[user] = entries[start:start + count]
+        start += count
+    return activity_logs
+
+
+def write(path, activity_logs, source_path):
+    """
+    Write the snapshot for the activity.json at source_path, or remove a
+    stale one if the logs cannot be represented
+    """
+    data = encode(activity_logs, source_fingerprint(source_path))
+    if data is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return True
+
+
+def read(path, source_path):
+    """
+    activity_logs from the snapshot if it matches source_path, else None
+    """
+    try:
+        fingerprint = source_fingerprint(source_path)
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as data:
+                return decode(data, fingerprint)
+    except (OSError, ValueError, BufferError, struct.error, UnicodeDecodeError):
+        return None
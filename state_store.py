@@ -0,0 +1,458 @@
+"""
+Process-wide state store shared by all Streamlit sessions.
+
+The store owns the one in-memory copy of users, activities, dreams, user
+banks, the dream bank and activity logs. Sessions read it directly and change
+it only through commit_events() (balance changes) or transaction() (catalog
+edits), which persist the change and bump a version counter. Sessions compare
+the version with the last one they saw and ask changes_since() which
+sections changed.
+
+With write-behind persistence (storage.WRITE_BEHIND_MS) a change is only
+journaled when it is committed; the store then flushes the storage from a
+background timer, at most once per delay, and once more at exit.
+"""
+import atexit
+import collections
+import copy
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import catalog
+import history
+import journal
+import metrics
+
+# Number of recent changes kept for changes_since()
+CHANGE_LOG_SIZE = 256
+# Log the in-memory copy's hit rate every this many sync() checks
+CACHE_LOG_EVERY = int(os.getenv("STORAGE_CACHE_LOG_EVERY", "100"))
+
+DEFAULT_ACTIVITIES = [
+    {"name": "Run 5km", "points": 10},
+    {"name": "Yoga 30min", "points": 5}
+]
+DEFAULT_DREAMS = [
+    {"name": "Weekend Trip", "cost": 100, "purchased_by": []}
+]
+DEFAULT_TREATS = [
+    {"name": "Ice Cream", "cost": 15, "purchased": False}
+]
+
+logger = logging.getLogger(__name__)
+
+
+def default_user_bank():
+    return {"activity_points": 0, "treats": copy.deepcopy(DEFAULT_TREATS)}
+
+
+class PurchasedBy(list):
+    """
+    Users who bought a dream, in purchase order, with O(1) membership tests.
+    Serializes as a plain JSON list. Change it only with append() and remove().
+    """
+
+    def __init__(self, users=()):
+        super().__init__(dict.fromkeys(users))
+        self._members = set(self)
+
+    def __contains__(self, user):
+        return user in self._members
+
+    def __reduce__(self):
+        return PurchasedBy, (list(self),)
+
+    def append(self, user):
+        if user not in self._members:
+            super().append(user)
+            self._members.add(user)
+
+    def remove(self, user):
+        super().remove(user)
+        self._members.discard(user)
+
+
+def event_topics(event):
+    """
+    Sections of the state an event changes
+    """
+    kind = event["type"]
+    user = event.get("user")
+    if kind in ("complete", "level_bonus", "delete_log", "reset_user"):
+        return {"user_banks", f"activity_logs:{user}"}
+    if kind == "rollup_logs":
+        return {f"activity_logs:{user}"}
+    if kind == "buy_treat":
+        return {"user_banks", "dream_bank"}
+    if kind == "buy_dream":
+        return {"dream_purchases", "dream_bank"}
+    if kind == "reset_dream_bank":
+        return {"dream_bank"}
+    return {"all"}
+
+
+class StateStore:
+    def __init__(self, storage, read_only=False):
+        # A read-only store (the API process) never writes, not even the
+        # one-time id migration of old data; it adds the same ids in memory
+        self.storage = storage
+        self.read_only = read_only
+        self.lock = threading.RLock()
+        self.version = 0
+        self.reloads = 0
+        # sync() checks that found this copy current, and that reloaded it
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._changes = collections.deque(maxlen=CHANGE_LOG_SIZE)
+        self._deferred = threading.local()
+        self._flush_timer = None
+        self._flush_lock = threading.Lock()
+        self._load()
+        if self.storage.write_behind_ms:
+            atexit.register(self.flush)
+
+    # ---- Loading ----
+    def _load(self):
+        users = self.storage.load_users()
+        bank, activity_logs = self.storage.load_state()
+        self.users = users
+        self.bank = {
+            "activities": bank.get("activities", copy.deepcopy(DEFAULT_ACTIVITIES)),
+            "dreams": bank.get("dreams", copy.deepcopy(DEFAULT_DREAMS)),
+            "user_banks": bank["user_banks"] if "user_banks" in bank else {
+                user: default_user_bank() for user in users
+            },
+            "dream_bank": bank.get("dream_bank", 0),
+            # Names of deleted activities, for their history entries
+            "retired_activities": bank.get("retired_activities", {})
+        }
+        for dream in self.bank["dreams"]:
+            dream["purchased_by"] = PurchasedBy(dream.get("purchased_by", []))
+        self.activity_logs = activity_logs
+        self._histories = {}
+        migrated = self._reindex()
+        migrated = self._normalize_logs() or migrated
+        if migrated and bank and not self.read_only:
+            # Data saved before catalog ids: store the ids once so every
+            # process and later event refers to the same records
+            self.storage.save_snapshot(self.bank, self.activity_logs)
+            logger.info("state store: added catalog ids and converted activity logs")
+        self._storage_version = self.storage.version()
+        self.reloads += 1
+
+    def _normalize_logs(self):
+        activity_ids = {}
+        for activity in self.activities:
+            activity_ids.setdefault(activity["name"], activity["id"])
+        changed = False
+        for user, entries in self.activity_logs.items():
+            for position, entry in enumerate(entries):
+                if "activity" in entry or "id" not in entry or isinstance(entry["timestamp"], str):
+                    changed = history.normalize_entry(entry, user, position, activity_ids) or changed
+        return changed
+
+    def sync(self):
+        """
+        Reload if another process changed the stored data. Costs a few
+        os.stat calls when nothing changed.
+        """
+        if self.storage.version() == self._storage_version:
+            self._count_lookup(True)
+            return False
+        with self.lock:
+            if self.storage.version() == self._storage_version:
+                self._count_lookup(True)
+                return False
+            self._load()
+            logger.info("state store: reloaded after an external change (%d reloads)", self.reloads)
+            self._count_lookup(False)
+            self._bump({"all"})
+            return True
+
+    def _count_lookup(self, hit):
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+        metrics.count("state_cache.hits" if hit else "state_cache.misses")
+        if (self.cache_hits + self.cache_misses) % CACHE_LOG_EVERY == 0:
+            stats = self.cache_stats()
+            logger.info(
+                "state cache: %d hits, %d misses (%.1f%% hit rate)",
+                stats["hits"], stats["misses"], stats["hit_rate"] * 100
+            )
+
+    def cache_stats(self):
+        """
+        How often sync() could keep the in-memory copy: hits, misses
+        (reloads) and the hit rate
+        """
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_rate": self.cache_hits / lookups if lookups else 0.0
+        }
+
+    # ---- Read access ----
+    @property
+    def storage_version(self):
+        """
+        Fingerprint of the stored data this copy reflects (Storage.version)
+        """
+        return self._storage_version
+
+    @property
+    def activities(self):
+        return self.bank["activities"]
+
+    @property
+    def dreams(self):
+        return self.bank["dreams"]
+
+    @property
+    def user_banks(self):
+        return self.bank["user_banks"]
+
+    @property
+    def dream_bank(self):
+        return self.bank["dream_bank"]
+
+    def activity(self, activity_id):
+        return self._activities_by_id.get(activity_id)
+
+    def dream(self, dream_id):
+        return self._dreams_by_id.get(dream_id)
+
+    def treat(self, user, treat_id):
+        return self._treats_by_id.get(user, {}).get(treat_id)
+
+    def entry_label(self, entry):
+        """
+        Display name of a log entry (see history.entry_label)
+        """
+        return history.entry_label(entry, self._activities_by_id, self.bank["retired_activities"])
+
+    def name_index(self, kind, user=None):
+        """
+        Shared catalog.NameIndex over "activities", "dreams" or a user's
+        "treats", rebuilt after catalog edits
+        """
+        with self.lock:
+            key = (kind, user)
+            if key not in self._name_indexes:
+                if kind == "treats":
+                    records = self.user_banks.get(user, {}).get("treats", [])
+                else:
+                    records = self.bank[kind]
+                with metrics.timer("catalog.index"):
+                    self._name_indexes[key] = catalog.NameIndex(records)
+            return self._name_indexes[key]
+
+    def treats_purchased(self, user):
+        return self._treats_purchased.get(user, 0)
+
+    def dreams_purchased(self, user):
+        return self._dreams_purchased.get(user, 0)
+
+    def history(self, user):
+        """
+        Shared timestamp-ordered index over a user's activity log
+        """
+        with self.lock:
+            if user not in self._histories:
+                with metrics.timer("history.index"):
+                    self._histories[user] = history.HistoryIndex(self.activity_logs.setdefault(user, []))
+            return self._histories[user]
+
+    # ---- Change notification ----
+    def changes_since(self, version):
+        """
+        Topics changed after version, or None if that is too far back to
+        tell (callers should then treat everything as changed)
+        """
+        if version == self.version:
+            return set()
+        if version is None or not self._changes or self._changes[0][0] > version + 1:
+            return None
+        topics = set()
+        for change_version, change_topics in self._changes:
+            if change_version > version:
+                topics |= change_topics
+        return None if "all" in topics else topics
+
+    def _bump(self, topics):
+        self.version += 1
+        self._changes.append((self.version, frozenset(topics)))
+
+    # ---- Changes ----
+    def _reindex(self):
+        """
+        Give catalog records ids where missing and rebuild the id indexes
+        and purchase counters. Returns True if any record got a new id.
+        """
+        changed = catalog.ensure_ids(self.activities, "activity")
+        changed = catalog.ensure_ids(self.dreams, "dream") or changed
+        for user, user_bank in self.user_banks.items():
+            changed = catalog.ensure_ids(user_bank.setdefault("treats", []), "treat", user) or changed
+        self._name_indexes = {}
+        self._activities_by_id = catalog.index_by_id(self.activities)
+        self._dreams_by_id = catalog.index_by_id(self.dreams)
+        self._treats_by_id = {
+            user: catalog.index_by_id(user_bank["treats"]) for user, user_bank in self.user_banks.items()
+        }
+        self._count_purchases()
+        return changed
+
+    def _count_purchases(self):
+        # Full recount, after loading and catalog edits; events keep the
+        # counters up to date incrementally
+        self._treats_purchased = {
+            user: sum(1 for t in user_bank.get("treats", []) if t.get("purchased", False))
+            for user, user_bank in self.user_banks.items()
+        }
+        self._dreams_purchased = collections.Counter(
+            user for dream in self.dreams for user in dream["purchased_by"]
+        )
+
+    def _apply(self, event, deferred=False):
+        journal.apply_to_bank(event, self.bank)
+        kind = event["type"]
+        user = event.get("user")
+        if kind in ("complete", "level_bonus") and deferred:
+            # Bulk entries may land anywhere in the timeline, so append them
+            # and let history() re-sort once instead of inserting one by one
+            self.activity_logs.setdefault(user, []).append(journal.log_entry(event))
+            self._histories.pop(user, None)
+        elif kind in ("complete", "level_bonus"):
+            self.history(user).add(journal.log_entry(event))
+        elif kind == "delete_log":
+            self.history(user).remove(event["id"])
+        elif kind == "buy_treat":
+            self._treats_purchased[user] = self._treats_purchased.get(user, 0) + 1
+        elif kind == "buy_dream":
+            self._dreams_purchased[user] += 1
+        elif kind == "reset_user":
+            self.activity_logs[user] = []
+            self._histories.pop(user, None)
+            self._treats_purchased[user] = 0
+        elif kind == "rollup_logs":
+            journal.apply_to_logs(event, self.activity_logs)
+            self._histories.pop(user, None)
+
+    def commit_events(self, events):
+        """
+        Apply balance-changing events (see journal.apply_event) and persist
+        them (at the end of deferred() if this thread is inside one)
+        """
+        deferred = getattr(self._deferred, "events", None) is not None
+        with self.lock:
+            topics = set()
+            for event in events:
+                self._apply(event, deferred)
+                topics |= event_topics(event)
+            if deferred:
+                self._deferred.events.extend(events)
+            else:
+                self._persist(lambda: self.storage.record_events(events, self.bank, self.activity_logs))
+            self._bump(topics)
+
+    @contextmanager
+    def deferred(self):
+        """
+        Apply this thread's commit_events() in memory only and persist them
+        on persist_deferred() and on exit, as events (deltas) like any other
+        commit, so changes other sessions and processes store meanwhile are
+        kept. Other sessions see each batch as it is committed.
+        """
+        with self.lock:
+            # Make sure there is a stored snapshot before the in-memory state
+            # gets ahead of it; the first record_events() writes one
+            self._persist(lambda: self.storage.record_events([], self.bank, self.activity_logs))
+        self._deferred.events = []
+        try:
+            yield self
+        finally:
+            try:
+                self.persist_deferred()
+            finally:
+                self._deferred.events = None
+
+    def persist_deferred(self):
+        """
+        Persist the events this thread's deferred() block committed so far,
+        so a long block (a bulk import) only holds one batch of them
+        """
+        events, self._deferred.events = self._deferred.events, []
+        if events:
+            with self.lock:
+                self._persist(lambda: self.storage.record_events(events, self.bank, self.activity_logs))
+
+    @contextmanager
+    def transaction(self, *topics):
+        """
+        Edit the catalog (users, activities, treats, dreams) in place, then
+        save it. Balances and purchases are kept as stored; see
+        journal.merge_balances.
+        """
+        with self.lock:
+            yield self
+            self._reindex()
+
+            def save():
+                if "users" in topics:
+                    self.storage.save_users(self.users)
+                self.storage.save_bank(self.bank, self.activity_logs)
+
+            self._persist(save)
+            self._bump(set(topics) or {"all"})
+
+    def _persist(self, save):
+        # Caller holds the lock. The stored data only becomes this copy's
+        # version if nothing else changed it since this copy was loaded;
+        # otherwise the next sync() reloads the merged result.
+        if self.read_only:
+            raise RuntimeError("This state store is read-only.")
+        unchanged = self.storage.version() == self._storage_version
+        save()
+        if unchanged:
+            self._storage_version = self.storage.version()
+        self._schedule_flush()
+
+    # ---- Write-behind ----
+    def _schedule_flush(self):
+        delay = self.storage.write_behind_ms
+        if not delay:
+            return
+        with self._flush_lock:
+            if self._flush_timer is None:
+                # Later changes ride along with this flush
+                self._flush_timer = threading.Timer(delay / 1000, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        """
+        Write out changes this store held back by write-behind persistence
+        now, if there are any
+        """
+        with self._flush_lock:
+            if self._flush_timer is None:
+                return
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        expected = self._storage_version
+        try:
+            version = self.storage.flush(expected)
+        except OSError:
+            # The journal still has the changes; the next flush or load
+            # picks them up
+            logger.exception("state store: write-behind flush failed")
+            return
+        with self.lock:
+            # Flushing rewrites the files without changing the data, so keep
+            # sync() from reloading it unless something else changed too
+            if version is not None and self._storage_version == expected:
+                self._storage_version = version
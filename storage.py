@@ -0,0 +1,941 @@
+"""
+Storage backends for users, bank data and activity logs.
+
+The JSON backend keeps the original users.json/bank.json/activity.json layout
+plus the append-only journal. The SQLite backend stores the same data in
+indexed tables so each completion or purchase is a small transaction.
+
+Select a backend with STORAGE_BACKEND=json|sqlite (default json). Data lives
+under DATA_DIR either way. The memory backend keeps nothing on disk and is
+meant for simulations and benchmarks.
+
+Set WRITE_BEHIND_MS to a delay in milliseconds to take snapshot writes off
+the request path (JSON backend): changes are only appended to the journal,
+which is fsynced, and folded into the JSON files at most that often by a
+background flush (see StateStore.flush).
+
+Run `python storage.py migrate` to copy existing JSON data into SQLite.
+"""
+import bisect
+import copy
+import io
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+from contextlib import closing, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import history
+import journal
+import retention
+import snapshot
+
+DEFAULT_BACKEND = "json"
+SQLITE_FILE_NAME = "treatsdreams.db"
+
+# Delay before journaled changes are folded into the JSON files; 0 writes
+# them synchronously
+WRITE_BEHIND_MS = int(os.getenv("WRITE_BEHIND_MS", "0"))
+
+
+# ---- Safe file writes ----
+class FileLock:
+    """
+    Exclusive OS-level lock on a file in DATA_DIR, shared by every process
+    and thread that writes there. Re-entrant within a thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @contextmanager
+    def __call__(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            lock_file = open(self.path, "a+")
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            self._local.file = lock_file
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                lock_file = self._local.file
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+                lock_file.close()
+                self._local.file = None
+
+
+def atomic_write_json(path, data):
+    """
+    Write to a temp file, fsync it and swap it in, so readers and crashes
+    never see a half-written file
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        # dumps runs entirely in the C encoder; dump writes chunk by chunk
+        f.write(json.dumps(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# ---- Streaming reads ----
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def json_object_items(f, read_size=1 << 20):
+    """
+    Yield the (key, value) pairs of the JSON object in a text file one at a
+    time, so only one value (e.g. one user's log) is in memory at once
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def fill():
+        # Drop what is parsed and at least double what is left, so a long
+        # value is parsed a few times at most
+        nonlocal buffer, pos, eof
+        data = f.read(max(read_size, len(buffer) - pos))
+        eof = not data
+        buffer, pos = buffer[pos:] + data, 0
+
+    def next_char():
+        nonlocal pos
+        while True:
+            pos = JSON_WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if eof:
+                raise ValueError(f"{getattr(f, 'name', 'JSON')}: unexpected end of file")
+            fill()
+
+    def value():
+        nonlocal pos
+        next_char()
+        while True:
+            try:
+                result, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if end < len(buffer) or eof:
+                pos = end
+                return result
+            # A number may go on in the next read
+            fill()
+
+    def expect(chars):
+        nonlocal pos
+        char = next_char()
+        if char not in chars:
+            raise ValueError(f"{getattr(f, 'name', 'JSON')}: expected one of {chars!r}, found {char!r}")
+        pos += 1
+        return char
+
+    expect("{")
+    if next_char() == "}":
+        return
+    while True:
+        key = value()
+        expect(":")
+        yield key, value()
+        if expect(",}") == "}":
+            return
+
+
+def _range_chunks(user, entries, start, end, chunk_size):
+    # (user, entries) chunks of one user's log in timestamp order, from start
+    # (inclusive) to end (exclusive)
+    timestamps = [history.to_epoch(entry["timestamp"]) for entry in entries]
+    if any(a > b for a, b in zip(timestamps, timestamps[1:])):
+        # Imported entries may be out of order
+        order = sorted(range(len(entries)), key=timestamps.__getitem__)
+        entries = [entries[i] for i in order]
+        timestamps = [timestamps[i] for i in order]
+    first = 0 if start is None else bisect.bisect_left(timestamps, start)
+    stop = len(entries) if end is None else bisect.bisect_left(timestamps, end)
+    for i in range(first, stop, chunk_size):
+        yield user, entries[i:min(i + chunk_size, stop)]
+
+
+class Storage:
+    """
+    Interface shared by all backends
+    """
+
+    # Milliseconds the caller may wait before calling flush(); 0 means every
+    # save is complete when it returns
+    write_behind_ms = 0
+
+    def load_users(self):
+        raise NotImplementedError
+
+    def save_users(self, users):
+        raise NotImplementedError
+
+    def load_bank(self):
+        raise NotImplementedError
+
+    def save_bank(self, bank, activity_logs):
+        """
+        Write activities, dreams, treats and users' banks. Stored balances
+        (activity points and the dream bank) are kept; see
+        journal.merge_balances.
+        activity_logs is the caller's current log state, for backends that
+        need it to build a snapshot.
+        """
+        raise NotImplementedError
+
+    def load_activity_logs(self):
+        raise NotImplementedError
+
+    def load_state(self):
+        """
+        (bank, activity_logs) together, for backends that can read both in
+        one pass
+        """
+        return self.load_bank(), self.load_activity_logs()
+
+    def log_chunks(self, users, start=None, end=None, chunk_size=5_000):
+        """
+        Yield (user, entries) for users' log entries with start <= timestamp
+        < end (epoch seconds; either may be None), oldest first and at most
+        chunk_size at a time. This loads every log and filters it; backends
+        override it to read less (SQLite only the range, JSON one user's
+        log at a time).
+        """
+        activity_logs = self.load_activity_logs()
+        for user in users:
+            # Drop each full log once it is filtered
+            yield from _range_chunks(user, activity_logs.pop(user, []), start, end, chunk_size)
+
+    def save_activity_logs(self, activity_logs):
+        raise NotImplementedError
+
+    def save_snapshot(self, bank, activity_logs):
+        """
+        Replace all stored bank data and activity logs, balances included,
+        in one write. Events stored meanwhile by other processes are
+        overwritten, so this is for migrations and tools that own the data.
+        """
+        raise NotImplementedError
+
+    def record_events(self, events, bank, activity_logs):
+        """
+        Persist completions, purchases and other balance changes (see
+        journal.apply_event) that have already been applied to bank and
+        activity_logs. Events are applied as deltas to the stored data.
+        """
+        raise NotImplementedError
+
+    def flush(self, expected_version=None):
+        """
+        Write out changes held back by write-behind persistence. Returns the
+        new version() if the stored data was at expected_version before the
+        flush (nothing else changed it meanwhile), else None.
+        """
+        return None
+
+    def data_files(self):
+        """
+        Paths whose mtime/size change whenever stored data changes
+        """
+        raise NotImplementedError
+
+    def version(self):
+        """
+        Fingerprint of the stored data; changes whenever any data file changes
+        """
+        fingerprint = []
+        for path in self.data_files():
+            try:
+                stat = os.stat(path)
+                fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                fingerprint.append((path, None, None))
+        return tuple(fingerprint)
+
+
+# ---- JSON files + journal ----
+class JsonStorage(Storage):
+    def __init__(self, data_dir, binary_snapshot=None, write_behind_ms=None):
+        self.data_dir = data_dir
+        self.users_file = os.path.join(data_dir, "users.json")
+        self.bank_file = os.path.join(data_dir, "bank.json")
+        self.activity_file = os.path.join(data_dir, "activity.json")
+        self.journal_file = os.path.join(data_dir, journal.JOURNAL_FILE_NAME)
+        self.snapshot_file = os.path.join(data_dir, snapshot.SNAPSHOT_FILE_NAME)
+        self.binary_snapshot = snapshot.ENABLED if binary_snapshot is None else binary_snapshot
+        self.write_behind_ms = WRITE_BEHIND_MS if write_behind_ms is None else write_behind_ms
+        self.lock = FileLock(os.path.join(data_dir, ".lock"))
+        # (bank.json stat, its journal_seq), so checking for pending events
+        # does not parse bank.json unless another process rewrote it
+        self._seq_cache = (None, 0)
+
+    def _read(self, path, default):
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                return json.load(f)
+        return default
+
+    def data_files(self):
+        return [self.users_file, self.bank_file, self.activity_file, self.journal_file]
+
+    def _read_logs(self):
+        if self.binary_snapshot:
+            activity_logs = snapshot.read(self.snapshot_file, self.activity_file)
+            if activity_logs is not None:
+                return activity_logs
+        return self._read(self.activity_file, {})
+
+    def _write_logs(self, activity_logs):
+        # Caller holds the lock
+        atomic_write_json(self.activity_file, activity_logs)
+        if self.binary_snapshot:
+            snapshot.write(self.snapshot_file, activity_logs, self.activity_file)
+
+    def _load_state(self):
+        bank = self._read(self.bank_file, {})
+        activity_logs = self._read_logs()
+        journal.replay(self.journal_file, bank, activity_logs)
+        return bank, activity_logs
+
+    def _bank_stat(self):
+        try:
+            stat = os.stat(self.bank_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _snapshot_seq(self):
+        # Caller holds the lock
+        stat = self._bank_stat()
+        if stat is None:
+            return 0
+        if self._seq_cache[0] != stat:
+            self._seq_cache = (stat, self._read(self.bank_file, {}).get("journal_seq", 0))
+        return self._seq_cache[1]
+
+    def _pending(self):
+        return journal.pending_count(self.journal_file, self._snapshot_seq())
+
+    def _write_bank(self, bank):
+        # Caller holds the lock
+        seq = journal.last_seq(self.journal_file)
+        atomic_write_json(self.bank_file, dict(bank, journal_seq=seq))
+        self._seq_cache = (self._bank_stat(), seq)
+
+    def _write_snapshot(self, bank, activity_logs):
+        # Caller holds the lock. Logs go first so a crash in between can at
+        # worst replay events onto logs that already contain them.
+        self._write_logs(activity_logs)
+        self._write_bank(bank)
+        journal.reset(self.journal_file)
+
+    def load_users(self):
+        return self._read(self.users_file, [])
+
+    def save_users(self, users):
+        with self.lock():
+            atomic_write_json(self.users_file, users)
+
+    def load_bank(self):
+        with self.lock():
+            # The bank side of the journal does not need the logs
+            bank = self._read(self.bank_file, {})
+            for event in journal.read_events(self.journal_file, bank.get("journal_seq", 0)):
+                journal.apply_to_bank(event, bank)
+            return bank
+
+    def load_activity_logs(self):
+        with self.lock():
+            return self._load_state()[1]
+
+    def load_state(self):
+        with self.lock():
+            return self._load_state()
+
+    def log_chunks(self, users, start=None, end=None, chunk_size=5_000):
+        # Streams activity.json one user at a time instead of loading every
+        # log, then applies the user's events from the journal tail
+        users = list(users)
+        wanted = set(users)
+        tail = {user: [] for user in users}
+        with self.lock():
+            try:
+                # The open file keeps this version if a snapshot replaces it
+                f = open(self.activity_file, "r")
+            except FileNotFoundError:
+                f = io.StringIO("{}")
+            for event in journal.read_events(self.journal_file, self._snapshot_seq()):
+                if event.get("user") in wanted:
+                    tail[event["user"]].append(event)
+
+        def user_chunks(user, entries):
+            logs = {user: entries}
+            for event in tail.pop(user):
+                journal.apply_to_logs(event, logs)
+            return _range_chunks(user, logs.get(user, []), start, end, chunk_size)
+
+        with f:
+            # Logs are stored in user order, so users asked for in that order
+            # come through one at a time; others wait until their turn
+            waiting, position = {}, 0
+            for user, entries in json_object_items(f):
+                if user not in tail:
+                    continue
+                waiting[user] = entries
+                while position < len(users) and users[position] in waiting:
+                    yield from user_chunks(users[position], waiting.pop(users[position]))
+                    position += 1
+        for user in users[position:]:
+            if user in tail:
+                yield from user_chunks(user, waiting.pop(user, []))
+
+    def save_activity_logs(self, activity_logs):
+        with self.lock():
+            if self._pending():
+                self._write_snapshot(self._load_state()[0], activity_logs)
+            else:
+                self._write_logs(activity_logs)
+
+    def save_bank(self, bank, activity_logs):
+        with self.lock():
+            if os.path.exists(self.bank_file) and (self.write_behind_ms or self._pending()):
+                # The stored balances are bank.json plus the journal; merge
+                # them when the event is replayed instead of loading the logs
+                journal.append_event(self.journal_file, {"type": "save_bank", "bank": bank})
+                return
+            self._write_bank(journal.merge_balances(bank, self._read(self.bank_file, {})))
+
+    def save_snapshot(self, bank, activity_logs):
+        with self.lock():
+            self._write_snapshot(bank, activity_logs)
+
+    def record_events(self, events, bank, activity_logs):
+        with self.lock():
+            if not os.path.exists(self.bank_file):
+                # No snapshot to replay onto yet, so write the first one
+                self._write_snapshot(bank, activity_logs)
+                return
+            if events:
+                journal.append_events(self.journal_file, events)
+            if not self.write_behind_ms and self._pending() >= journal.COMPACT_EVERY:
+                self._write_snapshot(*self._load_state())
+
+    def flush(self, expected_version=None):
+        with self.lock():
+            unchanged = self.version() == expected_version
+            if self._pending():
+                self._write_snapshot(*self._load_state())
+            return self.version() if unchanged else None
+
+
+# ---- SQLite ----
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS activities (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    item_id TEXT
+);
+CREATE TABLE IF NOT EXISTS dreams (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    purchased_by TEXT NOT NULL DEFAULT '[]',
+    item_id TEXT
+);
+CREATE TABLE IF NOT EXISTS user_banks (
+    user TEXT PRIMARY KEY,
+    activity_points INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS treats (
+    user TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    purchased INTEGER NOT NULL DEFAULT 0,
+    item_id TEXT,
+    PRIMARY KEY (user, position)
+);
+-- Entries store epoch seconds in ts and reference activity_id (or level for
+-- bonuses); rows saved before that have only the timestamp and activity text.
+-- Rollups (see retention) also have count and period.
+CREATE TABLE IF NOT EXISTS activity_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    activity TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    entry_id TEXT,
+    ts INTEGER,
+    activity_id TEXT,
+    level INTEGER,
+    count INTEGER,
+    period TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Columns added after the first release, for databases created before them
+ADDED_COLUMNS = [
+    ("activity_log", "entry_id", "TEXT"),
+    ("activity_log", "ts", "INTEGER"),
+    ("activity_log", "activity_id", "TEXT"),
+    ("activity_log", "level", "INTEGER"),
+    ("activity_log", "count", "INTEGER"),
+    ("activity_log", "period", "TEXT"),
+    ("activities", "item_id", "TEXT"),
+    ("dreams", "item_id", "TEXT"),
+    ("treats", "item_id", "TEXT"),
+]
+INDEXES = """
+CREATE INDEX IF NOT EXISTS activity_log_user_time ON activity_log (user, timestamp);
+CREATE INDEX IF NOT EXISTS activity_log_user_ts ON activity_log (user, ts);
+"""
+
+
+LOG_COLUMNS = "timestamp, activity, points, entry_id, ts, activity_id, level, count, period"
+LOG_INSERT = f"INSERT INTO activity_log (user, {LOG_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def _log_row(user, entry):
+    """
+    activity_log row values for an entry in either format (see history)
+    """
+    timestamp = entry["timestamp"]
+    if isinstance(timestamp, str):
+        return (user, timestamp, entry.get("activity", ""), entry["points"], entry.get("id"),
+                None, None, None, None, None)
+    return (user, "", entry.get("activity", ""), entry["points"], entry.get("id"),
+            timestamp, entry.get("activity_id"), entry.get("level"), entry.get("count"), entry.get("period"))
+
+
+def _row_entry(timestamp, activity, points, entry_id, ts, activity_id, level, count, period):
+    """
+    Log entry for activity_log columns LOG_COLUMNS
+    """
+    if ts is None:
+        entry = {"timestamp": timestamp, "activity": activity, "points": points}
+    else:
+        entry = {"timestamp": ts, "points": points}
+        if activity_id is not None:
+            entry["activity_id"] = activity_id
+        elif level is not None:
+            entry["level"] = level
+        else:
+            entry["activity"] = activity
+        if period is not None:
+            entry["count"] = count
+            entry["period"] = period
+    if entry_id is not None:
+        entry["id"] = entry_id
+    return entry
+
+
+def _with_id(record, item_id):
+    if item_id is not None:
+        record["id"] = item_id
+    return record
+
+
+class SqliteStorage(Storage):
+    def __init__(self, data_dir, auto_migrate=True):
+        self.data_dir = data_dir
+        self.db_file = os.path.join(data_dir, SQLITE_FILE_NAME)
+        is_new = not os.path.exists(self.db_file)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            for table, column, declaration in ADDED_COLUMNS:
+                columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+            conn.executescript(INDEXES)
+        if auto_migrate and is_new and any(
+                os.path.exists(os.path.join(data_dir, name))
+                for name in ("users.json", "bank.json", "activity.json")):
+            migrate_json_to_sqlite(data_dir)
+
+    def data_files(self):
+        return [self.db_file, self.db_file + "-wal"]
+
+    def _connect(self):
+        # IMMEDIATE takes the write lock when a transaction starts, so
+        # concurrent read-modify-write transactions queue instead of failing
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level="IMMEDIATE")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def load_users(self):
+        with closing(self._connect()) as conn:
+            return [row[0] for row in conn.execute("SELECT name FROM users ORDER BY position")]
+
+    def save_users(self, users):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM users")
+            conn.executemany(
+                "INSERT INTO users (position, name) VALUES (?, ?)",
+                list(enumerate(users))
+            )
+
+    def load_bank(self):
+        with closing(self._connect()) as conn:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if "initialized" not in meta:
+                # Nothing saved yet, so let the app seed its defaults
+                return {}
+            user_banks = {
+                user: {"activity_points": points, "treats": []}
+                for user, points in conn.execute("SELECT user, activity_points FROM user_banks")
+            }
+            for user, name, cost, purchased, item_id in conn.execute(
+                    "SELECT user, name, cost, purchased, item_id FROM treats ORDER BY user, position"):
+                user_banks.setdefault(user, {"activity_points": 0, "treats": []})["treats"].append(
+                    _with_id({"name": name, "cost": cost, "purchased": bool(purchased)}, item_id)
+                )
+            return {
+                "activities": [
+                    _with_id({"name": name, "points": points}, item_id)
+                    for name, points, item_id in conn.execute(
+                        "SELECT name, points, item_id FROM activities ORDER BY position")
+                ],
+                "dreams": [
+                    _with_id({"name": name, "cost": cost, "purchased_by": json.loads(purchased_by)}, item_id)
+                    for name, cost, purchased_by, item_id in conn.execute(
+                        "SELECT name, cost, purchased_by, item_id FROM dreams ORDER BY position")
+                ],
+                "user_banks": user_banks,
+                "dream_bank": int(meta.get("dream_bank", 0)),
+                "retired_activities": json.loads(meta.get("retired_activities", "{}"))
+            }
+
+    def save_bank(self, bank, activity_logs):
+        with closing(self._connect()) as conn, conn:
+            self._write_bank(conn, bank)
+
+    def _write_bank(self, conn, bank, keep_balances=True):
+        if keep_balances:
+            if not conn.in_transaction:
+                # Read the purchases under the write lock, so none land
+                # between reading and rewriting them
+                conn.execute("BEGIN IMMEDIATE")
+            bank = journal.merge_purchases(bank, self._stored_purchases(conn))
+        conn.execute("DELETE FROM activities")
+        conn.executemany(
+            "INSERT INTO activities (position, name, points, item_id) VALUES (?, ?, ?, ?)",
+            [(idx, a["name"], a["points"], a.get("id")) for idx, a in enumerate(bank.get("activities", []))]
+        )
+        conn.execute("DELETE FROM dreams")
+        conn.executemany(
+            "INSERT INTO dreams (position, name, cost, purchased_by, item_id) VALUES (?, ?, ?, ?, ?)",
+            [(idx, d["name"], d["cost"], json.dumps(d.get("purchased_by", [])), d.get("id"))
+             for idx, d in enumerate(bank.get("dreams", []))]
+        )
+        # Unless keep_balances is off, stored balances are kept and only new
+        # users get the given points
+        on_conflict = "DO NOTHING" if keep_balances else "DO UPDATE SET activity_points = excluded.activity_points"
+        user_banks = bank.get("user_banks", {})
+        for (user,) in conn.execute("SELECT user FROM user_banks").fetchall():
+            if user not in user_banks:
+                conn.execute("DELETE FROM user_banks WHERE user = ?", (user,))
+        conn.execute("DELETE FROM treats")
+        for user, user_bank in user_banks.items():
+            conn.execute(
+                f"INSERT INTO user_banks (user, activity_points) VALUES (?, ?) ON CONFLICT(user) {on_conflict}",
+                (user, user_bank.get("activity_points", 0))
+            )
+            conn.executemany(
+                "INSERT INTO treats (user, position, name, cost, purchased, item_id) VALUES (?, ?, ?, ?, ?, ?)",
+                [(user, idx, t["name"], t["cost"], int(t.get("purchased", False)), t.get("id"))
+                 for idx, t in enumerate(user_bank.get("treats", []))]
+            )
+        conn.execute(
+            f"INSERT OR {'IGNORE' if keep_balances else 'REPLACE'} INTO meta (key, value) VALUES ('dream_bank', ?)",
+            (str(bank.get("dream_bank", 0)),)
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('retired_activities', ?)",
+            (json.dumps(bank.get("retired_activities", {})),)
+        )
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('initialized', '1')")
+
+    @staticmethod
+    def _stored_purchases(conn):
+        """
+        Stored purchase state in bank form, for journal.merge_purchases
+        """
+        user_banks = {}
+        for user, item_id, purchased in conn.execute(
+                "SELECT user, item_id, purchased FROM treats WHERE item_id IS NOT NULL"):
+            user_banks.setdefault(user, {"treats": []})["treats"].append({"id": item_id, "purchased": bool(purchased)})
+        dreams = [
+            {"id": item_id, "purchased_by": json.loads(purchased_by)}
+            for item_id, purchased_by in conn.execute("SELECT item_id, purchased_by FROM dreams WHERE item_id IS NOT NULL")
+        ]
+        return {"user_banks": user_banks, "dreams": dreams}
+
+    def load_activity_logs(self):
+        activity_logs = {}
+        with closing(self._connect()) as conn:
+            for row in conn.execute(f"SELECT user, {LOG_COLUMNS} FROM activity_log ORDER BY id"):
+                activity_logs.setdefault(row[0], []).append(_row_entry(*row[1:]))
+        return activity_logs
+
+    def log_chunks(self, users, start=None, end=None, chunk_size=5_000):
+        # Rows saved before the ts column only have the timestamp text and
+        # are filtered here; the app converts them the first time it loads
+        query = (
+            f"SELECT {LOG_COLUMNS} FROM activity_log WHERE user = ? AND (ts IS NULL OR ts >= ? AND ts < ?) "
+            "ORDER BY ts, id"
+        )
+        bounds = (-2 ** 63 if start is None else start, 2 ** 63 - 1 if end is None else end)
+        with closing(self._connect()) as conn:
+            for user in users:
+                cursor = conn.execute(query, (user,) + bounds)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    entries = [_row_entry(*row) for row in rows]
+                    if rows[0][4] is None:
+                        entries = [
+                            entry for entry in entries
+                            if bounds[0] <= history.to_epoch(entry["timestamp"]) < bounds[1]
+                        ]
+                    if entries:
+                        yield user, entries
+
+    def save_activity_logs(self, activity_logs):
+        with closing(self._connect()) as conn, conn:
+            self._write_logs(conn, activity_logs)
+
+    def _write_logs(self, conn, activity_logs):
+        conn.execute("DELETE FROM activity_log")
+        conn.executemany(
+            LOG_INSERT, (_log_row(user, entry) for user, logs in activity_logs.items() for entry in logs)
+        )
+
+    def save_snapshot(self, bank, activity_logs):
+        with closing(self._connect()) as conn, conn:
+            self._write_bank(conn, bank, keep_balances=False)
+            self._write_logs(conn, activity_logs)
+
+    def _set_dream_bank(self, conn, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dream_bank', ?)", (str(value),))
+
+    def _add_dream_bank(self, conn, delta):
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('dream_bank', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + ?",
+            (str(delta), delta)
+        )
+
+    def _add_points(self, conn, user, delta):
+        conn.execute(
+            "INSERT INTO user_banks (user, activity_points) VALUES (?, ?) "
+            "ON CONFLICT(user) DO UPDATE SET activity_points = activity_points + ?",
+            (user, delta, delta)
+        )
+
+    def record_events(self, events, bank, activity_logs):
+        with closing(self._connect()) as conn:
+            initialized = conn.execute("SELECT 1 FROM meta WHERE key = 'initialized'").fetchone()
+            if initialized:
+                with conn:
+                    for event in events:
+                        self._apply_event(conn, event)
+                return
+        # Defaults seeded by the app have never been written
+        self.save_bank(bank, activity_logs)
+        self.save_activity_logs(activity_logs)
+
+    def _apply_event(self, conn, event):
+        kind = event["type"]
+        user = event.get("user")
+        if kind in ("complete", "level_bonus"):
+            conn.execute(LOG_INSERT, _log_row(user, journal.log_entry(event)))
+            self._add_points(conn, user, event["points"])
+        elif kind == "buy_treat":
+            if "treat_id" in event:
+                conn.execute(
+                    "UPDATE treats SET purchased = 1 WHERE user = ? AND item_id = ?", (user, event["treat_id"])
+                )
+            else:
+                conn.execute(
+                    "UPDATE treats SET purchased = 1 WHERE user = ? AND position = ?", (user, event["index"])
+                )
+            self._add_points(conn, user, -event["cost"])
+            self._add_dream_bank(conn, event["cost"])
+        elif kind == "buy_dream":
+            if "dream_id" in event:
+                row = conn.execute(
+                    "SELECT position, purchased_by FROM dreams WHERE item_id = ?", (event["dream_id"],)
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT position, purchased_by FROM dreams WHERE position = ?", (event["index"],)
+                ).fetchone()
+            if row is not None:
+                purchased_by = json.loads(row[1])
+                # Two stale copies of the state can both buy the dream
+                if user not in purchased_by:
+                    purchased_by.append(user)
+                    conn.execute(
+                        "UPDATE dreams SET purchased_by = ? WHERE position = ?", (json.dumps(purchased_by), row[0])
+                    )
+            self._add_dream_bank(conn, -event["cost"])
+        elif kind == "delete_log":
+            deleted = conn.execute(
+                "DELETE FROM activity_log WHERE user = ? AND entry_id = ?", (user, event["id"])
+            ).rowcount
+            if not deleted:
+                # Entries saved before they had ids
+                conn.execute(
+                    "DELETE FROM activity_log WHERE id = (SELECT id FROM activity_log "
+                    "WHERE user = ? AND entry_id IS NULL AND timestamp = ? AND activity = ? AND points = ? LIMIT 1)",
+                    (user, history.format_timestamp(event["timestamp"]), event.get("activity", ""), event["points"])
+                )
+            self._add_points(conn, user, -event["points"])
+        elif kind == "reset_user":
+            conn.execute("UPDATE user_banks SET activity_points = 0 WHERE user = ?", (user,))
+            conn.execute("UPDATE treats SET purchased = 0 WHERE user = ?", (user,))
+            conn.execute("DELETE FROM activity_log WHERE user = ?", (user,))
+        elif kind == "reset_dream_bank":
+            self._set_dream_bank(conn, 0)
+        elif kind == "rollup_logs":
+            # Rewrite the user's whole log so rows stay in the same order as
+            # the log in memory (rollups first)
+            entries = [
+                _row_entry(*row) for row in conn.execute(
+                    f"SELECT {LOG_COLUMNS} FROM activity_log WHERE user = ? ORDER BY id", (user,))
+            ]
+            conn.execute("DELETE FROM activity_log WHERE user = ?", (user,))
+            conn.executemany(LOG_INSERT, (
+                _log_row(user, entry) for entry in retention.rollup(
+                    entries, event["raw_before"], event.get("weekly_before"), event["offset"])
+            ))
+
+# ---- In memory ----
+class MemoryStorage(Storage):
+    """
+    Keeps data in memory only, for simulations and benchmarks
+    """
+
+    def __init__(self, data_dir=None):
+        self.data_dir = data_dir
+        self.users = []
+        self.bank = {}
+        self.activity_logs = {}
+        self._version = 0
+
+    def data_files(self):
+        return []
+
+    def version(self):
+        return self._version
+
+    def load_users(self):
+        return list(self.users)
+
+    def save_users(self, users):
+        self.users = list(users)
+        self._version += 1
+
+    def load_bank(self):
+        return copy.deepcopy(self.bank)
+
+    def save_bank(self, bank, activity_logs):
+        self.bank = copy.deepcopy(journal.merge_balances(bank, self.bank))
+        self._version += 1
+
+    def load_activity_logs(self):
+        return copy.deepcopy(self.activity_logs)
+
+    def save_activity_logs(self, activity_logs):
+        self.activity_logs = copy.deepcopy(activity_logs)
+        self._version += 1
+
+    def save_snapshot(self, bank, activity_logs):
+        self.bank = copy.deepcopy(bank)
+        self.activity_logs = copy.deepcopy(activity_logs)
+        self._version += 1
+
+    def record_events(self, events, bank, activity_logs):
+        if not self.bank:
+            self.bank = copy.deepcopy(bank)
+            self.activity_logs = copy.deepcopy(activity_logs)
+        else:
+            for event in events:
+                journal.apply_event(event, self.bank, self.activity_logs)
+        self._version += 1
+
+
+BACKENDS = {
+    "json": JsonStorage,
+    "sqlite": SqliteStorage,
+    "memory": MemoryStorage,
+}
+
+
+def get_storage(data_dir, backend=None):
+    backend = (backend or os.getenv("STORAGE_BACKEND", DEFAULT_BACKEND)).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}', expected one of: {', '.join(BACKENDS)}")
+    return BACKENDS[backend](data_dir)
+
+
+def migrate_json_to_sqlite(data_dir):
+    """
+    One-shot copy of users.json, bank.json (with journal) and activity.json
+    into the SQLite database
+    """
+    source = JsonStorage(data_dir)
+    target = SqliteStorage(data_dir, auto_migrate=False)
+    bank = source.load_bank()
+    bank.pop("journal_seq", None)
+    activity_logs = source.load_activity_logs()
+    target.save_users(source.load_users())
+    if bank:
+        target.save_bank(bank, activity_logs)
+    target.save_activity_logs(activity_logs)
+    return target
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "migrate":
+        data_dir = sys.argv[2] if len(sys.argv) > 2 else os.getenv("DATA_DIR", "data")
+        migrate_json_to_sqlite(data_dir)
+        print(f"Migrated JSON data in {data_dir} to {os.path.join(data_dir, SQLITE_FILE_NAME)}")
+    else:
+        print("Usage: python storage.py migrate [DATA_DIR]")
+        sys.exit(1)
@@ -0,0 +1,85 @@
+"""
+Groups (households) with their own users, activities, treats, dreams and
+Dream Bank.
+
+Each group is a partition: a directory holding a complete data set for the
+storage backend (the JSON files or the SQLite database), so a session only
+loads and writes the data of its own group. The default group lives in
+DATA_DIR itself, where data saved before groups already is; other groups
+live in DATA_DIR/groups/<name>.
+
+    python tenants.py list [DATA_DIR]
+    python tenants.py create NAME [DATA_DIR]
+"""
+import os
+import re
+import sys
+
+GROUPS_DIR_NAME = "groups"
+DEFAULT_GROUP = "default"
+NAME = re.compile(r"[a-z0-9][a-z0-9_-]{0,39}$")
+
+
+def normalize(name):
+    """
+    Group name as used in paths and URLs: lowercase, spaces as dashes
+    """
+    return "-".join(str(name).strip().lower().split())
+
+
+def validate(group):
+    if not NAME.match(group):
+        raise ValueError(
+            "Group names are up to 40 lowercase letters, digits, '-' and '_', starting with a letter or digit."
+        )
+    return group
+
+
+def partition_dir(data_dir, group):
+    if group == DEFAULT_GROUP:
+        return data_dir
+    return os.path.join(data_dir, GROUPS_DIR_NAME, validate(group))
+
+
+def list_groups(data_dir):
+    """
+    The default group followed by the others in name order
+    """
+    try:
+        names = sorted(
+            entry.name for entry in os.scandir(os.path.join(data_dir, GROUPS_DIR_NAME))
+            if entry.is_dir() and NAME.match(entry.name)
+        )
+    except FileNotFoundError:
+        names = []
+    return [DEFAULT_GROUP] + [name for name in names if name != DEFAULT_GROUP]
+
+
+def create_group(data_dir, name):
+    """
+    Create an empty partition for a new group and return its name
+    """
+    group = validate(normalize(name))
+    if group == DEFAULT_GROUP:
+        raise ValueError(f"Group '{group}' already exists.")
+    os.makedirs(os.path.join(data_dir, GROUPS_DIR_NAME), exist_ok=True)
+    try:
+        os.mkdir(partition_dir(data_dir, group))
+    except FileExistsError:
+        raise ValueError(f"Group '{group}' already exists.") from None
+    return group
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "list":
+        for group in list_groups(sys.argv[2] if len(sys.argv) > 2 else os.getenv("DATA_DIR", "data")):
+            print(group)
+    elif len(sys.argv) >= 3 and sys.argv[1] == "create":
+        try:
+            print(create_group(sys.argv[3] if len(sys.argv) > 3 else os.getenv("DATA_DIR", "data"), sys.argv[2]))
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+    else:
+        print("Usage: python tenants.py list [DATA_DIR] | create NAME [DATA_DIR]")
+        sys.exit(1)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+import service
+from analytics import LogColumns
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = service.TreatsDreamsService.open(str(tmp_path), "memory")
+    app.add_user("alice")
+    app.add_user("bob")
+    return app
+
+
+def converted_rows(columns, monkeypatch):
+    # Rows passed through _columns from now on
+    rows = []
+    build = columns._columns
+    monkeypatch.setattr(columns, "_columns", lambda logs: rows.append(len(logs)) or build(logs))
+    return rows
+
+
+def assert_matches_rebuild(columns, user):
+    fresh = LogColumns(columns.store)
+    fresh.codes = dict(columns.codes)
+    fresh.refresh()
+    for column, expected in zip(columns._users[user], fresh._users[user]):
+        np.testing.assert_array_equal(column, expected)
+
+
+def test_completions_append_only_new_rows(app, monkeypatch):
+    activity = app.add_activity("Run 5km", 10)
+    for timestamp in range(1_700_000_000, 1_700_000_050, 10):
+        app.complete_activity("alice", activity["id"], timestamp)
+    columns = LogColumns(app.store)
+    columns.refresh()
+    rows = converted_rows(columns, monkeypatch)
+
+    before = len(app.store.activity_logs["alice"])
+    events = app.complete_activities("alice", [activity["id"]] * 2, 1_700_000_100)
+    columns.refresh()
+
+    # Level-up bonuses are new rows too
+    assert rows == [len(events)] and len(app.store.activity_logs["alice"]) == before + len(events)
+    assert_matches_rebuild(columns, "alice")
+
+
+@pytest.mark.parametrize("change", ["delete", "backdated"])
+def test_other_changes_rebuild(app, monkeypatch, change):
+    activity = app.add_activity("Run 5km", 10)
+    events = app.complete_activities("alice", [activity["id"]] * 3, 1_700_000_000)
+    columns = LogColumns(app.store)
+    columns.refresh()
+    rows = converted_rows(columns, monkeypatch)
+
+    if change == "delete":
+        app.delete_log_entry("alice", events[1]["id"])
+        app.complete_activity("alice", activity["id"], 1_700_000_100)
+    else:
+        app.complete_activity("alice", activity["id"], 1_600_000_000)
+    columns.refresh()
+
+    assert rows == [len(app.store.activity_logs["alice"])]
+    assert_matches_rebuild(columns, "alice")
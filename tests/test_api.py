@@ -0,0 +1,103 @@
+import http.client
+import json
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+import api
+import service
+import tenants
+
+
+@contextmanager
+def serving(data_dir):
+    httpd = api.make_server(data_dir, "127.0.0.1", 0, "json")
+    threading.Thread(target=httpd.serve_forever, args=(0.01,), daemon=True).start()
+    try:
+        yield httpd
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture
+def server(tmp_path):
+    app = service.TreatsDreamsService.open(str(tmp_path), "json")
+    app.add_user("alice")
+    run = app.add_activity("Run 5km", 10)
+    for timestamp in range(1_700_000_000, 1_700_000_030):
+        app.complete_activity("alice", run["id"], timestamp)
+    app.store.flush()
+    with serving(str(tmp_path)) as httpd:
+        yield httpd, app
+
+
+def get(server, path, headers=None):
+    conn = http.client.HTTPConnection(*server[0].server_address)
+    try:
+        conn.request("GET", path, headers=headers or {})
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, response.getheader("ETag"), json.loads(data) if data else None
+    finally:
+        conn.close()
+
+
+def test_etag_gives_304_until_the_data_changes(server):
+    status, tag, body = get(server, "/api/users/alice")
+    assert status == 200 and tag and body["points"] == server[1].store.user_banks["alice"]["activity_points"]
+
+    assert get(server, "/api/users/alice", {"If-None-Match": tag}) == (304, tag, None)
+
+    app = server[1]
+    app.complete_activity("alice", app.store.activities[0]["id"])
+    app.store.flush()
+    status, new_tag, body = get(server, "/api/users/alice", {"If-None-Match": tag})
+    assert status == 200 and new_tag != tag
+    assert body["points"] == app.store.user_banks["alice"]["activity_points"]
+
+
+@pytest.mark.parametrize("query", ["page=abc", "page=0", "page=99", "page_size=0", "page_size=1000"])
+def test_bad_parameters_give_400(server, query):
+    status, _, body = get(server, f"/api/users/alice/log?{query}")
+    assert status == 400 and body["error"]
+
+
+@pytest.mark.parametrize("path", [
+    "/api/users/bob", "/api/users/bob/log", "/api/nothing", "/other", "/api/users?group=nobody"
+])
+def test_unknown_users_and_paths_give_404(server, path):
+    status, _, body = get(server, path)
+    assert status == 404 and body["error"]
+
+
+def test_log_pages_newest_first(server):
+    status, _, body = get(server, "/api/users/alice/log?page=2&page_size=10")
+    assert status == 200 and body["page_count"] == -(-body["entries_total"] // 10)
+    timestamps = [entry["timestamp"] for entry in body["entries"]]
+    assert len(timestamps) == 10 and timestamps == sorted(timestamps, reverse=True)
+    assert get(server, "/api/groups")[2] == [tenants.DEFAULT_GROUP]
+
+
+def test_api_does_not_migrate_old_data(tmp_path):
+    # Saved before catalog ids and epoch timestamps
+    files = {
+        "users.json": ["alice"],
+        "bank.json": {"activities": [{"name": "Run 5km", "points": 3}], "dreams": [], "dream_bank": 0,
+                      "user_banks": {"alice": {"activity_points": 3, "treats": []}}},
+        "activity.json": {"alice": [{"timestamp": "2024-01-01 10:00:00", "activity": "Run 5km", "points": 3}]}
+    }
+    for name, data in files.items():
+        (tmp_path / name).write_text(json.dumps(data))
+    with serving(str(tmp_path)) as httpd:
+        status, _, body = get((httpd,), "/api/users/alice/log")
+
+    assert status == 200 and body["entries"][0]["label"] == "Run 5km"
+    assert {name: json.loads((tmp_path / name).read_text()) for name in files} == files
+    # A writer adds the same ids the API showed
+    writer = service.TreatsDreamsService.open(str(tmp_path), "json")
+    assert writer.store.activity_logs["alice"][0]["id"] == body["entries"][0]["id"]
+    assert writer.store.activities[0]["id"] == body["entries"][0]["activity_id"]
+    with pytest.raises(RuntimeError):
+        service.TreatsDreamsService.open(str(tmp_path), "json", read_only=True).add_user("bob")
@@ -0,0 +1,26 @@
+import catalog
+
+
+def records(*names):
+    return [{"id": str(i), "name": name} for i, name in enumerate(names)]
+
+
+def test_short_terms_match_word_starts():
+    index = catalog.NameIndex(records("Run 5km", "Yoga", "Rowing", "Morning run", "Brunch"))
+    assert [r["name"] for r in index.search("r")] == ["Run 5km", "Rowing", "Morning run"]
+    assert [r["name"] for r in index.search("ru")] == ["Run 5km", "Morning run"]
+    assert index.search("zz") == []
+
+
+def test_long_terms_match_anywhere_and_terms_combine():
+    index = catalog.NameIndex(records("Run 5km", "Yoga", "Morning run", "Brunch"))
+    assert [r["name"] for r in index.search("run")] == ["Run 5km", "Morning run", "Brunch"]
+    assert [r["name"] for r in index.search("RUN mo")] == ["Morning run"]
+    assert len(index.search("  ")) == 4
+
+
+def test_page_of_clamps_to_the_last_page():
+    items = list(range(45))
+    assert catalog.page_of(items, 3) == (items[40:], 3)
+    assert catalog.page_of(items, 9) == (items[40:], 3)
+    assert catalog.page_of([], 1) == ([], 1)
@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+
+import pytest
+
+import export
+import service
+import storage
+
+DAY = 86400
+START = 1_700_000_000
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def data_dir(tmp_path, request):
+    app = service.TreatsDreamsService.open(str(tmp_path), request.param)
+    run = app.add_activity("Run 5km", 10)
+    yoga = app.add_activity("Yoga", 3)
+    for user in ("alice", "bob"):
+        app.add_user(user)
+        for day in range(10):
+            app.complete_activities(user, [run["id"], yoga["id"]], START + day * DAY)
+    app.buy_treat("alice", app.store.user_banks["alice"]["treats"][0]["id"])
+    app.delete_activity(yoga["id"])
+    app.store.flush()
+    return str(tmp_path), request.param
+
+
+def rows(chunks):
+    return [row for chunk in chunks for row in chunk]
+
+
+@pytest.mark.parametrize("table", export.TABLES)
+def test_storage_export_matches_the_app(data_dir, table):
+    path, backend = data_dir
+    store = service.TreatsDreamsService.open(path, backend).store
+    start, end = START + 2 * DAY, START + 5 * DAY
+
+    expected = rows(export.export_chunks(store, table, None, start, end, chunk_size=4))
+    exported = rows(export.stored_chunks(storage.get_storage(path, backend), table, None, start, end, chunk_size=4))
+
+    assert exported == expected
+    if table == "activity_logs":
+        assert expected and all(start <= row["timestamp"] < end for row in expected)
+        assert {row["activity"] for row in expected} >= {"Run 5km", "Yoga"}
+
+
+def test_storage_export_filters_users(data_dir):
+    path, backend = data_dir
+    exported = rows(export.stored_chunks(storage.get_storage(path, backend), "activity_logs", ["bob"]))
+    assert exported and {row["user"] for row in exported} == {"bob"}
+    timestamps = [row["timestamp"] for row in exported]
+    assert timestamps == sorted(timestamps)
+
+
+@pytest.mark.parametrize("fmt", export.formats())
+def test_export_file_is_a_download_payload(data_dir, fmt):
+    from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+
+    path, backend = data_dir
+    store = service.TreatsDreamsService.open(path, backend).store
+    data = convert_data_to_bytes_and_infer_mime(
+        export.export_file(store, "balances", fmt), unsupported_error=TypeError("unsupported")
+    )[0]
+
+    if fmt == "csv":
+        assert [row["user"] for row in csv.DictReader(io.StringIO(data.decode()))] == ["alice", "bob"]
+    elif fmt == "jsonl":
+        assert [json.loads(line)["user"] for line in data.decode().splitlines()] == ["alice", "bob"]
+    else:
+        import pyarrow.parquet as pq
+        assert pq.read_table(io.BytesIO(data)).column("user").to_pylist() == ["alice", "bob"]
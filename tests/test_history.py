@@ -0,0 +1,53 @@
+import numpy as np
+
+from history import HistoryIndex, local_day, week_start
+
+
+def entry(entry_id, timestamp, points=10):
+    return {"id": entry_id, "timestamp": timestamp, "activity_id": "a1", "points": points}
+
+
+def test_add_keeps_out_of_order_entries_in_timestamp_order():
+    entries = [entry("e3", 300), entry("e1", 100)]
+    index = HistoryIndex(entries)
+
+    index.add(entry("e2", 200))
+    index.add(entry("e4", 400, points=5))
+    # Same timestamp as e2: lands after it
+    index.add(entry("e2b", 200))
+
+    assert [e["id"] for e in entries] == ["e1", "e2", "e2b", "e3", "e4"]
+    assert index.timestamps == [100, 200, 200, 300, 400]
+    assert index.total_points == 45 and len(index) == 5
+    assert "id" in index.add({"timestamp": 50, "points": 1, "level": 2})
+
+
+def test_remove_by_id():
+    index = HistoryIndex([entry(f"e{i}", 100 * (i // 2), points=i) for i in range(6)])
+
+    assert index.remove("e3")["points"] == 3
+    assert index.remove("e3") is None
+    assert index.remove("e2")["id"] == "e2"
+
+    assert [e["id"] for e in index.entries] == ["e0", "e1", "e4", "e5"]
+    assert index.timestamps == [e["timestamp"] for e in index.entries]
+    assert index.total_points == 10 and set(index.by_id) == {"e0", "e1", "e4", "e5"}
+
+
+def test_pages_are_newest_first():
+    index = HistoryIndex([entry(f"e{i}", i) for i in range(23)])
+
+    assert index.page_count(10) == 3 and HistoryIndex([]).page_count(10) == 1
+    assert [e["id"] for e in index.page(0, 10)] == [f"e{i}" for i in range(22, 12, -1)]
+    assert [e["id"] for e in index.page(2, 10)] == ["e2", "e1", "e0"]
+    assert index.page(3, 10) == []
+
+
+def test_local_days_and_weeks_for_numbers_and_arrays():
+    # 2024-01-01 was a Monday; 23:30 UTC is the next day at UTC+1
+    monday = 19_723
+    timestamp = monday * 86400 + 23 * 3600 + 1800
+    assert local_day(timestamp, 0) == monday and local_day(timestamp, 3600) == monday + 1
+    assert [week_start(day) for day in range(monday, monday + 8)] == [monday] * 7 + [monday + 7]
+    days = local_day(np.array([timestamp, timestamp + 6 * 86400]), 3600)
+    np.testing.assert_array_equal(week_start(days), [monday, monday + 7])
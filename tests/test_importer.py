@@ -0,0 +1,65 @@
+import pytest
+
+import importer
+import service
+
+
+def records(count, during=None):
+    for i in range(count):
+        if i == count // 2 and during:
+            # Another process commits while the import is running
+            during()
+        yield i + 1, {"user": "alice", "activity": "Run 5km", "timestamp": f"2024-01-01 10:{i % 60:02d}:00"}
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_import_keeps_events_committed_meanwhile(tmp_path, backend):
+    data_dir = str(tmp_path)
+    setup = service.TreatsDreamsService.open(data_dir, backend)
+    setup.add_user("alice")
+    setup.add_user("bob")
+    run = next(a for a in setup.store.activities if a["name"] == "Run 5km")
+
+    importing = service.TreatsDreamsService.open(data_dir, backend)
+    app = service.TreatsDreamsService.open(data_dir, backend)
+    report = importer.import_records(
+        importing, records(40, lambda: app.complete_activity("bob", run["id"])), batch_size=10
+    )
+    assert report["imported"] == 40
+
+    expected_alice = importing.store.user_banks["alice"]["activity_points"]
+    reloaded = service.TreatsDreamsService.open(data_dir, backend).store
+    assert reloaded.user_banks["alice"]["activity_points"] == expected_alice
+    assert reloaded.user_banks["bob"]["activity_points"] == app.store.user_banks["bob"]["activity_points"] > 0
+    assert len(reloaded.activity_logs["alice"]) == len(importing.store.activity_logs["alice"])
+    assert len(reloaded.activity_logs["bob"]) == len(app.store.activity_logs["bob"])
+
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_import_persists_each_batch_before_reading_the_next(tmp_path, backend):
+    data_dir = str(tmp_path)
+    app = service.TreatsDreamsService.open(data_dir, backend)
+    app.add_user("alice")
+    stored = []
+
+    def count_stored():
+        logs = service.TreatsDreamsService.open(data_dir, backend).store.activity_logs["alice"]
+        stored.append(sum(1 for entry in logs if "activity_id" in entry))
+
+    importer.import_records(app, records(40, count_stored), batch_size=10)
+
+    # Halfway through, the first two batches are stored and nothing is held back
+    assert stored == [20]
+    assert app.store._deferred.events is None
+
+def test_import_matches_completing_one_by_one(tmp_path):
+    imported = service.TreatsDreamsService.open(str(tmp_path / "a"), "memory")
+    clicked = service.TreatsDreamsService.open(str(tmp_path / "b"), "memory")
+    for app in (imported, clicked):
+        app.add_user("alice")
+    run = next(a for a in clicked.store.activities if a["name"] == "Run 5km")
+    importer.import_records(imported, records(30), batch_size=7)
+    for _ in range(30):
+        clicked.complete_activity("alice", run["id"])
+    assert imported.store.user_banks["alice"]["activity_points"] == clicked.store.user_banks["alice"]["activity_points"]
@@ -0,0 +1,108 @@
+import copy
+import json
+
+import journal
+from storage import JsonStorage
+
+
+def bank():
+    return {
+        "activities": [{"id": "a1", "name": "Run 5km", "points": 10}],
+        "dreams": [{"id": "d1", "name": "Trip", "cost": 30, "purchased_by": []}],
+        "dream_bank": 0,
+        "user_banks": {"alice": {"activity_points": 0, "treats": [{"id": "t1", "name": "Cake", "cost": 5}]}}
+    }
+
+
+def complete(entry_id, points=10, timestamp=1_700_000_000):
+    return {"type": "complete", "user": "alice", "activity_id": "a1", "points": points,
+            "timestamp": timestamp, "id": entry_id}
+
+
+def test_replay_rebuilds_balances_logs_and_purchases(tmp_path):
+    path = str(tmp_path / journal.JOURNAL_FILE_NAME)
+    journal.append_events(path, [complete("l1"), complete("l2"), complete("l3", timestamp=1_700_000_100)])
+    journal.append_event(path, {"type": "buy_treat", "user": "alice", "treat_id": "t1", "cost": 5})
+    journal.append_event(path, {"type": "delete_log", "user": "alice", "id": "l2", "points": 10,
+                                "timestamp": 1_700_000_000})
+    journal.append_event(path, {"type": "buy_dream", "user": "alice", "dream_id": "d1", "cost": 5})
+
+    bank_data, activity_logs = bank(), {}
+    journal.replay(path, bank_data, activity_logs)
+
+    assert bank_data["user_banks"]["alice"]["activity_points"] == 15
+    assert bank_data["user_banks"]["alice"]["treats"][0]["purchased"]
+    assert bank_data["dreams"][0]["purchased_by"] == ["alice"]
+    assert bank_data["dream_bank"] == 0
+    assert [entry["id"] for entry in activity_logs["alice"]] == ["l1", "l3"]
+
+
+def test_replay_skips_events_in_the_snapshot_and_torn_lines(tmp_path):
+    path = str(tmp_path / journal.JOURNAL_FILE_NAME)
+    journal.append_events(path, [complete("l1"), complete("l2")])
+    with open(path, "a") as f:
+        f.write(json.dumps(complete("l3"))[:20])
+
+    bank_data, activity_logs = dict(bank(), journal_seq=1), {"alice": [journal.log_entry(complete("l1"))]}
+    journal.replay(path, bank_data, activity_logs)
+
+    assert journal.last_seq(path) == 2
+    assert bank_data["user_banks"]["alice"]["activity_points"] == 10
+    assert [entry["id"] for entry in activity_logs["alice"]] == ["l1", "l2"]
+
+
+def test_reset_keeps_sequence_numbers_increasing(tmp_path):
+    path = str(tmp_path / journal.JOURNAL_FILE_NAME)
+    journal.append_events(path, [complete("l1"), complete("l2")])
+    journal.reset(path)
+
+    assert list(journal.read_events(path)) == [{"seq": 2, "type": "checkpoint"}]
+    assert journal.append_event(path, complete("l3")) == 3
+    assert journal.pending_count(path, 2) == 1
+
+
+def test_merge_balances_keeps_stored_balances():
+    stored = bank()
+    stored["user_banks"]["alice"]["activity_points"] = 40
+    stored["dream_bank"] = 25
+    stale = copy.deepcopy(bank())
+    stale["activities"][0]["name"] = "Run 10km"
+    stale["user_banks"]["bob"] = {"activity_points": 0, "treats": []}
+
+    merged = journal.merge_balances(stale, stored)
+
+    assert merged["activities"][0]["name"] == "Run 10km"
+    assert merged["user_banks"]["alice"]["activity_points"] == 40
+    assert merged["user_banks"]["bob"]["activity_points"] == 0
+    assert merged["dream_bank"] == 25
+    assert stale["user_banks"]["alice"]["activity_points"] == 0
+
+
+def test_save_bank_event_merges_on_replay(tmp_path):
+    path = str(tmp_path / journal.JOURNAL_FILE_NAME)
+    renamed = bank()
+    renamed["activities"][0]["name"] = "Run 10km"
+    journal.append_event(path, complete("l1"))
+    journal.append_event(path, {"type": "save_bank", "bank": renamed})
+
+    bank_data, activity_logs = bank(), {}
+    journal.replay(path, bank_data, activity_logs)
+
+    assert bank_data["activities"][0]["name"] == "Run 10km"
+    assert bank_data["user_banks"]["alice"]["activity_points"] == 10
+
+
+def test_storage_compacts_the_journal_and_reloads_the_same_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, "COMPACT_EVERY", 3)
+    store = JsonStorage(str(tmp_path), binary_snapshot=False, write_behind_ms=0)
+    store.record_events([], bank(), {"alice": []})
+    store.record_events([complete("l1"), complete("l2")], bank(), {})
+    assert journal.pending_count(store.journal_file, store._snapshot_seq()) == 2
+
+    store.record_events([complete("l3", timestamp=1_700_000_100)], bank(), {})
+
+    # The third event wrote a snapshot, so startup has nothing to replay
+    assert journal.pending_count(store.journal_file, store._snapshot_seq()) == 0
+    stored_bank, stored_logs = JsonStorage(str(tmp_path), binary_snapshot=False, write_behind_ms=0).load_state()
+    assert stored_bank["user_banks"]["alice"]["activity_points"] == 30
+    assert [entry["id"] for entry in stored_logs["alice"]] == ["l1", "l2", "l3"]
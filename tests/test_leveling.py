@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from leveling import DEFAULT_CURVE, LevelCurve, ThresholdTable, calculate_level, calculate_points_needed
+
+
+def reference_level(total_points):
+    """
+    The original level-by-level loop, kept to check the engine against
+    """
+    if total_points < 5:
+        return 1, total_points, 5
+
+    level = 1
+    points_needed = 5
+    previous_threshold = 0
+    level_threshold = points_needed
+
+    while total_points >= level_threshold:
+        level += 1
+        previous_threshold = level_threshold
+        points_needed = 5 + (level * 5)
+        level_threshold += points_needed
+
+    return level, total_points - previous_threshold, points_needed
+
+
+def sample_points(samples=20_000, max_points=10_000_000, seed=0):
+    # Every total near small thresholds plus random samples
+    rng = random.Random(seed)
+    points = list(range(-10, 5_000))
+    points += [rng.randint(0, max_points) for _ in range(samples)]
+    for level in range(2, 2_000):
+        t = DEFAULT_CURVE.threshold(level)
+        points += [t - 1, t, t + 1]
+    return points
+
+
+def test_closed_form_matches_reference():
+    for p in sample_points():
+        assert calculate_level(p) == reference_level(p), p
+
+
+def test_threshold_table_matches_reference():
+    table = ThresholdTable(DEFAULT_CURVE.increment, max_level=10)
+    for p in sample_points():
+        assert table.level_for(p) == reference_level(p), p
+
+
+def test_documented_levels():
+    assert calculate_level(4) == (1, 4, 5)
+    assert calculate_level(5) == (2, 0, 15)
+    assert calculate_level(20) == (3, 0, 20)
+    assert calculate_level(64) == (4, 24, 25)
+    assert [calculate_points_needed(level) for level in range(1, 5)] == [0, 5, 20, 40]
+
+
+@pytest.mark.parametrize("first,base,step", [(10, 10, 0), (3, 7, 2), (1, 0, 1)])
+def test_other_curves_match_their_table(first, base, step):
+    curve = LevelCurve(first, base, step)
+    table = ThresholdTable(curve.increment)
+    for p in range(0, 20_000, 7):
+        assert curve.level_for(p) == table.level_for(p), p
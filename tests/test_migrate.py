@@ -0,0 +1,47 @@
+from storage import JsonStorage, SqliteStorage, migrate_json_to_sqlite
+
+
+def bank(points):
+    return {
+        "activities": [{"id": "a1", "name": "Run 5km", "points": 10}],
+        "dreams": [{"id": "d1", "name": "Trip", "cost": 4, "purchased_by": []}],
+        "dream_bank": 6,
+        "user_banks": {"alice": {"activity_points": points, "treats": []}}
+    }
+
+
+def complete(points):
+    return {"type": "complete", "user": "alice", "activity_id": "a1", "points": points,
+            "timestamp": 1_700_000_000, "id": "l1"}
+
+
+def json_data(data_dir):
+    source = JsonStorage(data_dir, binary_snapshot=False, write_behind_ms=0)
+    source.save_users(["alice", "bob"])
+    source.record_events([], bank(0), {"alice": []})
+    source.record_events([complete(10), {"type": "buy_dream", "user": "alice", "dream_id": "d1", "cost": 4}],
+                         bank(0), {})
+    return source
+
+
+def test_migrate_json_to_sqlite_keeps_journaled_state(tmp_path):
+    source = json_data(str(tmp_path))
+
+    target = migrate_json_to_sqlite(str(tmp_path))
+
+    expected_bank, expected_logs = source.load_state()
+    migrated_bank = target.load_bank()
+    assert target.load_users() == ["alice", "bob"]
+    for key in ("activities", "dreams", "dream_bank", "user_banks"):
+        assert migrated_bank[key] == expected_bank[key], key
+    assert migrated_bank["dreams"][0]["purchased_by"] == ["alice"]
+    assert target.load_activity_logs() == expected_logs
+
+
+def test_new_database_migrates_json_files_once(tmp_path):
+    json_data(str(tmp_path))
+    SqliteStorage(str(tmp_path)).save_users(["alice"])
+
+    # An existing database is not overwritten from the JSON files again
+    assert SqliteStorage(str(tmp_path)).load_users() == ["alice"]
+    assert SqliteStorage(str(tmp_path)).load_bank()["user_banks"]["alice"]["activity_points"] == 10
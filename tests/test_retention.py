@@ -0,0 +1,95 @@
+import journal
+import retention
+import service
+
+DAY = 86400
+# A Monday, midnight UTC
+MONDAY = 19_723 * DAY
+
+
+def entry(entry_id, timestamp, points=10, **label):
+    return dict({"id": entry_id, "timestamp": timestamp, "points": points}, **(label or {"activity_id": "a1"}))
+
+
+def test_rollup_merges_old_entries_per_day_and_label():
+    entries = [
+        entry("e1", MONDAY + 100),
+        entry("e2", MONDAY + 200),
+        entry("e3", MONDAY + 300, points=25, level=3),
+        entry("e4", MONDAY + DAY + 100),
+        entry("e5", MONDAY + 2 * DAY + 100)
+    ]
+
+    rolled = retention.rollup(entries, raw_before=MONDAY + 2 * DAY)
+
+    assert [(e["timestamp"], e["points"], e["count"], e["period"]) for e in rolled[:3]] == [
+        (MONDAY, 20, 2, "day"), (MONDAY, 25, 1, "day"), (MONDAY + DAY, 10, 1, "day")
+    ]
+    assert rolled[1]["level"] == 3
+    assert rolled[3:] == [entries[4]]
+    assert sum(e["points"] for e in rolled) == sum(e["points"] for e in entries)
+
+
+def test_weekly_rollup_includes_daily_rollups():
+    daily = retention.rollup([entry(f"e{i}", MONDAY + i * DAY) for i in range(7)], raw_before=MONDAY + 7 * DAY)
+    assert len(daily) == 7
+
+    weekly = retention.rollup(daily, raw_before=MONDAY + 7 * DAY, weekly_before=MONDAY + 7 * DAY)
+
+    assert [(e["timestamp"], e["points"], e["count"], e["period"]) for e in weekly] == [(MONDAY, 70, 7, "week")]
+    # Rollup ids are stable, so every replay produces the same entries
+    assert weekly == retention.rollup(daily, MONDAY + 7 * DAY, MONDAY + 7 * DAY)
+
+
+def test_needs_rollup():
+    entries = [entry("e1", MONDAY), entry("e2", MONDAY + 3 * DAY)]
+    assert not retention.needs_rollup(entries, raw_before=MONDAY)
+    assert retention.needs_rollup(entries, raw_before=MONDAY + DAY)
+
+    daily = retention.rollup(entries, raw_before=MONDAY + DAY)
+    assert not retention.needs_rollup(daily, raw_before=MONDAY + DAY)
+    assert retention.needs_rollup(daily, raw_before=MONDAY + DAY, weekly_before=MONDAY + DAY)
+
+
+def test_cutoffs_start_at_local_midnight_and_monday():
+    now = MONDAY + 10 * DAY + 5000
+    raw_before, weekly_before, offset = retention.cutoffs(now, raw_days=3, weekly_days=8)
+    assert (raw_before + offset) % DAY == 0
+    assert retention.local_day(raw_before, offset) == retention.local_day(now, offset) - 3
+    assert retention.week_start(retention.local_day(weekly_before, offset)) == retention.local_day(weekly_before, offset)
+    assert retention.cutoffs(now, raw_days=3, weekly_days=0)[1] is None
+
+
+def test_rollup_event_leaves_balances_alone():
+    bank_data = {"user_banks": {"alice": {"activity_points": 30, "treats": []}}}
+    activity_logs = {"alice": [entry(f"e{i}", MONDAY + i) for i in range(3)]}
+
+    journal.apply_event({"type": "rollup_logs", "user": "alice", "raw_before": MONDAY + DAY,
+                         "weekly_before": None, "offset": 0}, bank_data, activity_logs)
+
+    assert bank_data["user_banks"]["alice"]["activity_points"] == 30
+    assert [(e["points"], e["count"]) for e in activity_logs["alice"]] == [(30, 3)]
+
+
+def test_compact_logs_keeps_balances_and_pages_into_rollups(tmp_path):
+    app = service.TreatsDreamsService.open(str(tmp_path), "json")
+    app.add_user("alice")
+    run = app.add_activity("Run 5km", 10)
+    now = MONDAY + 20 * DAY
+    for day in range(20):
+        app.complete_activities("alice", [run["id"], run["id"]], MONDAY + day * DAY + 3600)
+    points = app.store.user_banks["alice"]["activity_points"]
+    total = app.store.history("alice").total_points
+
+    result = app.compact_logs(now=now, raw_days=5, weekly_days=0)
+
+    history = app.store.history("alice")
+    assert result["users"] == 1 and result["after"] < result["before"]
+    assert app.store.user_banks["alice"]["activity_points"] == points
+    assert history.total_points == total
+    pages = [e for page in range(history.page_count(10)) for e in history.page(page, 10)]
+    assert "period" not in pages[0] and pages[-1]["period"] == "day"
+    assert [e["timestamp"] for e in pages] == sorted((e["timestamp"] for e in pages), reverse=True)
+    app.store.flush()
+    reopened = service.TreatsDreamsService.open(str(tmp_path), "json").store
+    assert reopened.activity_logs["alice"] == app.store.activity_logs["alice"]
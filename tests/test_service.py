@@ -0,0 +1,152 @@
+import multiprocessing
+
+import pytest
+
+import service
+
+
+def in_process(target, *args):
+    # Run target in another process, like a second app or CLI instance
+    process = multiprocessing.get_context("fork").Process(target=target, args=args)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+
+def buy(data_dir, backend, user):
+    app = service.TreatsDreamsService.open(data_dir, backend)
+    app.buy_treat(user, app.store.user_banks[user]["treats"][0]["id"])
+    app.buy_dream(user, next(d["id"] for d in app.store.dreams if d["name"] == "Trip"))
+    app.store.flush()
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_stale_catalog_save_keeps_purchases_from_another_process(tmp_path, backend):
+    data_dir = str(tmp_path)
+    app = service.TreatsDreamsService.open(data_dir, backend)
+    app.add_user("alice")
+    run = app.add_activity("Run", 100)
+    app.complete_activity("alice", run["id"])
+    trip = app.add_dream("Trip", 1)
+    treat = app.store.user_banks["alice"]["treats"][0]
+    # Fills the dream bank for the other process's dream purchase
+    app.buy_treat("alice", app.add_treat("alice", "Cake", 10)["id"])
+    points = app.store.user_banks["alice"]["activity_points"]
+
+    in_process(buy, data_dir, backend, "alice")
+    # No sync() first: this copy still shows the treat and dream unbought
+    app.add_activity("Yoga", 5)
+    app.store.flush()
+
+    stored = service.TreatsDreamsService.open(data_dir, backend).store
+    assert stored.treat("alice", treat["id"])["purchased"]
+    assert stored.dream(trip["id"])["purchased_by"] == ["alice"]
+    assert stored.user_banks["alice"]["activity_points"] == points - treat["cost"]
+    assert [a["name"] for a in stored.activities][-2:] == ["Run", "Yoga"]
+    # The stale copy picks up the other process's purchases on its next sync
+    assert app.store.sync()
+    assert app.store.treat("alice", treat["id"])["purchased"]
+    with pytest.raises(ValueError):
+        app.buy_treat("alice", treat["id"])
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite", "memory"])
+def test_deleted_user_added_back_starts_empty(tmp_path, backend):
+    app = service.TreatsDreamsService.open(str(tmp_path), backend)
+    app.add_user("alice")
+    run = app.add_activity("Run", 4)
+    for timestamp in range(1_700_000_000, 1_700_000_005):
+        app.complete_activity("alice", run["id"], timestamp)
+    assert len(app.store.history("alice")) > 0
+
+    app.delete_user("alice")
+    app.add_user("alice")
+    app.store.flush()
+
+    assert app.store.activity_logs["alice"] == []
+    assert len(app.store.history("alice")) == 0
+    assert app.store.user_banks["alice"]["activity_points"] == 0
+    if backend != "memory":
+        stored = service.TreatsDreamsService.open(str(tmp_path), backend).store
+        assert stored.activity_logs.get("alice", []) == []
+        assert stored.user_banks["alice"]["activity_points"] == 0
+
+
+def test_sync_counts_cache_hits_and_reloads(tmp_path):
+    app = service.TreatsDreamsService.open(str(tmp_path), "json")
+    app.add_user("alice")
+    other = service.TreatsDreamsService.open(str(tmp_path), "json")
+
+    assert not app.store.sync()
+    assert not app.store.sync()
+    other.add_user("bob")
+    assert app.store.sync()
+
+    assert app.store.cache_stats() == {"hits": 2, "misses": 1, "hit_rate": 2 / 3}
+
+
+def assert_counters_match_recount(store):
+    for user in store.users:
+        treats = store.user_banks[user]["treats"]
+        assert store.treats_purchased(user) == sum(1 for t in treats if t.get("purchased", False)), user
+        assert store.dreams_purchased(user) == sum(1 for d in store.dreams if user in list(d["purchased_by"])), user
+
+
+@pytest.mark.parametrize("backend", ["json", "memory"])
+def test_purchase_counters_match_a_full_recount(tmp_path, backend):
+    app = service.TreatsDreamsService.open(str(tmp_path), backend)
+    store = app.store
+    for user in ("alice", "bob"):
+        app.add_user(user)
+    run = app.add_activity("Run", 100)
+    dreams = [app.add_dream(name, 10) for name in ("Trip", "Concert", "Boat")]
+    for user in ("alice", "bob"):
+        app.complete_activity(user, run["id"])
+        app.add_treat(user, "Cake", 5)
+        for treat in list(store.user_banks[user]["treats"]):
+            app.buy_treat(user, treat["id"])
+    for user, dream in [("alice", dreams[0]), ("alice", dreams[1]), ("bob", dreams[0])]:
+        app.buy_dream(user, dream["id"])
+    assert (store.treats_purchased("alice"), store.dreams_purchased("alice")) == (2, 2)
+    assert_counters_match_recount(store)
+
+    # Edits keep the purchase, deletes drop it
+    cake = store.user_banks["alice"]["treats"][1]
+    app.edit_treat("alice", cake["id"], "Chocolate cake", 6)
+    app.edit_dream(dreams[0]["id"], "Long trip", 12)
+    assert (store.treats_purchased("alice"), store.dreams_purchased("alice")) == (2, 2)
+    assert_counters_match_recount(store)
+    app.delete_treat("alice", cake["id"])
+    app.delete_dream(dreams[0]["id"])
+    assert (store.treats_purchased("alice"), store.dreams_purchased("alice")) == (1, 1)
+    assert store.dreams_purchased("bob") == 0
+    assert_counters_match_recount(store)
+
+    app.reset_user("alice")
+    app.reset_dream_bank()
+    assert store.treats_purchased("alice") == 0
+    assert_counters_match_recount(store)
+    app.delete_user("bob")
+    app.add_user("bob")
+    assert (store.treats_purchased("bob"), store.dreams_purchased("bob")) == (0, 0)
+    assert_counters_match_recount(store)
+
+    if backend != "memory":
+        store.flush()
+        assert_counters_match_recount(service.TreatsDreamsService.open(str(tmp_path), backend).store)
+
+
+def level_events(points, current_points):
+    events = service.completion_events("alice", {"id": "a1", "points": points}, current_points, 1_700_000_000)
+    assert events[0]["type"] == "complete" and events[0]["points"] == points
+    assert all(e["type"] == "level_bonus" for e in events[1:])
+    assert len({e["id"] for e in events}) == len(events)
+    return [(e["level"], e["points"]) for e in events[1:]], sum(e["points"] for e in events)
+
+
+def test_completion_events_give_a_bonus_per_level_reached():
+    assert level_events(100, 0) == ([(2, 2), (3, 2), (4, 3), (5, 3), (6, 4)], 114)
+    assert level_events(3, 0) == ([], 3)
+    # 18 points reach level 2, and its bonus reaches level 3
+    assert level_events(18, 0) == ([(2, 2), (3, 2)], 22)
+    assert level_events(1, 19) == ([(3, 2)], 3)
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import snapshot
+from storage import JsonStorage
+
+FINGERPRINT = (1, 2, 3)
+
+
+def logs():
+    return {
+        "alice": [
+            {"timestamp": 1_700_000_000, "activity_id": "a1", "points": 10, "id": "0123456789ab"},
+            {"timestamp": 1_700_000_100, "level": 2, "points": 15, "id": "bbbbbbbbbbbb"},
+            {"timestamp": 1_700_000_200, "activity": "Retired", "points": 5},
+            {"timestamp": 1_699_920_000, "activity_id": "a1", "points": 40, "id": "cccccccccccc",
+             "count": 4, "period": "day"}
+        ],
+        "bob": [],
+        "carol": [{"timestamp": 1_700_000_300, "activity_id": "a2", "points": -3, "id": "dddddddddddd"}]
+    }
+
+
+def test_round_trip():
+    assert snapshot.decode(snapshot.encode(logs(), FINGERPRINT), FINGERPRINT) == logs()
+
+
+def test_stale_fingerprint_is_ignored():
+    data = snapshot.encode(logs(), FINGERPRINT)
+    assert snapshot.decode(data, (1, 2, 4)) is None
+    assert snapshot.decode(b"not a snapshot", FINGERPRINT) is None
+
+
+def test_unsupported_entries_are_not_encoded():
+    for entry in (
+        {"timestamp": "2024-01-01 10:00:00", "activity_id": "a1", "points": 10},
+        {"timestamp": 1_700_000_000, "activity_id": "a1", "points": 1.5},
+        {"timestamp": 1_700_000_000, "activity_id": "a1", "points": 10, "note": "extra"},
+        {"timestamp": 1_700_000_000, "activity_id": "a1", "points": 10, "id": "short"}
+    ):
+        assert snapshot.encode({"alice": [entry]}, FINGERPRINT) is None
+
+
+def test_write_and_read_follow_the_source_file(tmp_path):
+    source = tmp_path / "activity.json"
+    path = str(tmp_path / snapshot.SNAPSHOT_FILE_NAME)
+    source.write_text(json.dumps(logs()))
+
+    assert snapshot.write(path, logs(), str(source))
+    assert snapshot.read(path, str(source)) == logs()
+
+    source.write_text(json.dumps({}))
+    assert snapshot.read(path, str(source)) is None
+
+    assert not snapshot.write(path, {"alice": [{"timestamp": "x", "points": 1}]}, str(source))
+    assert not (tmp_path / snapshot.SNAPSHOT_FILE_NAME).exists()
+
+
+def test_json_storage_loads_from_the_snapshot_until_it_is_stale(tmp_path, monkeypatch):
+    bank = {"activities": [], "dreams": [], "dream_bank": 0, "user_banks": {}}
+    JsonStorage(str(tmp_path), binary_snapshot=True, write_behind_ms=0).save_snapshot(bank, logs())
+    store = JsonStorage(str(tmp_path), binary_snapshot=True, write_behind_ms=0)
+    read_json = store._read
+
+    def read(path, default):
+        if path == store.activity_file:
+            pytest.fail("activity.json parsed despite a current snapshot")
+        return read_json(path, default)
+
+    monkeypatch.setattr(store, "_read", read)
+    assert store.load_activity_logs() == logs()
+    monkeypatch.undo()
+
+    # A writer without the binary format leaves the snapshot stale
+    JsonStorage(str(tmp_path), binary_snapshot=False, write_behind_ms=0).save_snapshot(bank, {"bob": []})
+    assert store.load_activity_logs() == {"bob": []}
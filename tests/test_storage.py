@@ -0,0 +1,184 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import journal
+import service
+import state_store
+from storage import JsonStorage, get_storage, json_object_items
+
+
+def bank(points):
+    return {
+        "activities": [{"id": "a1", "name": "Run 5km", "points": 10}],
+        "dreams": [],
+        "dream_bank": 0,
+        "user_banks": {"alice": {"activity_points": points, "treats": []}}
+    }
+
+
+def complete(points):
+    return {"type": "complete", "user": "alice", "activity_id": "a1", "points": points,
+            "timestamp": 1_700_000_000, "id": "l1"}
+
+
+def test_save_bank_keeps_journaled_balances_without_loading_logs(tmp_path, monkeypatch):
+    store = JsonStorage(str(tmp_path), binary_snapshot=False, write_behind_ms=0)
+    store.record_events([], bank(0), {"alice": []})
+    store.record_events([complete(10)], bank(10), {"alice": [journal.log_entry(complete(10))]})
+
+    def load_state():
+        raise AssertionError("catalog save loaded the activity logs")
+
+    monkeypatch.setattr(store, "_load_state", load_state)
+    # A stale session renames the activity and still holds 0 points
+    renamed = bank(0)
+    renamed["activities"][0]["name"] = "Run 10km"
+    store.save_bank(renamed, {})
+    monkeypatch.undo()
+
+    stored_bank, stored_logs = store.load_state()
+    assert stored_bank["activities"][0]["name"] == "Run 10km"
+    assert stored_bank["user_banks"]["alice"]["activity_points"] == 10
+    assert len(stored_logs["alice"]) == 1
+
+
+def test_save_bank_without_pending_events_writes_bank(tmp_path):
+    store = JsonStorage(str(tmp_path), binary_snapshot=False, write_behind_ms=0)
+    store.record_events([], bank(5), {"alice": []})
+    store.save_bank(bank(0), {})
+
+    assert journal.pending_count(store.journal_file, store._snapshot_seq()) == 0
+    assert store.load_bank()["user_banks"]["alice"]["activity_points"] == 5
+
+
+@pytest.mark.parametrize("rewrite", [False, True])
+def test_pending_count_follows_other_processes(tmp_path, rewrite):
+    store = JsonStorage(str(tmp_path), binary_snapshot=False, write_behind_ms=0)
+    other = JsonStorage(str(tmp_path), binary_snapshot=False, write_behind_ms=0)
+    store.record_events([], bank(0), {"alice": []})
+    other.record_events([complete(10)], bank(10), {})
+    with store.lock():
+        assert store._pending() == 1
+    if rewrite:
+        other.save_snapshot(bank(10), {"alice": [journal.log_entry(complete(10))]})
+        with store.lock():
+            assert store._pending() == 0
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_log_chunks_reads_a_time_range_in_order(tmp_path, backend):
+    store = get_storage(str(tmp_path), backend)
+    store.save_users(["alice", "bob"])
+    store.record_events([], bank(0), {})
+    # An import can leave entries out of order
+    timestamps = [1_700_000_500, 1_700_000_100, 1_700_000_300, 1_700_000_200, 1_700_000_400]
+    store.record_events([dict(complete(10), timestamp=t, id=f"entry{t}") for t in timestamps], bank(50), {})
+
+    chunks = list(store.log_chunks(["alice", "bob"], 1_700_000_200, 1_700_000_500, chunk_size=2))
+
+    assert [(user, [entry["timestamp"] for entry in entries]) for user, entries in chunks] == [
+        ("alice", [1_700_000_200, 1_700_000_300]), ("alice", [1_700_000_400])
+    ]
+
+
+
+def test_json_log_chunks_streams_the_logs_and_applies_the_journal(tmp_path, monkeypatch):
+    store = JsonStorage(str(tmp_path), binary_snapshot=False, write_behind_ms=0)
+    logs = {user: [journal.log_entry(dict(complete(1), user=user, id=f"{user}{i}", timestamp=1_700_000_000 + i))
+                   for i in range(5)] for user in ("alice", "bob", "carol")}
+    store.record_events([], bank(0), logs)
+    store.record_events([
+        {"type": "delete_log", "user": "bob", "id": "bob1", "points": 1, "timestamp": 1_700_000_001},
+        dict(complete(1), user="bob", id="bob9", timestamp=1_700_000_009),
+        dict(complete(1), user="dave", id="dave0")
+    ], bank(0), {})
+    expected = store.load_activity_logs()
+
+    def load_state():
+        raise AssertionError("log_chunks loaded every log")
+
+    monkeypatch.setattr(store, "_load_state", load_state)
+    chunks = list(store.log_chunks(["dave", "bob", "alice", "nobody"], 1_700_000_001, chunk_size=2))
+
+    assert [(user, [e["id"] for e in entries]) for user, entries in chunks] == [
+        ("bob", ["bob2", "bob3"]), ("bob", ["bob4", "bob9"]), ("alice", ["alice1", "alice2"]),
+        ("alice", ["alice3", "alice4"])
+    ]
+    everything = [e for _, entries in store.log_chunks(["alice", "bob", "carol", "dave"]) for e in entries]
+    assert everything == [e for user in ("alice", "bob", "carol", "dave") for e in expected[user]]
+
+
+def test_json_object_items_reads_one_value_at_a_time():
+    data = {"alice": [{"points": 12345, "note": "a \"quoted\" } string"}] * 40, "bob": [], "carol": -7.5}
+    text = " \n" + json.dumps(data, indent=2) + "\n"
+    for read_size in (1, 7, 1 << 20):
+        assert list(json_object_items(io.StringIO(text), read_size)) == list(data.items())
+    assert list(json_object_items(io.StringIO("{ }"), 1)) == []
+    for broken in ("[1, 2]", '{"alice": [1, 2]', '{"alice" [1]}', ""):
+        with pytest.raises(ValueError):
+            list(json_object_items(io.StringIO(broken), 3))
+
+def write_behind_app(data_dir, delay_ms):
+    storage = JsonStorage(data_dir, binary_snapshot=False, write_behind_ms=delay_ms)
+    return service.TreatsDreamsService(state_store.StateStore(storage))
+
+
+def test_write_behind_flushes_delayed_writes(tmp_path):
+    app = write_behind_app(str(tmp_path), 50)
+    app.add_user("alice")
+    run = app.add_activity("Run 5km", 10)
+    for timestamp in range(1_700_000_000, 1_700_000_005):
+        app.complete_activity("alice", run["id"], timestamp)
+    storage = app.store.storage
+    with storage.lock():
+        assert storage._pending() > 0
+
+    deadline = time.monotonic() + 5
+    while True:
+        with storage.lock():
+            if not storage._pending():
+                break
+        assert time.monotonic() < deadline, "write-behind flush did not run"
+        time.sleep(0.01)
+
+    stored_bank, stored_logs = JsonStorage(str(tmp_path), binary_snapshot=False, write_behind_ms=0).load_state()
+    assert stored_bank["user_banks"]["alice"] == app.store.user_banks["alice"]
+    assert stored_logs["alice"] == app.store.activity_logs["alice"]
+
+
+def test_write_behind_flushes_at_exit(tmp_path):
+    script = (
+        "import sys; from tests.test_storage import write_behind_app\n"
+        "app = write_behind_app(sys.argv[1], 60_000)\n"
+        "app.add_user('alice')\n"
+        "app.complete_activity('alice', app.add_activity('Run 5km', 3)['id'])\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", script, str(tmp_path)], cwd=root, check=True)
+
+    storage = JsonStorage(str(tmp_path), binary_snapshot=False, write_behind_ms=0)
+    with storage.lock():
+        assert storage._pending() == 0
+    stored_bank, stored_logs = storage.load_state()
+    assert stored_bank["user_banks"]["alice"]["activity_points"] == 3
+    assert len(stored_logs["alice"]) == 1
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_buying_a_dream_twice_records_the_buyer_once(tmp_path, backend):
+    store = get_storage(str(tmp_path), backend)
+    with_dream = dict(bank(0), dreams=[{"id": "d1", "name": "Trip", "cost": 4, "purchased_by": []}], dream_bank=10)
+    store.record_events([], with_dream, {"alice": []})
+    buy = {"type": "buy_dream", "user": "alice", "dream_id": "d1", "cost": 4}
+    # The second purchase comes from a copy that had not seen the first
+    store.record_events([buy], with_dream, {})
+    store.record_events([buy], with_dream, {})
+
+    assert list(store.load_bank()["dreams"][0]["purchased_by"]) == ["alice"]
+    assert list(store.load_state()[0]["dreams"][0]["purchased_by"]) == ["alice"]
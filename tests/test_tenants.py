@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+import service
+import tenants
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_groups_keep_their_data_apart(tmp_path, backend):
+    data_dir = str(tmp_path)
+    default = service.TreatsDreamsService.open(tenants.partition_dir(data_dir, tenants.DEFAULT_GROUP), backend)
+    default.add_user("alice")
+    group = tenants.create_group(data_dir, " Smith Family ")
+    smiths = service.TreatsDreamsService.open(tenants.partition_dir(data_dir, group), backend)
+    smiths.add_user("bob")
+    run = smiths.add_activity("Run 5km", 3)
+    smiths.complete_activity("bob", run["id"])
+    smiths.store.flush()
+    default.store.flush()
+    # Writes to one group's partition are not changes for another group's store
+    assert not default.store.sync()
+
+    assert group == "smith-family"
+    assert tenants.list_groups(data_dir) == ["default", "smith-family"]
+    assert tenants.partition_dir(data_dir, group) == os.path.join(data_dir, "groups", "smith-family")
+    reopened = service.TreatsDreamsService.open(data_dir, backend).store
+    assert reopened.users == ["alice"] and run["id"] not in {a["id"] for a in reopened.activities}
+    reopened_smiths = service.TreatsDreamsService.open(tenants.partition_dir(data_dir, group), backend).store
+    assert reopened_smiths.users == ["bob"]
+    assert reopened_smiths.user_banks["bob"]["activity_points"] == 3
+
+
+def test_group_names_are_checked(tmp_path):
+    tenants.create_group(str(tmp_path), "smiths")
+    for name in ("smiths", "default", "../escape", ""):
+        with pytest.raises(ValueError):
+            tenants.create_group(str(tmp_path), name)
+    with pytest.raises(ValueError):
+        tenants.partition_dir(str(tmp_path), "../escape")
+    assert tenants.list_groups(str(tmp_path)) == ["default", "smiths"]
@@ -0,0 +1,42 @@
+import ui_state
+
+
+def test_prune_drops_stale_edit_slots_and_fields():
+    state = {
+        "editing_activity": "a1",
+        "editing_treat": "t-gone",
+        "editing_dream": None,
+        "edit_activity_name_a1": "Run 10km",
+        "edit_activity_points_a2": 5,
+        "edit_treat_cost_t-gone": 3,
+        "edit_dream_form_d1": True,
+        "add_activity_7": {},
+        "group": "default",
+        1: "not a widget key"
+    }
+
+    removed = ui_state.prune(state, lambda section, record_id: record_id != "t-gone")
+
+    assert removed == 4
+    assert state == {
+        "editing_activity": "a1",
+        "editing_treat": None,
+        "editing_dream": None,
+        "edit_activity_name_a1": "Run 10km",
+        "group": "default",
+        1: "not a widget key"
+    }
+    assert ui_state.prune(state, lambda section, record_id: True) == 0
+
+
+def test_editing_one_record_closes_the_other_form():
+    state = {}
+    ui_state.start_editing(state, "dreams", "d1")
+    state["edit_dream_name_d1"] = "Trip"
+    ui_state.start_editing(state, "dreams", "d2")
+
+    assert ui_state.editing(state, "dreams") == "d2"
+    assert ui_state.prune(state, lambda section, record_id: True) == 1
+    ui_state.stop_editing(state, "dreams")
+    assert ui_state.editing(state, "dreams") is None
+    assert ui_state.size(state)[0] == 1
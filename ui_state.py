@@ -0,0 +1,85 @@
+"""
+Per-session UI state kept in st.session_state, bounded by design.
+
+Each catalog section has one "currently editing" slot holding the id of the
+record whose edit form is open, instead of a flag per record. prune() runs
+at the start of every page run and drops what no longer applies: a slot
+whose record was deleted, the form fields of records not being edited, and
+keys left by older versions of the page. size() reports how much a session
+holds, for the admin panel.
+
+Works on any mutable mapping, so it does not need Streamlit to run.
+"""
+import pickle
+import re
+import sys
+
+# section -> (session key of its editing slot, widget key prefix of its
+# edit form fields)
+EDIT_SLOTS = {
+    "activities": ("editing_activity", "edit_activity_"),
+    "treats": ("editing_treat", "edit_treat_"),
+    "dreams": ("editing_dream", "edit_dream_")
+}
+# Edit form fields: <prefix><field>_<record id>
+FORM_FIELD = re.compile(r"^edit_(activity|treat|dream)_(name|points|cost)_(.+)$")
+# Keys from older versions of the page: per-record edit flags and a new
+# add-activity form key after every add
+LEGACY = re.compile(r"^(edit_(activity|treat|dream)_form_\S+|add_activity_\d+)$")
+_KINDS = {"activity": "activities", "treat": "treats", "dream": "dreams"}
+
+
+def editing(state, section):
+    """
+    Id of the record whose edit form is open in section, or None
+    """
+    return state.get(EDIT_SLOTS[section][0])
+
+
+def start_editing(state, section, record_id):
+    # Opening another record's form closes the previous one
+    state[EDIT_SLOTS[section][0]] = record_id
+
+
+def stop_editing(state, section):
+    state[EDIT_SLOTS[section][0]] = None
+
+
+def prune(state, exists):
+    """
+    Drop stale keys. exists(section, record_id) tells whether a record is
+    still there. Returns the number of keys removed.
+    """
+    stale = []
+    for section, (slot, _) in EDIT_SLOTS.items():
+        record_id = state.get(slot)
+        if record_id is not None and not exists(section, record_id):
+            state[slot] = None
+    for key in list(state.keys()):
+        if not isinstance(key, str):
+            continue
+        if LEGACY.match(key):
+            stale.append(key)
+            continue
+        field = FORM_FIELD.match(key)
+        if field and state.get(EDIT_SLOTS[_KINDS[field.group(1)]][0]) != field.group(3):
+            stale.append(key)
+    for key in stale:
+        del state[key]
+    return len(stale)
+
+
+def size(state):
+    """
+    (keys, approximate bytes) held by a session
+    """
+    total = 0
+    keys = list(state.keys())
+    for key in keys:
+        value = state.get(key)
+        try:
+            total += len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            # Uploaded files and other live objects
+            total += sys.getsizeof(value)
+    return len(keys), total